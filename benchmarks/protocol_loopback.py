@@ -0,0 +1,132 @@
+"""
+Loopback throughput of the wire protocol
+Sends a payload as DATA frames over a TCP connection to 127.0.0.1 and reads
+it back two ways: with FrameReader/recv_payload (recv_into one reused buffer)
+and with a plain recv() loop that allocates new bytes for every read, the way
+a naive reader would. Also times small request/reply round trips.
+
+Run:  python benchmarks/protocol_loopback.py --size 512 --chunk 1
+"""
+
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import (  # noqa: E402
+    DATA, FRAME_HEADER_SIZE, FrameReader, decode_frame, recv_message, recv_payload, send_data,
+    send_message
+)
+
+MB = 1024 * 1024
+
+
+def connected_pair():
+    listener = socket.create_server(("127.0.0.1", 0))
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    for sock in (client, server):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return client, server
+
+
+def send_payload(sock, total, chunk):
+    block = memoryview(os.urandom(chunk))
+    sent = 0
+    while sent < total:
+        n = min(chunk, total - sent)
+        send_message(sock, {"op": "data", "length": n})
+        send_data(sock, block[:n])
+        sent += n
+
+
+def receive_framed(sock, total):
+    """The protocol's own path: recv_into preallocated buffers"""
+    reader = FrameReader(sock)
+    buffer = bytearray(MB)
+    received = 0
+    while received < total:
+        header = recv_message(reader)
+        received += recv_payload(reader, header["length"], lambda view, position: None, buffer=buffer)
+    return received
+
+
+def receive_naive(sock, total):
+    """Baseline: recv() into fresh bytes and join them per frame"""
+    def recv_exactly(n):
+        pieces = []
+        while n:
+            piece = sock.recv(min(n, 256 * 1024))
+            if not piece:
+                raise ConnectionError("Connection closed by peer")
+            pieces.append(piece)
+            n -= len(piece)
+        return b"".join(pieces)
+
+    received = 0
+    while received < total:
+        frame_type, _, length = decode_frame(recv_exactly(FRAME_HEADER_SIZE))
+        payload = recv_exactly(length)
+        if frame_type == DATA:
+            received += len(payload)
+    return received
+
+
+def throughput(receive, total, chunk):
+    client, server = connected_pair()
+    sender = threading.Thread(target=send_payload, args=(client, total, chunk))
+    started = time.perf_counter()
+    sender.start()
+    received = receive(server, total)
+    elapsed = time.perf_counter() - started
+    sender.join()
+    client.close()
+    server.close()
+    assert received == total
+    return total / MB / elapsed
+
+
+def round_trips(count):
+    client, server = connected_pair()
+
+    def echo():
+        reader = FrameReader(server)
+        for _ in range(count):
+            send_message(server, recv_message(reader))
+
+    thread = threading.Thread(target=echo)
+    thread.start()
+    reader = FrameReader(client)
+    started = time.perf_counter()
+    for i in range(count):
+        send_message(client, {"op": "ping", "seq": i})
+        recv_message(reader)
+    elapsed = time.perf_counter() - started
+    thread.join()
+    client.close()
+    server.close()
+    return count / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=512, help="MiB sent per run")
+    parser.add_argument("--chunk", type=int, default=1, help="MiB per message")
+    parser.add_argument("--pings", type=int, default=20000, help="request/reply round trips")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    total, chunk = args.size * MB, args.chunk * MB
+    for name, receive in (("recv_into (FrameReader)", receive_framed), ("recv + join (naive)", receive_naive)):
+        best = max(throughput(receive, total, chunk) for _ in range(args.runs))
+        print(f"{name:<26} {best:8.0f} MB/s")
+    print(f"{'round trips':<26} {round_trips(args.pings):8.0f} /s")
+
+
+if __name__ == "__main__":
+    main()
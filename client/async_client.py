@@ -0,0 +1,359 @@
+"""
+Asyncio client for the CryptPort file server
+Control requests (auth, list, stat, delete) and small transfers on one
+connection, pipelined: each request is written as soon as it is made and a
+single reader task matches the replies, which the server sends in request
+order, to their callers. Listing and deleting together cost one round trip.
+Batches (delete_files, stat_files, rename_files) go out as a few large
+requests written back to back, so thousands of items also cost one round trip.
+
+Files of any size can also be sent and fetched on streams of their own
+(multiplex.py), flow-controlled per stream, so a long transfer shares the
+connection with the requests queued behind it instead of blocking them.
+
+Methods return the same (success, ...) tuples as FileServerClient and never
+raise for server-side errors.
+"""
+
+import asyncio
+import collections
+import json
+import os
+import socket
+import uuid
+
+from client.file_server_client import LIST_PAGE_SIZE, ServerError
+from multiplex import Multiplexer, StreamInterrupted
+from protocol import DEFAULT_PORT, ProtocolError, encode_data, encode_message
+from transfer.integrity import BlockDigest, IntegrityError, check
+from transfer.mapped import read_chunks
+
+SMALL_FILE_LIMIT = 16 * 1024 * 1024   # upload_bytes / download_bytes hold the file in memory
+STREAM_CHUNK = 1024 * 1024            # data message size for uploads on a stream
+BATCH_ITEMS = 500                     # items per batch request (the server takes up to 1000)
+BATCH_BYTES = 32 * 1024               # and no more than this much of them, to fit one message
+
+
+class AsyncFileServerClient:
+    """Pipelined asyncio connection to a CryptPort server"""
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.authenticated = False
+        self.streams = False                 # the server accepts multiplexed streams
+        self._mux = None
+        self._frames_task = None
+        self._reader_task = None
+        self._pending = collections.deque()  # futures waiting for a reply, oldest first
+
+    @property
+    def connected(self) -> bool:
+        return self._mux is not None and not self._frames_task.done()
+
+    # --------------------------------------------------------------------------
+    # Connection
+    # --------------------------------------------------------------------------
+    async def connect(self) -> bool:
+        await self.disconnect()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, int(self.port)),
+                self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._mux = Multiplexer(reader, writer)
+        loop = asyncio.get_running_loop()
+        self._frames_task = loop.create_task(self._mux.run())
+        self._reader_task = loop.create_task(self._read_replies())
+        return True
+
+    async def authenticate(self, username, passkey=""):
+        try:
+            reply = await self.request({"op": "auth", "username": username, "passkey": passkey})
+        except (ServerError, ProtocolError, OSError, asyncio.TimeoutError) as e:
+            return False, str(e) or "Not connected"
+        self.authenticated = True
+        self.streams = "window" in reply
+        return True, "Authenticated"
+
+    async def disconnect(self):
+        mux, self._mux = self._mux, None
+        self.authenticated = False
+        self.streams = False
+        if mux is not None:
+            mux.close()
+            try:
+                await mux.writer.wait_closed()
+            except OSError:
+                pass
+        for task in (self._frames_task, self._reader_task):
+            if task is not None:
+                task.cancel()
+        self._frames_task = self._reader_task = None
+        self._fail_pending(ConnectionError("Disconnected"))
+
+    # --------------------------------------------------------------------------
+    # Remote files
+    # --------------------------------------------------------------------------
+    async def list_files(self):
+        """Every remote file, fetched page by page"""
+        files = []
+        cursor = None
+        try:
+            while True:
+                reply = await self.request({"op": "list", "cursor": cursor, "limit": LIST_PAGE_SIZE})
+                files.extend(reply["files"])
+                cursor = reply.get("next")
+                if not cursor:
+                    break
+        except (ServerError, ProtocolError, OSError, asyncio.TimeoutError) as e:
+            return False, [], str(e)
+        return True, files, f"{len(files)} files"
+
+    async def refresh_listing(self, cache, page_size=LIST_PAGE_SIZE):
+        """Bring a ListingCache up to date; returns (success, changed, message).
+
+        With a cached ETag this is one small request for the changes since,
+        and changed is the list of entries that changed (see ListingCache.apply).
+        Otherwise the listing is fetched page by page and then caught up with
+        whatever changed while the pages were coming in; changed is then True.
+        """
+        try:
+            if cache.etag:
+                reply = await self.request({"op": "list_changes", "since": cache.etag})
+                if not reply.get("reset"):
+                    changed = cache.apply(reply["changes"], reply["etag"])
+                    return True, changed, f"{len(reply['changes'])} changed"
+            files = []
+            cursor = None
+            first_etag = None
+            while True:
+                reply = await self.request({"op": "list", "cursor": cursor, "limit": page_size})
+                first_etag = first_etag or reply.get("etag")
+                files.extend(reply["files"])
+                cursor = reply.get("next")
+                if not cursor:
+                    break
+            cache.replace(files, first_etag)
+            if first_etag and reply["etag"] != first_etag:
+                reply = await self.request({"op": "list_changes", "since": first_etag})
+                if reply.get("reset"):
+                    cache.etag = None  # still settling; the next refresh starts over
+                else:
+                    cache.apply(reply["changes"], reply["etag"])
+        except (ServerError, ProtocolError, OSError, asyncio.TimeoutError, KeyError) as e:
+            return False, False, str(e)
+        return True, True, f"{len(cache)} files"
+
+    async def stat_file(self, filename):
+        try:
+            reply = await self.request({"op": "stat", "name": filename})
+        except (ServerError, ProtocolError, OSError, asyncio.TimeoutError) as e:
+            return False, None, str(e)
+        return True, {"size": reply["size"], "mtime_ns": reply["mtime_ns"]}, filename
+
+    async def delete_file(self, filename):
+        try:
+            await self.request({"op": "delete", "name": filename})
+        except (ServerError, ProtocolError, OSError, asyncio.TimeoutError) as e:
+            return False, str(e)
+        return True, f"Deleted {filename}"
+
+    async def delete_files(self, filenames):
+        """Delete many files; returns (all succeeded, [(name, result)], summary)"""
+        return await self._batch("delete", list(filenames), "Deleted")
+
+    async def stat_files(self, filenames):
+        """Stat many files; each successful result carries size and mtime_ns"""
+        return await self._batch("stat", list(filenames), "Found")
+
+    async def rename_files(self, renames):
+        """Rename many files, given (name, new name) pairs"""
+        return await self._batch("rename", [[old, new] for old, new in renames], "Renamed")
+
+    async def _batch(self, action, items, verb):
+        chunks = list(_batch_chunks(items))
+        replies = await asyncio.gather(
+            *(self.request({"op": "batch", "action": action, "items": chunk}) for chunk in chunks),
+            return_exceptions=True)
+        results = []
+        for chunk, reply in zip(chunks, replies):
+            if isinstance(reply, (ServerError, ProtocolError, OSError, asyncio.TimeoutError)):
+                results.extend((item, {"ok": False, "error": str(reply) or "Not connected"}) for item in chunk)
+            elif isinstance(reply, BaseException):
+                raise reply
+            else:
+                results.extend(zip(chunk, reply["results"]))
+        done = sum(1 for _, result in results if result.get("ok"))
+        message = f"{verb} {done} of {len(items)} files"
+        if done < len(items):
+            first = next(result for _, result in results if not result.get("ok"))
+            message += f"; {len(items) - done} failed ({first.get('error', 'unknown error')})"
+        return done == len(items), results, message
+
+    async def upload_bytes(self, name, data):
+        """Upload a small file held in memory as one pipelined request"""
+        if len(data) > SMALL_FILE_LIMIT:
+            return False, f"{name} is too large for a small upload"
+        digest = BlockDigest()
+        digest.update(data)
+        try:
+            await self.request({"op": "upload_stream", "name": name, "size": len(data), "codec": None},
+                               {"op": "data", "length": len(data)}, data,
+                               {"op": "end", "digest": digest.hexdigest()})
+        except (ServerError, ProtocolError, OSError, asyncio.TimeoutError) as e:
+            return False, str(e)
+        return True, f"Uploaded {name}"
+
+    async def download_bytes(self, filename):
+        """Download a small file into memory; returns (success, data, message)"""
+        ok, info, message = await self.stat_file(filename)
+        if not ok:
+            return False, b"", message
+        if info["size"] > SMALL_FILE_LIMIT:
+            return False, b"", f"{filename} is too large for a small download"
+        try:
+            reply = await self.request({"op": "download", "name": filename, "offset": 0})
+            data = reply.get("payload", b"")
+            digest = BlockDigest()
+            digest.update(data)
+            check(reply.get("digest"), digest.hexdigest(), filename)
+        except (ServerError, ProtocolError, OSError, asyncio.TimeoutError, IntegrityError) as e:
+            return False, b"", str(e)
+        return True, data, f"Downloaded {filename}"
+
+    async def upload_file(self, file_path, remote_name=None, progress_callback=None):
+        """Upload a file of any size on a stream of its own"""
+        name = remote_name or os.path.basename(file_path)
+        if not self.streams:
+            return False, "Server does not support streams"
+        stream = self._mux.open_stream()
+        try:
+            total = os.path.getsize(file_path)
+            await stream.send_message({"op": "upload_stream", "name": name, "size": total, "codec": None})
+            digest = BlockDigest()
+            sent = 0
+            try:
+                with open(file_path, "rb") as f:
+                    for chunk in read_chunks(f, STREAM_CHUNK):
+                        digest.update(chunk)
+                        await stream.send_message({"op": "data", "length": len(chunk)})
+                        await stream.send_data(chunk)
+                        sent += len(chunk)
+                        if progress_callback:
+                            progress_callback(sent, total)
+                await stream.send_message({"op": "end", "digest": digest.hexdigest()})
+            except StreamInterrupted:
+                pass  # the server turned the upload down part-way; its reply says why
+            reply = await asyncio.wait_for(stream.read_message(), self.timeout)
+        except (ProtocolError, OSError, asyncio.TimeoutError) as e:
+            return False, str(e)
+        finally:
+            self._mux.close_stream(stream)
+        if not reply.get("ok"):
+            return False, reply.get("error", "Upload failed")
+        return True, f"Uploaded {name}"
+
+    async def download_file(self, remote_name, local_path, progress_callback=None):
+        """Download a file of any size on a stream of its own.
+
+        The data goes to a temporary file that replaces local_path only once
+        it has passed the integrity check; a failed download leaves nothing.
+        """
+        if not self.streams:
+            return False, "Server does not support streams"
+        stream = self._mux.open_stream()
+        tmp_path = f"{local_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            await stream.send_message({"op": "download", "name": remote_name, "offset": 0})
+            reply = await asyncio.wait_for(stream.read_message(), self.timeout)
+            if not reply.get("ok"):
+                return False, reply.get("error", "Download failed")
+            total = int(reply["length"])
+            digest = BlockDigest()
+            with open(tmp_path, "wb") as out:
+                def sink(data, position):
+                    out.write(data)
+                    digest.update(data)
+                    if progress_callback:
+                        progress_callback(position + len(data), total)
+
+                await stream.read_payload(total, sink)
+            check(reply.get("digest"), digest.hexdigest(), remote_name)
+            os.replace(tmp_path, local_path)
+        except (IntegrityError, ProtocolError, OSError, asyncio.TimeoutError) as e:
+            return False, str(e)
+        finally:
+            self._mux.close_stream(stream)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return True, local_path
+
+    # --------------------------------------------------------------------------
+    # Pipelining
+    # --------------------------------------------------------------------------
+    async def request(self, header, *parts) -> dict:
+        """Send one request and wait for its reply.
+
+        parts follow the header on the wire: raw payload bytes, or further
+        messages (dicts) belonging to the same request. Nothing here waits
+        for earlier replies, so concurrent calls share the round trip.
+        """
+        if not self.connected:
+            raise ConnectionError("Not connected")
+        future = asyncio.get_running_loop().create_future()
+        frames = [encode_message(header)]
+        for part in parts:
+            if isinstance(part, dict):
+                frames.append(encode_message(part))
+            else:
+                frames.extend(encode_data(part))
+        # Written in one step with no await in between, so requests never interleave
+        self._mux.write_nowait(*frames)
+        self._pending.append(future)
+        await self._mux.drain()
+        reply = await asyncio.wait_for(future, self.timeout)
+        if not reply.get("ok"):
+            raise ServerError(reply.get("error", "Request failed"))
+        return reply
+
+    async def _read_replies(self):
+        """Hand each stream 0 reply, with its payload if it has one, to the oldest waiting request"""
+        control = self._mux.control
+        try:
+            while True:
+                reply = await control.read_message()
+                if "length" in reply:
+                    reply["payload"] = await control.read_exact(int(reply["length"]))
+                if not self._pending:
+                    raise ProtocolError("Reply without a request")
+                future = self._pending.popleft()
+                if not future.done():  # its caller may have timed out
+                    future.set_result(reply)
+        except (ConnectionError, ProtocolError, OSError) as e:
+            self._fail_pending(e)
+
+    def _fail_pending(self, error):
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+
+def _batch_chunks(items):
+    """Split items into request-sized chunks, by count and by encoded size"""
+    chunk, size = [], 0
+    for item in items:
+        item_size = len(json.dumps(item)) + 1
+        if chunk and (len(chunk) == BATCH_ITEMS or size + item_size > BATCH_BYTES):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(item)
+        size += item_size
+    if chunk:
+        yield chunk
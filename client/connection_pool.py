@@ -0,0 +1,189 @@
+"""
+Connection pool for CryptPort clients
+Keeps authenticated server connections warm per (host, port, user) so that a
+reconnect or an extra transfer stream skips the TCP and auth handshakes.
+
+- idle connections are closed after idle_timeout seconds
+- a connection is checked before reuse: a cheap peek always, and a ping
+  round trip when it has been idle for more than check_after seconds
+- at most max_size connections (busy + idle) exist per key; acquire waits
+  for one to come back when the limit is reached
+- a connection is only handed to callers presenting the passkey it was
+  authenticated with
+"""
+
+import hashlib
+import hmac
+import socket
+import threading
+import time
+
+DEFAULT_MAX_SIZE = 8
+IDLE_TIMEOUT = 60.0
+CHECK_AFTER = 15.0
+
+
+def pool_key(host, port, username):
+    return (str(host), int(port), str(username))
+
+
+def _fingerprint(passkey) -> bytes:
+    return hashlib.sha256(str(passkey).encode("utf-8")).digest()
+
+
+class _Idle:
+    def __init__(self, session, credential, since):
+        self.session = session
+        self.credential = credential
+        self.since = since
+
+
+class ConnectionPool:
+    """Thread-safe pool of authenticated sessions"""
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, idle_timeout=IDLE_TIMEOUT,
+                 check_after=CHECK_AFTER, clock=time.monotonic):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.idle = {}      # key -> [_Idle, ...], most recently used last
+        self.busy = {}      # key -> number of sessions handed out
+        self.owners = {}    # session -> (key, credential) for every session out of the pool
+
+    def acquire(self, key, passkey, factory, timeout=30.0):
+        """Return a warm session for key, or a new one from factory()"""
+        credential = _fingerprint(passkey)
+        deadline = self.clock() + timeout
+        while True:
+            entry = self._reserve(key, credential, deadline)
+            if entry is None:
+                try:
+                    session = factory()
+                except BaseException:
+                    self._unreserve(key)
+                    raise
+                with self.condition:
+                    self.owners[session] = (key, credential)
+                return session
+            if self._healthy(entry):
+                with self.condition:
+                    self.owners[entry.session] = (key, credential)
+                return entry.session
+            entry.session.close()
+            self._unreserve(key)
+
+    def adopt(self, session, key, passkey):
+        """Count a session authenticated elsewhere as handed out, so release() can keep it"""
+        with self.condition:
+            self.busy[key] = self.busy.get(key, 0) + 1
+            self.owners[session] = (key, _fingerprint(passkey))
+
+    def release(self, session):
+        """Give back a session that finished its last request cleanly"""
+        with self.condition:
+            owner = self.owners.pop(session, None)
+            if owner is None:
+                session.close()
+                return
+            key, credential = owner
+            self._decrement(key)
+            self.idle.setdefault(key, []).append(_Idle(session, credential, self.clock()))
+            self._prune()
+            self.condition.notify_all()
+
+    def discard(self, session):
+        """Close a session whose state is unknown (e.g. a request failed part-way)"""
+        session.close()
+        with self.condition:
+            owner = self.owners.pop(session, None)
+            if owner is not None:
+                self._decrement(owner[0])
+                self.condition.notify_all()
+
+    def clear(self, username=None):
+        """Close idle sessions, all of them or just one user's (e.g. on logout)"""
+        with self.condition:
+            for key in list(self.idle):
+                if username is None or key[2] == username:
+                    for entry in self.idle.pop(key):
+                        entry.session.close()
+            self.condition.notify_all()
+
+    def idle_count(self, key=None) -> int:
+        with self.condition:
+            if key is not None:
+                return len(self.idle.get(key, []))
+            return sum(len(entries) for entries in self.idle.values())
+
+    # --------------------------------------------------------------------------
+    # Internals
+    # --------------------------------------------------------------------------
+    def _reserve(self, key, credential, deadline):
+        """Take an idle entry (or None: the caller may open a new session) and count it busy"""
+        with self.condition:
+            while True:
+                self._prune()
+                entries = self.idle.get(key, [])
+                for i in range(len(entries) - 1, -1, -1):
+                    if hmac.compare_digest(entries[i].credential, credential):
+                        self.busy[key] = self.busy.get(key, 0) + 1
+                        return entries.pop(i)
+                if self.busy.get(key, 0) + len(entries) < self.max_size:
+                    self.busy[key] = self.busy.get(key, 0) + 1
+                    return None
+                if entries:
+                    entries.pop(0).session.close()  # someone else's credential: make room
+                    continue
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    raise ConnectionError(f"All {self.max_size} connections to {key[0]}:{key[1]} are busy")
+                self.condition.wait(remaining)
+
+    def _unreserve(self, key):
+        with self.condition:
+            self._decrement(key)
+            self.condition.notify_all()
+
+    def _decrement(self, key):
+        self.busy[key] = self.busy.get(key, 1) - 1
+        if not self.busy[key]:
+            del self.busy[key]
+
+    def _prune(self):
+        now = self.clock()
+        for key in list(self.idle):
+            entries = self.idle[key]
+            while entries and now - entries[0].since > self.idle_timeout:
+                entries.pop(0).session.close()
+            if not entries:
+                del self.idle[key]
+
+    def _healthy(self, entry) -> bool:
+        """Peek for a closed or out-of-sync socket; ping if it has been quiet a while"""
+        sock = entry.session.sock
+        if entry.session.reader.buffered:
+            return False  # unread reply bytes: the conversation is out of step
+        timeout = sock.gettimeout()
+        try:
+            sock.settimeout(0)  # with a timeout set, recv would wait for data first
+            if sock.recv(1, socket.MSG_PEEK):
+                return False  # unread bytes: the conversation is out of step
+            return False      # b"": the server closed it
+        except BlockingIOError:
+            pass              # nothing to read: still open
+        except OSError:
+            return False
+        finally:
+            try:
+                sock.settimeout(timeout)
+            except OSError:
+                pass
+        if self.clock() - entry.since <= self.check_after:
+            return True
+        try:
+            entry.session.request({"op": "ping"})
+        except Exception:
+            return False
+        return True
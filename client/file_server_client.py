@@ -0,0 +1,758 @@
+"""
+Client for the CryptPort file server
+Blocking API used from transfer worker threads: every method returns
+(success, message) or (success, data, message) and never raises for
+server-side errors.
+
+Large uploads are split into byte ranges and sent over several connections
+at once; the server writes each range in place, so order does not matter.
+
+Every transfer carries a transfer.integrity digest computed from the data as
+it is sent or received, and the receiving side rejects a mismatch.
+
+With a ConnectionPool, connections that end cleanly are kept warm for the
+next transfer or reconnect instead of being closed.
+
+After a network drop, resume() reconnects with the server's resumption ticket
+instead of logging in again. Range uploads and downloads survive a drop: they
+resume the session and carry on from the ranges or checkpoint already stored.
+With a resume_dir, the id of an unfinished range upload is also noted on disk,
+so uploading the same unchanged file again in a later session only sends the
+ranges the server is still missing.
+
+With a transfer.keys.KeyCache, uploads are encrypted as they stream (transfer.crypto) and
+downloads are decrypted as they arrive; the server only ever sees ciphertext
+and no encrypted copy is written on the client.
+"""
+
+import itertools
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from client.connection_pool import pool_key
+from protocol import (
+    DEFAULT_PORT, FrameReader, ProtocolError, enable_keepalive, recv_exact, recv_message,
+    recv_payload, send_data, send_file_range, send_message
+)
+from transfer.checkpoint import Checkpoint, ResumeRecords, local_source_id
+from transfer.archive import DirectoryArchive
+from transfer.compression import choose_codec, compress_stream, default_codec_name
+from transfer.crypto import (
+    ENCRYPTED_SUFFIX, CryptoError, DecryptingWriter, EncryptingReader, encrypted_size
+)
+from transfer.mapped import mapped_view, read_chunks
+from transfer.delta import COPY, DELTA_MIN_SIZE, MAX_LITERAL_RATIO, Signature, compute_delta, probe
+from transfer.integrity import (
+    BLOCK_SIZE, BlockDigest, HashingReader, IntegrityError, block_hash, check
+)
+
+DEFAULT_STREAMS = 4
+PARALLEL_THRESHOLD = 32 * 1024 * 1024   # smaller files go over a single stream
+SLICE_SIZE = BLOCK_SIZE                 # bytes per upload_range message: one hashed block
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+HEARTBEAT_INTERVAL = 5.0                # idle seconds before the control connection is pinged
+HEARTBEAT_TIMEOUT = 5.0                 # an unanswered heartbeat means the connection is gone
+RESUME_ATTEMPTS = 3                     # reconnects a transfer tries before giving up
+LIST_PAGE_SIZE = 500                    # entries asked for per listing page; the server may send fewer
+_DROPPED = (ConnectionError, TimeoutError)  # failures a reconnect can fix
+
+
+class ServerError(Exception):
+    """The server answered a request with ok=false"""
+
+
+class _Session:
+    """One authenticated connection"""
+
+    def __init__(self, host, port, timeout, connect_timeout=None):
+        self.sock = socket.create_connection((host, port), timeout=connect_timeout or timeout)
+        self.sock.settimeout(timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+            self.sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER_SIZE)
+        enable_keepalive(self.sock)
+        self.reader = FrameReader(self.sock)
+
+    def request(self, header) -> dict:
+        send_message(self.sock, header)
+        return self.read_reply()
+
+    def read_reply(self) -> dict:
+        reply = recv_message(self.reader)
+        if not reply.get("ok"):
+            raise ServerError(reply.get("error", "Request failed"))
+        return reply
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class FileServerClient:
+    """Connection to a CryptPort server"""
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, streams=DEFAULT_STREAMS, timeout=30,
+                 pool=None, resume_dir=None):
+        self.host = host
+        self.port = port
+        self.streams = streams
+        self.timeout = timeout
+        self.pool = pool
+        self.resume_records = ResumeRecords(resume_dir) if resume_dir else None
+        self.socket = None
+        self.authenticated = False
+        self.ticket = None             # resumption ticket from the last auth or resume
+        self.last_activity = 0.0       # time.monotonic() of the last reply on the control connection
+        self._session = None
+        self._credentials = None
+        self._lock = threading.Lock()  # the control connection serves one request at a time
+
+    # --------------------------------------------------------------------------
+    # Connection
+    # --------------------------------------------------------------------------
+    def connect(self) -> bool:
+        self.disconnect()
+        try:
+            self._session = _Session(self.host, int(self.port), self.timeout)
+        except OSError:
+            return False
+        self.socket = self._session.sock
+        return True
+
+    def authenticate(self, username, passkey=""):
+        try:
+            with self._lock:
+                reply = self._session.request({"op": "auth", "username": username, "passkey": passkey})
+        except (ServerError, ProtocolError, OSError, AttributeError) as e:
+            return False, str(e) or "Not connected"
+        self._credentials = (username, passkey)
+        self.ticket = reply.get("ticket")
+        self.last_activity = time.monotonic()
+        self.authenticated = True
+        if self.pool:
+            self.pool.adopt(self._session, self._pool_key(), passkey)
+        return True, "Authenticated"
+
+    def login(self, username, passkey=""):
+        """connect() + authenticate(), reusing a warm pooled connection when there is one"""
+        if not self.pool:
+            if not self.connect():
+                return False, "Failed to connect to server"
+            return self.authenticate(username, passkey)
+        self.disconnect()
+        self._credentials = (username, passkey)
+        try:
+            self._session = self._open_session()
+        except (ServerError, ProtocolError, OSError) as e:
+            self._credentials = None
+            return False, str(e)
+        self.socket = self._session.sock
+        self.last_activity = time.monotonic()
+        self.authenticated = True
+        return True, "Authenticated"
+
+    def ping(self, timeout=HEARTBEAT_TIMEOUT):
+        """Heartbeat round trip on the control connection; returns (success, message)"""
+        if not self._lock.acquire(timeout=timeout):
+            return True, "Busy"  # a request is using the connection right now
+        try:
+            if not self._session:
+                return False, "Not connected"
+            sock = self._session.sock
+            start = time.monotonic()
+            sock.settimeout(timeout)
+            try:
+                self._session.request({"op": "ping"})
+            finally:
+                sock.settimeout(self.timeout)
+        except (ServerError, ProtocolError, OSError) as e:
+            return False, str(e) or "Heartbeat failed"
+        finally:
+            self._lock.release()
+        self.last_activity = time.monotonic()
+        return True, f"{(self.last_activity - start) * 1000:.0f} ms"
+
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_activity
+
+    def interrupt(self):
+        """Shut the control connection down from another thread, without its lock.
+
+        A login, ping or request blocked on it fails at once, as on a drop.
+        """
+        sock = self.socket
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def resume(self):
+        """Reconnect after a drop, presenting the resumption ticket instead of the credentials"""
+        if self._credentials is None:
+            return False, "Not logged in"
+        with self._lock:
+            if self._session:
+                if self.pool and self.authenticated:
+                    self.pool.discard(self._session)
+                else:
+                    self._session.close()
+            self._session = None
+            self.socket = None
+            self.authenticated = False
+            try:
+                # A host that does not answer quickly is still unreachable; let the caller retry
+                session = _Session(self.host, int(self.port), self.timeout, HEARTBEAT_TIMEOUT)
+            except OSError as e:
+                return False, str(e)
+            try:
+                resumed = self._authenticate_session(session)
+            except (ServerError, ProtocolError, OSError) as e:
+                session.close()
+                return False, str(e)
+            self._session = session
+            self.socket = session.sock
+            self.last_activity = time.monotonic()
+            self.authenticated = True
+        if self.pool:
+            self.pool.adopt(session, self._pool_key(), self._credentials[1])
+        return True, "Session resumed" if resumed else "Reconnected"
+
+    def disconnect(self):
+        """Drop the control connection; a pooled, authenticated one stays warm"""
+        with self._lock:
+            if self._session:
+                if self.pool and self.authenticated:
+                    self.pool.release(self._session)
+                else:
+                    self._session.close()
+            self._session = None
+            self.socket = None
+            self.authenticated = False
+            self.ticket = None
+
+    # --------------------------------------------------------------------------
+    # Remote files
+    # --------------------------------------------------------------------------
+    def list_files(self):
+        """Every remote file, fetched page by page"""
+        files = []
+        cursor = None
+        try:
+            while True:
+                reply = self._request({"op": "list", "cursor": cursor, "limit": LIST_PAGE_SIZE})
+                files.extend(reply["files"])
+                cursor = reply.get("next")
+                if not cursor:
+                    break
+        except (ServerError, ProtocolError, OSError) as e:
+            return False, [], str(e)
+        return True, files, f"{len(files)} files"
+
+    def delete_file(self, filename):
+        try:
+            self._request({"op": "delete", "name": filename})
+        except (ServerError, ProtocolError, OSError) as e:
+            return False, str(e)
+        return True, f"Deleted {filename}"
+
+    # --------------------------------------------------------------------------
+    # Transfers
+    # --------------------------------------------------------------------------
+    def upload_file(self, file_path, progress_callback=None, remote_name=None, streams=None,
+                    delta=True, compression="auto", keys=None):
+        """Upload a file, in parallel byte ranges when it is large enough.
+
+        With delta on and an older copy already on the server, only changed
+        blocks are sent, unless the start of the file shows the two are
+        mostly different. compression is a codec name, 'auto' (compress only
+        files that sample as compressible) or None. With keys (a KeyCache) the file
+        is encrypted on the fly and stored as '<name>.cpx'.
+        """
+        name = remote_name or os.path.basename(file_path)
+        size = os.path.getsize(file_path)
+        if keys:
+            return self._encrypted_upload(file_path, remote_name or name + ENCRYPTED_SUFFIX, size,
+                                          keys, progress_callback)
+        streams = max(1, streams or self.streams)
+        if size < PARALLEL_THRESHOLD:
+            streams = 1
+
+        if delta and size >= DELTA_MIN_SIZE:
+            try:
+                remote = self._request({"op": "stat", "name": name})
+            except ServerError:
+                remote = None  # nothing to diff against
+            except (ProtocolError, OSError) as e:
+                return False, str(e)
+            if remote and remote["size"] >= DELTA_MIN_SIZE:
+                result = self._delta_upload(file_path, name, size, progress_callback)
+                if result is not None:
+                    return result
+
+        codec = choose_codec(file_path) if compression == "auto" else compression
+        if codec:
+            return self._compressed_upload(file_path, name, size, codec, progress_callback)
+
+        progress = _SharedProgress(size, progress_callback)
+        # One slot per slice up front, so the stream threads only ever assign
+        digest = BlockDigest(SLICE_SIZE, [None] * -(-size // SLICE_SIZE))
+        ranges = split_ranges(size, streams) if streams > 1 else [(0, size)]
+        key = self._upload_key(file_path, name)
+        try:
+            resumed = self._resume_upload(key, file_path, digest)
+            if resumed:
+                upload_id, ranges = resumed
+                progress.restart(size - sum(length for _, length in ranges))
+            else:
+                upload_id = self._request({"op": "upload_open", "name": name, "size": size})["upload_id"]
+                if key:
+                    self.resume_records.save(key, upload_id)
+        except (ServerError, ProtocolError, OSError) as e:
+            return False, str(e)
+
+        try:
+            for attempt in range(RESUME_ATTEMPTS + 1):
+                try:
+                    self._send_ranges(upload_id, file_path, ranges, streams, progress, digest)
+                    break
+                except _DROPPED:
+                    if attempt == RESUME_ATTEMPTS or not self.resume()[0]:
+                        raise
+                # The ranges the server already has are kept; send only the rest
+                ranges = self._missing_ranges(upload_id)
+                progress.restart(size - sum(length for _, length in ranges))
+            self._request({"op": "upload_commit", "upload_id": upload_id,
+                           "digest": digest.hexdigest()})
+        except BaseException as e:
+            if key is None or isinstance(e, ServerError):
+                self._abort_upload(upload_id)
+                self._forget_upload(key)
+            # otherwise the server keeps what it has for the next attempt
+            if isinstance(e, (ServerError, ProtocolError, OSError)):
+                return False, str(e)
+            raise
+        self._forget_upload(key)
+        progress.finish()
+        return True, f"Uploaded {name}"
+
+    def download_file(self, filename, save_path, progress_callback=None, keys=None):
+        """Download into save_path, resuming a previous partial download if one matches.
+
+        A connection drop part-way resumes the session and continues from the
+        checkpoint, up to RESUME_ATTEMPTS times. With keys the file is
+        decrypted as it arrives.
+        """
+        if keys:
+            return self._decrypted_download(filename, save_path, keys, progress_callback)
+        for attempt in range(RESUME_ATTEMPTS + 1):
+            try:
+                return self._download(filename, save_path, progress_callback)
+            except _DROPPED as e:
+                if attempt == RESUME_ATTEMPTS:
+                    return False, str(e)
+                resumed, message = self.resume()
+                if not resumed:
+                    return False, f"{e} (reconnect failed: {message})"
+
+    def _decrypted_download(self, filename, save_path, keys, progress_callback):
+        """Decrypt while receiving; save_path only appears once every chunk authenticated.
+
+        The decryptor keeps its place across a drop, so a resumed session
+        asks for the rest of the file from the bytes it already has.
+        """
+        tmp_path = f"{save_path}.part"
+        try:
+            info = self._request({"op": "stat", "name": filename})
+            version = (info["size"], info["mtime_ns"])
+            with open(tmp_path, "wb") as out:
+                writer = DecryptingWriter(out, keys.decryptor())
+                for attempt in range(RESUME_ATTEMPTS + 1):
+                    try:
+                        self._receive(filename, writer, version, progress_callback)
+                        break
+                    except _DROPPED as e:
+                        if attempt == RESUME_ATTEMPTS or not self.resume()[0]:
+                            raise
+                writer.finish()
+            os.replace(tmp_path, save_path)
+        except (ServerError, ProtocolError, OSError, CryptoError) as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False, str(e)
+        return True, save_path
+
+    def _receive(self, filename, writer, version, progress_callback):
+        """Feed the file from writer.received onwards into writer"""
+        info = self._request({"op": "stat", "name": filename})
+        if version != (info["size"], info["mtime_ns"]):
+            raise ServerError("File changed on the server during download")
+        size = info["size"]
+        with self._bulk_session() as session:
+            reply = session.request({"op": "download", "name": filename, "offset": writer.received})
+            if reply["size"] != size:
+                raise ServerError("File changed on the server during download")
+
+            def sink(view, position):
+                writer.write(view)
+                if progress_callback:
+                    progress_callback(writer.received, size)
+
+            recv_payload(session.reader, reply["length"], sink)
+
+    def _download(self, filename, save_path, progress_callback):
+        try:
+            info = self._request({"op": "stat", "name": filename})
+            size = info["size"]
+            checkpoint = Checkpoint.open(save_path, f"{size}:{info['mtime_ns']}", size)
+            offset = checkpoint.offset
+            with self._bulk_session() as session:
+                reply = session.request({"op": "download", "name": filename, "offset": offset})
+                if reply["size"] != size:
+                    raise ServerError("File changed on the server during download")
+
+                mode = "r+b" if os.path.exists(checkpoint.part_path) else "wb"
+                with open(checkpoint.part_path, mode) as out:
+                    out.truncate(offset)
+                    out.seek(offset)
+
+                    def sink(view, position):
+                        out.write(view)
+                        checkpoint.update(view)
+                        if progress_callback:
+                            progress_callback(offset + position + len(view), size)
+
+                    try:
+                        recv_payload(session.reader, reply["length"], sink)
+                    except BaseException:
+                        out.flush()
+                        os.fsync(out.fileno())
+                        checkpoint.save()
+                        raise
+            try:
+                check(reply.get("digest"), checkpoint.hexdigest(), filename)
+            except IntegrityError:
+                checkpoint.discard()  # a resume would keep the bad blocks
+                raise
+            checkpoint.finish()
+        except _DROPPED:
+            raise
+        except (ServerError, ProtocolError, OSError, IntegrityError) as e:
+            return False, str(e)
+        if progress_callback and size == 0:
+            progress_callback(0, 0)
+        return True, save_path
+
+    # --------------------------------------------------------------------------
+    # Internals
+    # --------------------------------------------------------------------------
+    def _request(self, header) -> dict:
+        if not self._session:
+            raise ConnectionError("Not connected")
+        with self._lock:
+            reply = self._session.request(header)
+        self.last_activity = time.monotonic()
+        return reply
+
+    def _pool_key(self):
+        return pool_key(self.host, self.port, (self._credentials or ("", ""))[0])
+
+    def _open_session(self) -> _Session:
+        """Authenticated connection: a warm one from the pool, or a new one"""
+        if self.pool:
+            passkey = (self._credentials or ("", ""))[1]
+            return self.pool.acquire(self._pool_key(), passkey, self._new_session, self.timeout)
+        return self._new_session()
+
+    def _new_session(self) -> _Session:
+        session = _Session(self.host, int(self.port), self.timeout)
+        try:
+            self._authenticate_session(session)
+        except BaseException:
+            session.close()
+            raise
+        return session
+
+    def _authenticate_session(self, session) -> bool:
+        """Authenticate a new connection, with the resumption ticket when there is one.
+
+        Returns True if the ticket was accepted, False if it took a full login.
+        """
+        if self.ticket:
+            try:
+                self.ticket = session.request({"op": "resume", "ticket": self.ticket}).get("ticket")
+                return True
+            except ServerError:
+                self.ticket = None  # expired: fall back to the credentials
+        username, passkey = self._credentials or ("", "")
+        reply = session.request({"op": "auth", "username": username, "passkey": passkey})
+        self.ticket = reply.get("ticket")
+        return False
+
+    @contextmanager
+    def _bulk_session(self):
+        """Extra connection for bulk data; back to the pool only if used without error"""
+        session = self._open_session()
+        try:
+            yield session
+        except BaseException:
+            if self.pool:
+                self.pool.discard(session)
+            else:
+                session.close()
+            raise
+        if self.pool:
+            self.pool.release(session)
+        else:
+            session.close()
+
+    def _send_ranges(self, upload_id, file_path, ranges, streams, progress, digest):
+        if streams == 1:
+            with self._lock:
+                for byte_range in ranges:
+                    self._send_range(self._session, upload_id, file_path, *byte_range,
+                                     progress, digest)
+        else:
+            self._parallel_upload(upload_id, file_path, ranges, progress, digest, streams)
+
+    def _upload_key(self, file_path, name):
+        """Identity of a range upload for resume_records, or None when they are off"""
+        if self.resume_records is None:
+            return None
+        user = self._credentials[0] if self._credentials else ""
+        return (f"{self.host}:{self.port}:{user}:{name}:"
+                f"{os.path.abspath(file_path)}:{local_source_id(file_path)}")
+
+    def _resume_upload(self, key, file_path, digest):
+        """(upload_id, missing ranges) of an unfinished upload noted under key, or None.
+
+        The block hashes of the slices the server already holds died with the
+        interrupted attempt, so they are taken again from the local file.
+        """
+        upload_id = self.resume_records.load(key) if key else None
+        if not upload_id:
+            return None
+        try:
+            missing = self._missing_ranges(upload_id)
+        except ServerError:
+            self._forget_upload(key)  # expired, or the server restarted
+            return None
+        _hash_received(file_path, missing, digest)
+        return upload_id, missing
+
+    def _forget_upload(self, key):
+        if key:
+            self.resume_records.remove(key)
+
+    def _missing_ranges(self, upload_id):
+        """Gaps between the ranges the server holds for an upload, as (offset, length)"""
+        status = self._request({"op": "upload_status", "upload_id": upload_id})
+        missing = []
+        position = 0
+        for offset, length in status["received"]:
+            if offset > position:
+                missing.append((position, offset - position))
+            position = offset + length
+        if position < status["size"]:
+            missing.append((position, status["size"] - position))
+        return missing
+
+    def _parallel_upload(self, upload_id, file_path, ranges, progress, digest, streams=None):
+        def send(byte_range):
+            try:
+                with self._bulk_session() as session:
+                    self._send_range(session, upload_id, file_path, *byte_range, progress, digest)
+            except BaseException:
+                progress.stopped.set()  # no point finishing the other ranges
+                raise
+
+        with ThreadPoolExecutor(max_workers=min(len(ranges), streams or len(ranges))) as executor:
+            futures = [executor.submit(send, byte_range) for byte_range in ranges]
+            for future in futures:
+                future.result()  # re-raises the first failure
+
+    @staticmethod
+    def _send_range(session, upload_id, file_path, start, length, progress, digest):
+        """Stream [start, start+length) with sendfile, one slice per message.
+
+        Each slice is hashed through a memory map first, so sendfile then finds
+        it in the page cache and the hash costs no extra disk read.
+        """
+        position = start
+        end = start + length
+        with open(file_path, "rb") as f, mapped_view(f) as view:
+            while True:
+                if progress.stopped.is_set():
+                    raise ConnectionAbortedError("Upload stopped")
+                count = min(SLICE_SIZE, end - position)
+                header = {"op": "upload_range", "upload_id": upload_id,
+                          "offset": position, "length": count}
+                if count:
+                    header["digest"] = block_hash(view[position:position + count])
+                    digest.set_block(position // SLICE_SIZE, header["digest"])
+                send_message(session.sock, header)
+                if count:
+                    send_file_range(session.sock, f, position, count)
+                session.read_reply()
+                position += count
+                progress.add(count)
+                if position >= end:
+                    break
+
+    def _delta_upload(self, file_path, name, size, progress_callback):
+        """Send only what changed relative to the server's copy of name.
+
+        Returns None, having sent nothing, when the first PROBE_SIZE bytes
+        are mostly literal: against an unrelated copy the single-stream,
+        pure-Python diff is much slower than a plain upload.
+        """
+        literal = 0
+        try:
+            with self._bulk_session() as session:
+                info = session.request({"op": "signature", "name": name})
+                data = bytearray(info["length"])
+                recv_exact(session.reader, memoryview(data))
+                signature = Signature.from_bytes(info["block_size"], info["size"], bytes(data))
+
+                digest = BlockDigest()
+                with open(file_path, "rb") as src:
+                    operations = compute_delta(HashingReader(src, digest), signature,
+                                               progress_callback, size)
+                    first, ratio = probe(operations, signature.block_size)
+                    if ratio > MAX_LITERAL_RATIO:
+                        return None
+                    send_message(session.sock, {"op": "upload_delta", "name": name, "basis": name,
+                                                "size": size, "block_size": signature.block_size})
+                    for op in itertools.chain(first, operations):
+                        if op[0] == COPY:
+                            send_message(session.sock, {"op": "copy", "block": op[1], "count": op[2]})
+                        else:
+                            send_message(session.sock, {"op": "data", "length": len(op[1])})
+                            send_data(session.sock, op[1])
+                            literal += len(op[1])
+                send_message(session.sock, {"op": "end", "digest": digest.hexdigest()})
+                session.read_reply()
+        except (ServerError, ProtocolError, OSError) as e:
+            return False, str(e)
+        return True, f"Uploaded {name} (delta: sent {literal} of {size} bytes)"
+
+    def upload_directory(self, dir_path, progress_callback=None, compression="auto"):
+        """Send a whole directory tree as one tar stream, stored as '<dir>.tar'"""
+        name = os.path.basename(os.path.normpath(dir_path)) + ".tar"
+        codec = default_codec_name() if compression == "auto" else compression
+        with DirectoryArchive(dir_path) as archive:
+            return self._stream_upload(archive, name, None, codec, progress_callback)
+
+    def _encrypted_upload(self, file_path, name, size, keys, progress_callback):
+        """Single stream, encrypted on the fly; ciphertext neither diffs nor compresses"""
+        try:
+            encryptor = keys.encryptor()
+        except CryptoError as e:
+            return False, str(e)
+        with open(file_path, "rb") as src, EncryptingReader(src, encryptor) as reader:
+            return self._stream_upload(reader, name, encrypted_size(size), None, progress_callback)
+
+    def _compressed_upload(self, file_path, name, size, codec, progress_callback):
+        """Single stream, compressed on the fly; the server stores it decompressed"""
+        with open(file_path, "rb") as src:
+            return self._stream_upload(src, name, size, codec, progress_callback)
+
+    def _stream_upload(self, src, name, size, codec, progress_callback):
+        """Send src as data messages on a dedicated connection"""
+        sent = 0
+        try:
+            with self._bulk_session() as session:
+                send_message(session.sock, {"op": "upload_stream", "name": name,
+                                            "size": size, "codec": codec})
+                digest = BlockDigest()
+                if codec:
+                    pieces = compress_stream(codec, src, progress_callback=progress_callback,
+                                             total=size, digest=digest)
+                else:
+                    pieces = _plain_stream(src, progress_callback, size, digest=digest)
+                for piece in pieces:
+                    send_message(session.sock, {"op": "data", "length": len(piece)})
+                    send_data(session.sock, piece)
+                    sent += len(piece)
+                send_message(session.sock, {"op": "end", "digest": digest.hexdigest()})
+                session.read_reply()
+        except (ServerError, ProtocolError, OSError) as e:
+            return False, str(e)
+        if progress_callback and size == 0:
+            progress_callback(0, 0)
+        if codec:
+            return True, f"Uploaded {name} ({codec}: sent {sent} bytes)"
+        return True, f"Uploaded {name}"
+
+    def _abort_upload(self, upload_id):
+        try:
+            self._request({"op": "upload_abort", "upload_id": upload_id})
+        except (ServerError, ProtocolError, OSError):
+            pass
+
+
+class _SharedProgress:
+    """Sums progress from several stream threads into one callback"""
+
+    def __init__(self, total, callback):
+        self.total = total
+        self.done = 0
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def add(self, count):
+        if not self.callback:
+            return
+        with self.lock:
+            self.done += count
+            self.callback(self.done, self.total)
+
+    def restart(self, done):
+        """Carry on after a reconnect, with done bytes already safely on the server"""
+        with self.lock:
+            self.done = done
+        self.stopped.clear()
+
+    def finish(self):
+        if self.callback and self.total == 0:
+            self.callback(0, 0)
+
+
+def _plain_stream(src, progress_callback, total, chunk_size=1024 * 1024, digest=None):
+    done = 0
+    for piece in read_chunks(src, chunk_size):
+        done += len(piece)
+        if digest:
+            digest.update(piece)
+        yield piece
+        if progress_callback:
+            progress_callback(done, total)
+
+
+def _hash_received(file_path, missing, digest):
+    """Set the digest's block hashes for every slice outside the missing ranges"""
+    gaps = set()
+    for offset, length in missing:
+        gaps.update(range(offset // SLICE_SIZE, -(-(offset + length) // SLICE_SIZE)))
+    with open(file_path, "rb") as f, mapped_view(f) as view:
+        for index in range(len(digest.hashes)):
+            if index not in gaps:
+                digest.set_block(index, block_hash(view[index * SLICE_SIZE:(index + 1) * SLICE_SIZE]))
+
+
+def split_ranges(size, streams):
+    """Split size bytes into at most `streams` contiguous (offset, length) ranges.
+
+    Ranges start on slice boundaries so every slice is one whole digest block.
+    """
+    streams = max(1, min(streams, size // SLICE_SIZE or 1))
+    step = -(-size // streams)
+    step = -(-step // SLICE_SIZE) * SLICE_SIZE
+    return [(offset, min(step, size - offset)) for offset in range(0, size, step)]
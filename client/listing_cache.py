@@ -0,0 +1,47 @@
+"""
+Listing cache for CryptPort clients
+Keeps the last remote file listing together with the server's ETag for it.
+A refresh then asks only for what changed since that ETag; the full,
+paginated listing is fetched again only when the server can no longer
+answer incrementally (first use, a server restart, or a very old ETag).
+"""
+
+
+class ListingCache:
+    """Local copy of one server directory listing"""
+
+    def __init__(self):
+        self.etag = None
+        self.entries = {}   # name -> {"name", "size", "mtime"}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def files(self):
+        """Entries sorted by name, as list_files returns them"""
+        return [self.entries[name] for name in sorted(self.entries)]
+
+    def replace(self, files, etag):
+        self.entries = {entry["name"]: entry for entry in files}
+        self.etag = etag
+
+    def apply(self, changes, etag) -> list:
+        """Merge list_changes entries; returns those that actually changed the listing.
+
+        Deleted files come back as their {"name", "deleted": True} change.
+        """
+        changed = []
+        for entry in changes:
+            name = entry["name"]
+            if entry.get("deleted"):
+                if self.entries.pop(name, None) is not None:
+                    changed.append(entry)
+            elif self.entries.get(name) != entry:
+                self.entries[name] = entry
+                changed.append(entry)
+        self.etag = etag
+        return changed
+
+    def clear(self):
+        self.entries = {}
+        self.etag = None
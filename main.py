@@ -4,7 +4,11 @@ Handles window transitions: Welcome → Register → Login → Config → Connec
 """
 
 import sys
-from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget
+from PyQt5.QtWidgets import QApplication, QMainWindow, QMessageBox, QVBoxLayout, QWidget
+from client.file_server_client import FileServerClient
+from threads.connection_thread import ConnectionThread
+from threads.file_transfer_thread import FileTransferThread
+from transfer.keys import KeyCache
 from ui.welcome_window import WelcomeWindow
 from ui.register_window import RegisterWindow
 from ui.login_window import LoginWindow
@@ -33,35 +37,98 @@ class ConnectionWindow(QMainWindow):
         self.connection_tab.disconnection_requested.connect(self.on_disconnect_requested)
 
         self.file_tab = None
+        self.client = None
+        self.connection_thread = None
+        self.keys = KeyCache()  # encryption keys derived from the passkey, for this session only
 
     def on_connect_requested(self, host, port, username, password):
-        print(f"Connecting to {host}:{port} with {username}/{password}")
+        print(f"Connecting to {host}:{port} as {username}")
+        self.stop_connection()
+        self.connection_tab.update_connection_status(False, f"Connecting to {host}:{port}...")
+        self.client = FileServerClient(host, port)
+        self.connection_thread = ConnectionThread(self.client, username, password, parent=self)
+        self.connection_thread.connected.connect(self.on_connected)
+        self.connection_thread.connection_lost.connect(self.on_connection_lost)
+        self.connection_thread.connection_restored.connect(self.on_connection_restored)
+        self.connection_thread.connection_failed.connect(self.on_connection_failed)
+        self.connection_thread.start()
+
+    def on_connected(self, success, message):
+        if self.sender() is not self.connection_thread:
+            return  # from a connection that has since been stopped
+        if not success:
+            self.connection_tab.update_connection_status(False, f"Connection failed: {message}")
+            return
         self.connection_tab.update_connection_status(True, "Connected successfully!")
+        self.keys.unlock(self.connection_thread.passkey)
         self.open_file_tab()
 
+    def on_connection_lost(self, message):
+        self.statusBar().showMessage(f"Connection lost ({message}), reconnecting...")
+
+    def on_connection_restored(self, message):
+        self.statusBar().showMessage(message, 5000)
+
+    def on_connection_failed(self, message):
+        if self.sender() is not self.connection_thread:
+            return
+        self.statusBar().showMessage(f"Disconnected: {message}")
+        QMessageBox.warning(self, "Connection Lost", f"Could not reconnect to the server:\n{message}")
+
     def on_disconnect_requested(self):
         print("Disconnected from server")
+        self.stop_connection()
         self.connection_tab.update_connection_status(False, "Disconnected successfully")
 
+    def closeEvent(self, event):
+        for thread in self.findChildren(FileTransferThread):  # encryption jobs outlive their page
+            thread.cancel()
+            thread.wait()
+        self.stop_connection()
+        for thread in self.findChildren(ConnectionThread):  # already interrupted; it ends promptly
+            thread.wait()
+        super().closeEvent(event)
+
+    def stop_connection(self):
+        """Stop the heartbeats and close the session"""
+        if self.connection_thread:
+            self.connection_thread.stop()  # the thread disconnects the client itself, off the UI thread
+            self.connection_thread = None
+        elif self.client:
+            self.client.disconnect()
+        self.client = None
+        if self.file_tab:
+            self.file_tab.shutdown()
+            if self.centralWidget() is not self.file_tab:
+                self.file_tab.deleteLater()
+            self.file_tab = None
+        self.keys.clear()
+
+    def show_page(self, widget):
+        """Show widget; the file tab is only set aside, so its queue and transfers carry on"""
+        if self.file_tab and self.centralWidget() is self.file_tab:
+            self.takeCentralWidget()
+        self.setCentralWidget(widget)
+
     def open_file_tab(self):
         from ui.file_tab import FileTab
-        self.file_tab = FileTab()
-        self.setCentralWidget(self.file_tab)
-
-        self.file_tab.disconnect_requested.connect(self.return_to_config_window)
-        self.file_tab.open_encryption_requested.connect(self.open_encryption_tab)
-        self.file_tab.open_history_requested.connect(self.open_history_tab)
+        if self.file_tab is None:
+            self.file_tab = FileTab(self.keys)
+            self.file_tab.disconnect_requested.connect(self.return_to_config_window)
+            self.file_tab.open_encryption_requested.connect(self.open_encryption_tab)
+            self.file_tab.open_history_requested.connect(self.open_history_tab)
+        self.show_page(self.file_tab)
 
     def open_encryption_tab(self):
         from ui.encryption_tab import EncryptionTab
-        self.encryption_tab = EncryptionTab()
-        self.setCentralWidget(self.encryption_tab)
+        self.encryption_tab = EncryptionTab(self.keys, owner=self)
+        self.show_page(self.encryption_tab)
         self.encryption_tab.back_requested.connect(self.open_file_tab)
 
     def open_history_tab(self):
         from ui.history_tab import HistoryTab
         self.history_tab = HistoryTab()
-        self.setCentralWidget(self.history_tab)
+        self.show_page(self.history_tab)
         self.history_tab.back_requested.connect(self.open_file_tab)
 
     def return_to_config_window(self):
@@ -2,7 +2,9 @@
 PyQt5 File Transfer Client - Main Application Window (Used after Config/Login)
 """
 
+import asyncio
 import os
+from functools import partial
 from PyQt5.QtWidgets import (
     QMainWindow, QTabWidget, QVBoxLayout, QWidget,
     QMessageBox, QFileDialog
@@ -10,8 +12,12 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtGui import QFont, QIcon
 from PyQt5.QtCore import QTimer
 
+from client.async_client import AsyncFileServerClient
+from client.connection_pool import ConnectionPool
 from client.file_server_client import FileServerClient
+from client.listing_cache import ListingCache
 from auth.auth_service import AuthService
+from threads.async_bridge import AsyncBridge
 from threads.file_transfer_thread import FileTransferThread
 from ui.styles import APP_STYLES
 from ui.auth_tab import AuthTab
@@ -20,13 +26,23 @@ from ui.files_tab import FilesTab
 from ui.logs_tab import LogsTab
 from config import AppConfig
 
+VIEW_PAGE_SIZE = 500  # listing rows handed to the files tab per turn of the event loop
+
 
 class FileTransferApp(QMainWindow):
     """Main application window with all tabs"""
 
     def __init__(self):
         super().__init__()
-        self.client = FileServerClient()
+        self.pool = ConnectionPool()                 # warm connections per (host, port, user)
+        # Bulk transfers, on worker threads; unfinished uploads are noted so a later session resumes them
+        self.client = FileServerClient(pool=self.pool,
+                                       resume_dir=os.path.join(os.getcwd(), "cryptport_uploads"))
+        self.async_client = AsyncFileServerClient()  # pipelined control requests
+        self.listing = ListingCache()                # remote listing, refreshed incrementally
+        self.listing_feed = None                     # names of a full listing still being shown
+        self.bridge = AsyncBridge()
+        self.bridge.failed.connect(lambda error: QMessageBox.critical(self, "Error", error))
         self.auth_service = AuthService()
         self.transfer_thread = None
 
@@ -116,7 +132,9 @@ class FileTransferApp(QMainWindow):
         self.tabs.setTabEnabled(2, False)
         if self.client.socket:
             self.client.disconnect()
+            self.bridge.submit(self.async_client.disconnect())
             self.connection_tab.update_connection_status(False)
+        self.pool.clear()  # warm connections carry the old login
         self.tabs.setCurrentIndex(0)
         QMessageBox.information(self, "Logout", "You have been logged out successfully")
 
@@ -129,27 +147,48 @@ class FileTransferApp(QMainWindow):
             QMessageBox.warning(self, "Connection", "Please login first to get authentication token")
             return
 
-        self.client.host = host
-        self.client.port = port
-
-        if self.client.connect():
-            success, message = self.client.authenticate(self.auth_service.get_token())
-            if success:
-                self.connection_tab.update_connection_status(True, "Connected & Authenticated")
-                self.tabs.setTabEnabled(2, True)
-                self.tabs.setCurrentIndex(2)
-                QMessageBox.information(self, "Success", "Connected and authenticated successfully")
-            else:
-                self.client.disconnect()
-                self.connection_tab.update_connection_status(False, "Authentication failed")
-                QMessageBox.critical(self, "Auth Error", f"Authentication failed:\n{message}")
+        self.client.host = self.async_client.host = host
+        self.client.port = self.async_client.port = port
+        self.listing.clear()
+        self.connection_tab.update_connection_status(False, "Connecting...")
+        self.bridge.submit(self.open_connections(self.auth_service.get_token()),
+                           self.on_connection_finished)
+
+    async def open_connections(self, token):
+        """Connect and authenticate both clients off the UI thread; returns (stage, message)"""
+        if not await self.async_client.connect():
+            return "connect", "Failed to connect to server"
+        success, message = await self.async_client.authenticate(token)
+        if success:
+            success, message = await asyncio.get_running_loop().run_in_executor(
+                None, self.connect_transfer_client, token)
+        if not success:
+            await self.async_client.disconnect()
+            return "auth", message
+        return None, message
+
+    def connect_transfer_client(self, token):
+        return self.client.login(token)
+
+    def on_connection_finished(self, result):
+        failed_stage, message = result
+        if failed_stage is None:
+            self.connection_tab.update_connection_status(True, "Connected & Authenticated")
+            self.tabs.setTabEnabled(2, True)
+            self.tabs.setCurrentIndex(2)
+            QMessageBox.information(self, "Success", "Connected and authenticated successfully")
+        elif failed_stage == "auth":
+            self.connection_tab.update_connection_status(False, "Authentication failed")
+            QMessageBox.critical(self, "Auth Error", f"Authentication failed:\n{message}")
         else:
             self.connection_tab.update_connection_status(False, "Connection failed")
-            QMessageBox.critical(self, "Connection Error", "Failed to connect to server")
+            QMessageBox.critical(self, "Connection Error", message)
 
     def handle_disconnection_request(self):
         """Handle disconnection"""
         self.client.disconnect()
+        self.bridge.submit(self.async_client.disconnect())
+        self.listing.clear()
         self.connection_tab.update_connection_status(False, "Disconnected")
         self.tabs.setTabEnabled(2, False)
         self.tabs.setCurrentIndex(1)
@@ -193,27 +232,65 @@ class FileTransferApp(QMainWindow):
 
     def handle_files_refresh(self):
         """Refresh file list"""
-        if not self.client.socket or not self.client.authenticated:
+        if not self.async_client.authenticated:
             QMessageBox.warning(self, "Refresh Error", "Please connect to server first")
             return
 
-        success, files, message = self.client.list_files()
-        if success:
-            self.files_tab.update_files_list(files)
-        else:
+        self.bridge.submit(self.async_client.refresh_listing(self.listing), self.on_listing_refreshed)
+
+    def on_listing_refreshed(self, result):
+        """Push only the changed entries to the files tab; a whole new listing goes in pages"""
+        success, changed, message = result
+        if not success:
             QMessageBox.critical(self, "Error", message)
+        elif changed is True:
+            self.listing_feed = sorted(self.listing.entries)
+            self.feed_listing(self.listing_feed, 0)
+        elif changed:
+            self.files_tab.update_file_entries(changed)
+
+    def feed_listing(self, names, start):
+        """Show one page of names, then yield to the event loop before the next.
+
+        Entries are read from the cache as each page goes out, so a change
+        pushed in between is not overwritten by an older copy.
+        """
+        if names is not self.listing_feed:
+            return  # a newer full listing took over
+        entries = self.listing.entries
+        page = [entries[name] for name in names[start:start + VIEW_PAGE_SIZE] if name in entries]
+        if start == 0:
+            self.files_tab.update_files_list(page)
+        else:
+            self.files_tab.update_file_entries(page)
+        if start + VIEW_PAGE_SIZE < len(names):
+            QTimer.singleShot(0, partial(self.feed_listing, names, start + VIEW_PAGE_SIZE))
+        else:
+            self.listing_feed = None
 
-    def handle_file_delete(self, filename: str):
-        """Handle file deletion"""
-        if not self.client.socket or not self.client.authenticated:
+    def handle_file_delete(self, filenames):
+        """Handle deletion of one file or of a whole selection"""
+        if not self.async_client.authenticated:
             QMessageBox.warning(self, "Delete Error", "Please connect to server first")
             return
 
-        success, message = self.client.delete_file(filename)
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        self.bridge.submit(self.delete_and_list(filenames), self.on_file_deleted)
+
+    async def delete_and_list(self, filenames):
+        """Delete, then refresh; the refresh has to be asked after the deletes or it misses them"""
+        deleted = await self.async_client.delete_files(filenames)
+        return deleted, await self.async_client.refresh_listing(self.listing)
+
+    def on_file_deleted(self, results):
+        """One status for the whole batch, however many files it covered"""
+        (success, _, message), listing = results
         if success:
             self.files_tab.handle_delete_success(message)
         else:
             self.files_tab.handle_delete_error(message)
+        self.on_listing_refreshed(listing)
 
     # --------------------------------------------------------------------------
     # 📜 LOG EXPORT & WINDOW ICON
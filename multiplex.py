@@ -0,0 +1,244 @@
+"""
+Stream multiplexing for the asyncio CryptPort client and server
+One connection carries many logical streams. Stream 0 is the connection's
+own request/reply stream: requests on it are answered one at a time, in
+order, exactly as on a plain connection. A message on any new stream id
+opens a stream of its own; its request, data and reply all carry that id,
+and streams are served concurrently, so a long upload on one stream does
+not hold up a list or delete on another.
+
+Flow control is per stream (stream 0 excepted): a side may have at most
+`window` bytes of DATA outstanding on a stream. The receiver grants more
+with WINDOW frames as it consumes the data, so a slow stream only ever
+buffers its own window and cannot stall the connection for the others.
+"""
+
+import asyncio
+
+from protocol import (
+    DATA, FRAME_HEADER_SIZE, MAX_DATA_FRAME, MESSAGE, WINDOW, ProtocolError, decode_frame,
+    decode_message, encode_data, encode_frame, encode_message
+)
+
+STREAM_WINDOW = 2 * 1024 * 1024    # DATA bytes in flight per stream; bounds how far data runs ahead of a request
+FRAME_CHUNK = 256 * 1024           # largest DATA frame on a flow-controlled stream
+CONTROL_QUEUE = 4                  # frames buffered for stream 0 before the connection pushes back
+
+
+class StreamInterrupted(Exception):
+    """The peer replied while we were still sending, e.g. to reject the request early"""
+
+
+class Stream:
+    """One logical stream: an inbox of received frames and a send window"""
+
+    def __init__(self, mux, stream_id, window=STREAM_WINDOW):
+        self.mux = mux
+        self.id = stream_id
+        self.window = window          # None: no flow control (stream 0)
+        self.inbox = asyncio.Queue(CONTROL_QUEUE if window is None else 0)
+        self.credit = window or 0     # DATA bytes we may still send
+        self.credit_changed = asyncio.Event()
+        self.buffered = 0             # DATA bytes received but not yet read
+        self.unacked = 0              # DATA bytes read but not yet granted back
+        self.messages = 0             # messages received but not yet read
+        self.error = None
+
+    # --- Receiving ---
+
+    async def read_message(self) -> dict:
+        frame_type, payload = await self._next_frame()
+        if frame_type != MESSAGE:
+            raise ProtocolError("Expected a message frame")
+        self.messages -= 1
+        return decode_message(payload)
+
+    async def read_payload(self, length, sink):
+        """Read length payload bytes from DATA frames, handing each piece to sink(data, position).
+
+        sink may be a coroutine function; each piece is then awaited before the next is read.
+        """
+        position = 0
+        while position < length:
+            frame_type, payload = await self._next_frame()
+            if frame_type != DATA or len(payload) > length - position:
+                raise ProtocolError("Payload does not match its header")
+            pending = sink(payload, position)
+            if pending is not None:
+                await pending
+            position += len(payload)
+            await self._consumed(len(payload))
+
+    async def read_exact(self, length) -> bytearray:
+        buffer = bytearray(length)
+
+        def sink(data, position):
+            buffer[position:position + len(data)] = data
+
+        await self.read_payload(length, sink)
+        return buffer
+
+    async def _next_frame(self):
+        frame_type, payload = await self.inbox.get()
+        if frame_type is None:
+            self.inbox.put_nowait((None, payload))  # leave the error for the next reader too
+            raise payload
+        return frame_type, payload
+
+    async def _consumed(self, n):
+        if self.window is None:
+            return
+        self.buffered -= n
+        self.unacked += n
+        if self.unacked >= self.window // 2:
+            increment, self.unacked = self.unacked, 0
+            await self.mux.write(encode_frame(WINDOW, increment, self.id))
+
+    # --- Sending ---
+
+    async def send_message(self, header):
+        await self.mux.write(encode_message(header, self.id))
+
+    async def send_data(self, data):
+        view = memoryview(data).cast("B")
+        try:
+            while len(view):
+                n = await self._reserve(len(view))
+                await self.mux.write(*encode_data(view[:n], self.id))
+                view = view[n:]
+        finally:
+            view.release()  # data may be an mmap slice that must be closable even if we fail
+
+    async def send_file_range(self, f, offset, count):
+        """Send count bytes of an open file as DATA frames, the payload via sendfile"""
+        end = offset + count
+        while offset < end:
+            n = await self._reserve(end - offset)
+            await self.mux.sendfile(self.id, f, offset, n)
+            offset += n
+
+    async def _reserve(self, wanted) -> int:
+        """Wait for send credit and take up to one frame's worth of it"""
+        if self.window is None:
+            return min(wanted, MAX_DATA_FRAME)
+        while True:
+            if self.error is not None:
+                raise self.error
+            if self.messages:
+                raise StreamInterrupted(f"Stream {self.id} was answered early")
+            if self.credit > 0:
+                n = min(wanted, FRAME_CHUNK, self.credit)
+                self.credit -= n
+                return n
+            self.credit_changed.clear()
+            await self.credit_changed.wait()
+
+    # --- Called by the multiplexer ---
+
+    async def deliver(self, frame_type, payload):
+        if frame_type == DATA and self.window is not None:
+            self.buffered += len(payload)
+            if self.buffered > self.window:
+                raise ProtocolError(f"Stream {self.id} overran its window")
+        elif frame_type == MESSAGE:
+            self.messages += 1
+            self.credit_changed.set()
+        await self.inbox.put((frame_type, payload))
+
+    def grant(self, increment):
+        self.credit += increment
+        self.credit_changed.set()
+
+    def fail(self, error):
+        self.error = error
+        self.credit_changed.set()
+        while True:
+            try:
+                self.inbox.put_nowait((None, error))
+                return
+            except asyncio.QueueFull:
+                self.inbox.get_nowait()  # the connection is gone; unread frames do not matter
+
+
+class Multiplexer:
+    """Reads a connection's frames and routes them to their streams"""
+
+    def __init__(self, reader, writer, accept=None, window=STREAM_WINDOW):
+        self.reader = reader
+        self.writer = writer
+        self.accept = accept        # accept(stream) when the peer opens a stream; None: it may not
+        self.window = window
+        self.write_lock = asyncio.Lock()
+        self.control = Stream(self, 0, None)
+        self.streams = {0: self.control}
+        self.last_id = 0            # newest stream id opened, by either side
+        self.error = None
+
+    def open_stream(self) -> Stream:
+        self.last_id += 1
+        stream = Stream(self, self.last_id, self.window)
+        self.streams[stream.id] = stream
+        return stream
+
+    def close_stream(self, stream):
+        """Forget a finished stream; frames still arriving for it are dropped"""
+        if stream.id:
+            self.streams.pop(stream.id, None)
+
+    async def run(self):
+        """Route frames until the connection closes; every open stream then sees the error"""
+        try:
+            while True:
+                frame_type, stream_id, length = decode_frame(
+                    await self.reader.readexactly(FRAME_HEADER_SIZE))
+                if frame_type == WINDOW:
+                    stream = self.streams.get(stream_id)
+                    if stream is not None:
+                        stream.grant(length)
+                    continue
+                payload = await self.reader.readexactly(length)
+                stream = self.streams.get(stream_id)
+                if stream is None:
+                    stream = self._peer_opened(stream_id, frame_type)
+                    if stream is None:
+                        continue
+                await stream.deliver(frame_type, payload)
+        except asyncio.IncompleteReadError:
+            self.error = ConnectionError("Connection closed by peer")
+        except (ConnectionError, ProtocolError, OSError) as e:
+            self.error = e
+        finally:
+            for stream in list(self.streams.values()):
+                stream.fail(self.error or ConnectionError("Connection closed"))
+
+    def _peer_opened(self, stream_id, frame_type):
+        if self.accept is None or frame_type != MESSAGE or stream_id <= self.last_id:
+            return None  # late frames of a stream that has already finished
+        self.last_id = stream_id
+        stream = Stream(self, stream_id, self.window)
+        self.streams[stream_id] = stream
+        self.accept(stream)
+        return stream
+
+    async def write(self, *parts):
+        async with self.write_lock:
+            self.writer.writelines(parts)
+            await self.writer.drain()
+
+    def write_nowait(self, *parts):
+        """Queue whole frames at once, keeping them together; never while a sendfile may be running"""
+        self.writer.writelines(parts)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    async def sendfile(self, stream_id, f, offset, count):
+        async with self.write_lock:
+            self.writer.write(encode_frame(DATA, count, stream_id))
+            # Flushes the frame header, then os.sendfile straight from the page cache
+            sent = await asyncio.get_running_loop().sendfile(self.writer.transport, f, offset, count)
+        if sent != count:
+            raise ConnectionError("File ended before its data was sent")
+
+    def close(self):
+        self.writer.close()
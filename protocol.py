@@ -0,0 +1,254 @@
+"""
+Wire protocol shared by the CryptPort client and server
+Everything travels in binary frames:
+
+    magic "CP" | version (1 byte) | type (1 byte) | stream id (4) | length (4) | payload
+
+A MESSAGE frame carries one JSON header. A header with a "length" field is
+followed by exactly that many bytes of file data in one or more DATA frames,
+so file data never goes through JSON. The stream id tags the logical stream a
+frame belongs to; 0 is the connection's own request/reply stream. A WINDOW
+frame has no payload: its length field grants the peer that many more bytes
+of DATA on the stream (see multiplex.py).
+
+FrameReader receives with socket.recv_into into buffers allocated once per
+connection; large payloads go straight into the caller's buffer.
+"""
+
+import json
+import socket
+import struct
+
+DEFAULT_PORT = 5000
+PROTOCOL_VERSION = 1
+MAGIC = b"CP"
+FRAME_HEADER = struct.Struct("!2sBBII")
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+MAX_HEADER_SIZE = 64 * 1024            # largest MESSAGE payload
+MAX_DATA_FRAME = 8 * 1024 * 1024       # payloads above this are split across DATA frames
+
+MESSAGE = 1
+DATA = 2
+WINDOW = 3
+
+_MSG_MORE = getattr(socket, "MSG_MORE", 0)  # Linux: hold a frame header back until its data follows
+
+KEEPALIVE_IDLE = 10        # seconds of silence before the kernel starts probing the peer
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+USER_TIMEOUT = 20          # seconds sent data may stay unacknowledged before the connection is dropped
+
+
+class ProtocolError(Exception):
+    """The peer sent something we cannot understand"""
+
+
+def enable_keepalive(sock):
+    """Detect a vanished peer in tens of seconds instead of the system default of hours"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for name, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                        ("TCP_KEEPCNT", KEEPALIVE_COUNT), ("TCP_USER_TIMEOUT", USER_TIMEOUT * 1000)):
+        option = getattr(socket, name, None)
+        if option is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, option, value)
+
+
+def encode_frame(frame_type, length, stream_id=0) -> bytes:
+    return FRAME_HEADER.pack(MAGIC, PROTOCOL_VERSION, frame_type, stream_id, length)
+
+
+def decode_frame(header) -> tuple:
+    """(type, stream id, length) of a frame header"""
+    magic, version, frame_type, stream_id, length = FRAME_HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError("Not a CryptPort frame")
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if frame_type == MESSAGE and length > MAX_HEADER_SIZE:
+        raise ProtocolError("Header too long")
+    if frame_type not in (MESSAGE, DATA, WINDOW) or length > MAX_DATA_FRAME:
+        raise ProtocolError("Bad frame")
+    return frame_type, stream_id, length
+
+
+def encode_message(header: dict, stream_id=0) -> bytes:
+    body = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return encode_frame(MESSAGE, len(body), stream_id) + body
+
+
+def decode_message(body) -> dict:
+    """Parse the JSON payload of a MESSAGE frame"""
+    try:
+        header = json.loads(body)
+    except ValueError as e:
+        raise ProtocolError(f"Bad header: {e}") from None
+    if not isinstance(header, dict):
+        raise ProtocolError("Header must be an object")
+    return header
+
+
+def encode_data(data, stream_id=0):
+    """Frame header and payload pieces for data (bytes-like), ready for sendmsg"""
+    view = memoryview(data).cast("B")
+    parts = []
+    for start in range(0, len(view), MAX_DATA_FRAME):
+        piece = view[start:start + MAX_DATA_FRAME]
+        parts.append(encode_frame(DATA, len(piece), stream_id))
+        parts.append(piece)
+    return parts
+
+
+def send_message(sock, header: dict, stream_id=0):
+    sock.sendall(encode_message(header, stream_id))
+
+
+def send_data(sock, data, stream_id=0):
+    """Send data as DATA frames, gathering headers and payload in one sendmsg"""
+    parts = encode_data(data, stream_id)
+    remaining = sum(len(part) for part in parts)
+    while remaining:
+        sent = sock.sendmsg(parts)
+        remaining -= sent
+        while sent:
+            if sent >= len(parts[0]):
+                sent -= len(parts.pop(0))
+            else:
+                parts[0] = memoryview(parts[0])[sent:]
+                sent = 0
+
+
+def send_file_range(sock, f, offset, count, stream_id=0):
+    """Send count bytes of an open file as DATA frames, the payload via sendfile"""
+    end = offset + count
+    while offset < end:
+        length = min(MAX_DATA_FRAME, end - offset)
+        sock.sendall(encode_frame(DATA, length, stream_id), _MSG_MORE)
+        sent = sock.sendfile(f, offset, length)
+        if sent != length:
+            raise ConnectionError("File ended before its data was sent")
+        offset += length
+
+
+class FrameReader:
+    """Buffered frame reader over a socket, built on recv_into"""
+
+    def __init__(self, sock, buffer_size=256 * 1024):
+        self.sock = sock
+        self.buffer = bytearray(max(buffer_size, MAX_HEADER_SIZE + FRAME_HEADER_SIZE))
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.data_left = 0      # payload bytes still to come in the current DATA frame
+        self.data_stream = 0
+
+    @property
+    def buffered(self) -> int:
+        return self.end - self.start
+
+    def read_frame(self):
+        """Next frame header as (type, stream id, length); the payload is left unread"""
+        if self.data_left:
+            raise ProtocolError("Previous data frame was not consumed")
+        header = self._take(FRAME_HEADER_SIZE)
+        return decode_frame(header)
+
+    def read_message_body(self, length) -> bytes:
+        return bytes(self._take(length))
+
+    def readinto(self, view) -> int:
+        """Copy up to len(view) bytes of the current DATA frame payload into view"""
+        count = min(len(view), self.data_left)
+        if self.buffered:
+            n = min(count, self.buffered)
+            view[:n] = self.view[self.start:self.start + n]
+            self.start += n
+        else:
+            if count >= len(self.buffer) // 2:
+                n = self.sock.recv_into(view[:count])  # large read: straight into the caller's buffer
+            else:
+                n = self._fill_into(view, count)
+            if not n:
+                raise ConnectionError("Connection closed mid-payload")
+        self.data_left -= n
+        return n
+
+    def begin_data(self, stream_id, length):
+        self.data_left = length
+        self.data_stream = stream_id
+
+    def _fill_into(self, view, count) -> int:
+        """Small read: refill the buffer first so the next header comes with it"""
+        self._fill(1)
+        n = min(count, self.buffered)
+        view[:n] = self.view[self.start:self.start + n]
+        self.start += n
+        return n
+
+    def _take(self, n):
+        """View of the next n buffered bytes, receiving more as needed"""
+        if self.buffered < n:
+            self._fill(n)
+        chunk = self.view[self.start:self.start + n]
+        self.start += n
+        return chunk
+
+    def _fill(self, n):
+        if self.start:
+            # Slide the partial frame to the front; it is shorter than n, so the move is small
+            self.buffer[:self.buffered] = bytes(self.view[self.start:self.end])
+            self.end -= self.start
+            self.start = 0
+        while self.end < n:
+            received = self.sock.recv_into(self.view[self.end:])
+            if not received:
+                raise ConnectionError("Connection closed by peer")
+            self.end += received
+
+
+def recv_message(reader: FrameReader, stream_id=None) -> dict:
+    """Read one MESSAGE frame's header"""
+    frame_type, frame_stream, length = reader.read_frame()
+    if frame_type != MESSAGE:
+        raise ProtocolError("Expected a message frame")
+    if stream_id is not None and frame_stream != stream_id:
+        raise ProtocolError("Message on an unexpected stream")
+    return decode_message(reader.read_message_body(length))
+
+
+def recv_payload(reader: FrameReader, length: int, sink, buffer_size: int = 1024 * 1024,
+                 buffer=None):
+    """Read exactly length payload bytes from DATA frames, handing each piece to
+    sink(view, position).
+
+    One buffer is reused for the whole payload; pass buffer to reuse one
+    across payloads as well.
+    """
+    if buffer is None:
+        buffer = bytearray(min(buffer_size, max(length, 1)))
+    view = memoryview(buffer)
+    position = 0
+    while position < length:
+        if not reader.data_left:
+            _next_data_frame(reader, length - position)
+            continue
+        n = reader.readinto(view[:min(len(view), length - position)])
+        sink(view[:n], position)
+        position += n
+    return position
+
+
+def recv_exact(reader: FrameReader, view):
+    """Fill view (e.g. a slice of a preallocated bytearray) completely from DATA frames"""
+    position = 0
+    while position < len(view):
+        if not reader.data_left:
+            _next_data_frame(reader, len(view) - position)
+            continue
+        position += reader.readinto(view[position:])
+
+
+def _next_data_frame(reader, remaining):
+    frame_type, stream_id, frame_length = reader.read_frame()
+    if frame_type != DATA or frame_length > remaining:
+        raise ProtocolError("Payload does not match its header")
+    reader.begin_data(stream_id, frame_length)
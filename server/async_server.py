@@ -0,0 +1,310 @@
+"""
+Asyncio reference server for CryptPort
+Same protocol, storage layout and replies as server.file_server, but every
+connection is a coroutine on one event loop instead of a thread, so thousands
+of mostly idle clients cost a few kilobytes each rather than a thread stack.
+
+Downloads go out with loop.sendfile, which uses os.sendfile: file data moves
+from the page cache to the socket without passing through Python. Anything
+that blocks on the disk or the CPU (range writes, the fsync on commit, delta
+block copies, decompression, signatures, directory rescans, batches) runs in
+the default executor, so one slow call never stalls the other connections.
+
+Connections are multiplexed (multiplex.py): requests on stream 0 are served
+in order, and each stream a client opens runs as a task of its own, so one
+connection can carry an upload, a download and a listing at the same time.
+
+Each open connection uses a file descriptor; raise `ulimit -n` to serve more
+clients than the default limit allows.
+
+Run:  python -m server.async_server --port 5000 --root cryptport_server_files
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import socket
+
+from multiplex import Multiplexer, StreamInterrupted
+from protocol import DEFAULT_PORT, ProtocolError, enable_keepalive
+from server.file_server import (
+    DEFAULT_ROOT, PAYLOAD_OPS, TICKET_LIFETIME, DeltaUpload, FileStorage, StreamUpload, error_text,
+    parse_users
+)
+from transfer.delta import COPY, DATA, file_signature
+from transfer.integrity import IntegrityError
+
+BACKLOG = 4096                 # pending connections; the kernel caps it at net.core.somaxconn
+
+
+def _offload(function, *args):
+    """Run blocking work in the default executor; awaitable"""
+    return asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+class AsyncFileServer(FileStorage):
+    """Single-threaded server, one coroutine per connection"""
+
+    def __init__(self, root=DEFAULT_ROOT, users=None, backlog=BACKLOG):
+        super().__init__(root, users)
+        self.backlog = backlog
+        self.server = None
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(
+            self._client_connected, host, port, backlog=self.backlog, reuse_address=True)
+        return self.server
+
+    async def serve_forever(self, host, port):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    def _client_connected(self, reader, writer):
+        return ClientConnection(self, reader, writer).serve()
+
+
+class ClientConnection:
+    """One client connection: a serial loop for stream 0 and a task per opened stream"""
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.mux = Multiplexer(reader, writer, accept=self._accept)
+        self.frames_task = None
+        self.tasks = set()
+        self.user = None
+
+    async def serve(self):
+        sock = self.mux.writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            enable_keepalive(sock)
+        self.frames_task = asyncio.create_task(self.mux.run())
+        try:
+            await self._serve_control()
+        finally:
+            for task in list(self.tasks):
+                task.cancel()
+            self.mux.close()
+            self.frames_task.cancel()
+
+    async def _serve_control(self):
+        """Requests on stream 0, answered one at a time like on a plain connection"""
+        stream = self.mux.control
+        try:
+            while True:
+                try:
+                    header = await stream.read_message()
+                except ProtocolError as e:
+                    await stream.send_message({"ok": False, "error": str(e)})
+                    return
+                reply, in_sync = await self._dispatch(stream, header)
+                if reply is not None:
+                    await stream.send_message(reply)
+                if not in_sync:
+                    return
+        except (ConnectionError, OSError):
+            pass
+
+    def _accept(self, stream):
+        task = asyncio.create_task(self._serve_stream(stream))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _serve_stream(self, stream):
+        """One request on a stream of its own; a failure ends just that stream"""
+        try:
+            try:
+                header = await stream.read_message()
+            except ProtocolError as e:
+                reply = {"ok": False, "error": str(e)}
+            else:
+                reply, _ = await self._dispatch(stream, header)
+            if reply is not None:
+                await stream.send_message(reply)
+        except (ConnectionError, OSError, StreamInterrupted):
+            pass
+        finally:
+            self.mux.close_stream(stream)
+
+    async def _dispatch(self, stream, header):
+        """Run one request; returns (reply, whether the stream is still in step)"""
+        op = header.get("op")
+        handler = getattr(self, f"op_{op}", None)
+        if handler is None:
+            return {"ok": False, "error": f"Unknown operation: {op}"}, True
+        if self.user is None and op not in ("auth", "resume"):
+            return {"ok": False, "error": "Not authenticated"}, True
+        try:
+            return await handler(stream, header), True
+        except (OSError, ProtocolError, KeyError, ValueError, IntegrityError) as e:
+            return {"ok": False, "error": error_text(e)}, op not in PAYLOAD_OPS
+
+    # --- Operations ---
+
+    async def op_auth(self, stream, header):
+        username = header.get("username", "")
+        if not self.server.check_credentials(username, header.get("passkey", "")):
+            return {"ok": False, "error": "Invalid username or passkey"}
+        self.user = username
+        return {"ok": True, "window": self.mux.window,  # window: streams are available
+                "ticket": self.server.issue_ticket(username), "ticket_lifetime": TICKET_LIFETIME}
+
+    async def op_resume(self, stream, header):
+        """Authenticate with a resumption ticket from an earlier connection"""
+        username = self.server.redeem_ticket(header.get("ticket"))
+        if username is None:
+            return {"ok": False, "error": "Resumption ticket is invalid or has expired"}
+        self.user = username
+        return {"ok": True, "window": self.mux.window,
+                "ticket": self.server.issue_ticket(username), "ticket_lifetime": TICKET_LIFETIME}
+
+    async def op_ping(self, stream, header):
+        return {"ok": True}
+
+    async def op_list(self, stream, header):
+        # A rescan of a large directory would stall every connection; run it beside the loop
+        files, cursor, etag = await _offload(
+            self.server.list_page, header.get("cursor"), header.get("limit"))
+        return {"ok": True, "files": files, "next": cursor, "etag": etag}
+
+    async def op_list_changes(self, stream, header):
+        changes, etag = self.server.changes_since(header.get("since"))
+        if changes is None:
+            return {"ok": True, "reset": True, "etag": etag}
+        return {"ok": True, "changes": changes, "etag": etag}
+
+    async def op_stat(self, stream, header):
+        return {"ok": True, **self.server.stat_file(header["name"])}
+
+    async def op_delete(self, stream, header):
+        self.server.delete_file(header["name"])
+        return {"ok": True}
+
+    async def op_batch(self, stream, header):
+        # A thousand unlinks or stats are disk work; keep them off the event loop
+        results = await _offload(self.server.run_batch, header["action"], header["items"])
+        return {"ok": True, "results": results}
+
+    async def op_upload_open(self, stream, header):
+        upload_id = await _offload(self.server.open_upload, self.user, header["name"],
+                                   int(header["size"]))
+        return {"ok": True, "upload_id": upload_id}
+
+    async def op_upload_range(self, stream, header):
+        upload = self.server.get_upload(self.user, header["upload_id"])
+        offset, length = int(header["offset"]), int(header["length"])
+        expected = header.get("digest")
+        upload.check_range(offset, length, expected)
+        hasher = hashlib.sha256()
+
+        def write(data, position):
+            hasher.update(data)
+            upload.pwrite(data, offset + position)
+
+        async def sink(data, position):
+            await _offload(write, data, position)
+
+        await stream.read_payload(length, sink)
+        upload.record_range(offset, length, expected, hasher.hexdigest())
+        return {"ok": True}
+
+    async def op_upload_status(self, stream, header):
+        upload = self.server.get_upload(self.user, header["upload_id"])
+        return {"ok": True, "size": upload.size, "received": upload.received()}
+
+    async def op_upload_commit(self, stream, header):
+        # fsyncs the whole file
+        return await _offload(self.server.commit_upload, self.user, header["upload_id"],
+                              header.get("digest"))
+
+    async def op_upload_abort(self, stream, header):
+        await _offload(self.server.abort_upload, self.user, header["upload_id"])
+        return {"ok": True}
+
+    async def op_signature(self, stream, header):
+        """Block signatures of a stored file, sent as a raw payload"""
+        path = self.server.path_for(header["name"])
+        signature = await _offload(file_signature, path)
+        payload = signature.to_bytes()
+        await stream.send_message({"ok": True, "block_size": signature.block_size,
+                                   "size": signature.size, "length": len(payload)})
+        await stream.send_data(payload)
+        return None
+
+    async def op_upload_delta(self, stream, header):
+        """Rebuild a file from a stream of copy/data messages against a stored basis"""
+        trailer = {}
+        with DeltaUpload(self.server, header["name"], header["basis"],
+                         int(header["block_size"])) as upload:
+            async for op in self._operations(stream, trailer):
+                if op[0] == COPY:
+                    await _offload(upload.copy, op[1], op[2])  # a run may span gigabytes of basis
+                else:
+                    await _offload(upload.write, op[1])
+            await _offload(upload.finish, header["size"], trailer.get("digest"))
+        return {"ok": True}
+
+    async def op_upload_stream(self, stream, header):
+        """Receive a stream of data messages of unknown length, optionally compressed"""
+        trailer = {}
+        with StreamUpload(self.server, header["name"], header.get("codec")) as upload:
+            async for op, data in self._operations(stream, trailer):
+                if op != DATA:
+                    raise ProtocolError("Unexpected message in stream upload")
+                await _offload(upload.write, data)  # decompresses
+            await _offload(upload.finish, header.get("size"), trailer.get("digest"))
+        return {"ok": True}
+
+    async def _operations(self, stream, trailer):
+        """Yield delta/stream operations up to the 'end' message, whose fields go into trailer"""
+        while True:
+            message = await stream.read_message()
+            op = message.get("op")
+            if op == "end":
+                trailer.update(message)
+                return
+            if op == COPY:
+                yield (COPY, int(message["block"]), int(message["count"]))
+            elif op == DATA:
+                yield (DATA, await stream.read_exact(int(message["length"])))
+            else:
+                raise ProtocolError(f"Unexpected delta message: {op}")
+
+    async def op_download(self, stream, header):
+        path = self.server.path_for(header["name"])
+        offset = int(header.get("offset", 0))
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            length = max(size - offset, 0)
+            await stream.send_message({"ok": True, "size": size, "length": length,
+                                       "digest": self.server.load_digest(path)})
+            await stream.send_file_range(f, offset, length)
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CryptPort asyncio reference file server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="directory that holds the files")
+    parser.add_argument("--user", action="append", metavar="NAME:PASSKEY",
+                        help="allowed account (repeatable); without it any username is accepted")
+    parser.add_argument("--backlog", type=int, default=BACKLOG, help="pending connection queue length")
+    args = parser.parse_args(argv)
+
+    server = AsyncFileServer(args.root, parse_users(args.user), args.backlog)
+    print(f"CryptPort server listening on {args.host}:{args.port}, storing files in {args.root}")
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,743 @@
+"""
+Reference file server for CryptPort
+Speaks the protocol in protocol.py: auth, ping, list, stat, delete, upload and download.
+
+Uploads may arrive as several byte ranges over separate connections; each range
+is written straight to its place in the file with os.pwrite, so the pieces are
+reassembled in order no matter which connection finishes first.
+
+Uploads are checked against the client's integrity digest while they are
+written, and the digest is kept beside the file so downloads can be checked.
+
+A successful auth also returns a resumption ticket. After a network drop the
+client reconnects with "resume" and the ticket instead of its credentials;
+range uploads live on the server rather than on a connection, so the client
+can ask which ranges arrived ("upload_status") and send only the rest. An
+upload nobody has touched for UPLOAD_IDLE_TIMEOUT is aborted and its partial
+file removed.
+
+Listings come in pages ("list" with a cursor) tagged with an ETag naming the
+directory version. "list_changes" answers with just the entries that changed
+since a given ETag, so a client holding a cached listing stays current cheaply.
+
+"batch" applies one action (delete, stat or rename) to a list of items in a
+single request and answers with a result for every item, in order; one
+failing item does not stop the others.
+
+FileStorage and the upload receivers below hold everything that does not
+depend on how connections are served; server.async_server reuses them.
+
+Run:  python -m server.file_server --port 5000 --root cryptport_server_files
+"""
+
+import argparse
+import bisect
+import collections
+import hashlib
+import json
+import os
+import secrets
+import socketserver
+import threading
+import time
+import uuid
+
+from protocol import (
+    DEFAULT_PORT, FrameReader, ProtocolError, enable_keepalive, recv_exact, recv_message,
+    recv_payload, send_data, send_file_range, send_message
+)
+from transfer.compression import get_codec
+from transfer.delta import COPY, DATA, copy_blocks, file_signature
+from transfer.integrity import BLOCK_SIZE, BlockDigest, HashingWriter, IntegrityError, check
+
+DEFAULT_ROOT = os.path.join(os.getcwd(), "cryptport_server_files")
+DIGEST_DIR = ".cryptport_digests"
+PAYLOAD_OPS = {"upload_range", "upload_delta", "upload_stream"}  # a failure part-way leaves the stream out of sync
+TICKET_LIFETIME = 15 * 60   # seconds a resumption ticket stays valid after it was issued
+CHANGE_LOG_SIZE = 10000     # changes remembered for incremental listings
+LIST_PAGE_BYTES = 48 * 1024  # keeps a listing page well inside protocol.MAX_HEADER_SIZE
+BATCH_LIMIT = 1000          # items per batch request, so its reply stays inside MAX_HEADER_SIZE
+UPLOAD_IDLE_TIMEOUT = 2 * TICKET_LIFETIME  # seconds an unused range upload is kept for a resume
+
+
+def safe_name(name) -> str:
+    """Keep clients inside the storage root"""
+    base = os.path.basename(str(name or ""))
+    if base in ("", ".", "..", DIGEST_DIR) or base.endswith(".part"):
+        raise ProtocolError(f"Invalid file name: {name!r}")
+    return base
+
+
+def error_text(error) -> str:
+    """Message for the client; OS errors lose the server-side path"""
+    if isinstance(error, OSError) and error.strerror:
+        return error.strerror
+    if isinstance(error, KeyError):
+        return f"Missing field: {error.args[0]}"
+    return str(error)
+
+
+class _Identity:
+    """Stands in for a decompressor when a stream is sent uncompressed"""
+
+    def decompress(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+
+class Upload:
+    """A file being assembled from byte ranges"""
+
+    def __init__(self, owner, path, size):
+        self.owner = owner
+        self.path = path
+        self.part_path = f"{path}.{uuid.uuid4().hex}.part"  # concurrent uploads of one name stay apart
+        self.size = size
+        self.last_used = time.monotonic()
+        self.fd = os.open(self.part_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        os.ftruncate(self.fd, size)
+        self.ranges = []
+        self.digest = BlockDigest(BLOCK_SIZE)
+        self.lock = threading.Lock()
+        self.closed = False  # committed or aborted; no more writes
+        self.writers = 0     # pwrites in progress; the last one out closes fd after close
+
+    def write_range(self, reader, offset, length, expected=None):
+        """Write one range; with a block digest from the client, check it as it arrives"""
+        self.check_range(offset, length, expected)
+        hasher = hashlib.sha256()
+
+        def sink(view, pos):
+            hasher.update(view)
+            self.pwrite(view, offset + pos)
+
+        recv_payload(reader, length, sink)
+        self.record_range(offset, length, expected, hasher.hexdigest())
+
+    def check_range(self, offset, length, expected):
+        if offset < 0 or length < 0 or offset + length > self.size:
+            raise ProtocolError("Range outside the file")
+        if expected and (offset % BLOCK_SIZE or (length != BLOCK_SIZE and offset + length != self.size)):
+            raise ProtocolError("Hashed range is not one whole block")
+
+    def record_range(self, offset, length, expected, actual):
+        """Accept a fully written range whose data hashed to actual"""
+        if expected:
+            check(expected, actual, "Range")
+        with self.lock:
+            self.last_used = time.monotonic()
+            self.ranges.append((offset, length))
+            if expected and length:
+                self.digest.set_block(offset // BLOCK_SIZE, expected)
+
+    def pwrite(self, view, offset):
+        with self.lock:
+            if self.closed:
+                raise ProtocolError("Upload was aborted")
+            self.writers += 1
+        try:
+            while len(view):
+                n = os.pwrite(self.fd, view, offset)
+                view = view[n:]
+                offset += n
+        finally:
+            with self.lock:
+                self.writers -= 1
+                if self.closed and not self.writers:
+                    os.close(self.fd)
+
+    def complete(self) -> bool:
+        """True when the received ranges cover the whole file"""
+        return self.size == 0 or self.received() == [[0, self.size]]
+
+    def received(self):
+        """Fully written ranges, merged, as [offset, length] pairs in file order"""
+        merged = []
+        with self.lock:
+            for offset, length in sorted(self.ranges):
+                if merged and offset <= merged[-1][0] + merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], offset + length - merged[-1][0])
+                elif length:
+                    merged.append([offset, length])
+        return merged
+
+    def commit(self):
+        with self.lock:
+            if self.closed:
+                raise ProtocolError("Upload was aborted")
+            os.fsync(self.fd)
+            self._close()
+        os.replace(self.part_path, self.path)
+
+    def abort(self):
+        """Safe against a range still being written on another connection"""
+        with self.lock:
+            if self.closed:
+                return
+            self._close()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+    def _close(self):
+        """Called with the lock held; a pwrite in progress closes fd when it is done"""
+        self.closed = True
+        if not self.writers:
+            os.close(self.fd)
+
+
+class _Receiver:
+    """Writes an incoming file to a temporary name; finish() checks it and moves it into place"""
+
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self.path = storage.path_for(name)
+        self.tmp_path = f"{self.path}.{uuid.uuid4().hex}.part"
+        self.digest = BlockDigest()
+        self.written = 0
+        self.out = open(self.tmp_path, "wb")
+
+    def _write(self, data):
+        self.out.write(data)
+        self.digest.update(data)
+        self.written += len(data)
+
+    def finish(self, size, expected):
+        """size (None: unknown) and expected digest come from the sender"""
+        self.out.close()
+        if size is not None and self.written != int(size):
+            raise ProtocolError("Received size does not match")
+        check(expected, self.digest.hexdigest(), self.name)
+        os.replace(self.tmp_path, self.path)
+        self.storage.save_digest(self.path, self.digest.hexdigest())
+        self.storage.record_change(self.path)
+
+    def close(self):
+        self.out.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StreamUpload(_Receiver):
+    """upload_stream: data messages of unknown total length, optionally compressed"""
+
+    def __init__(self, storage, name, codec=None):
+        super().__init__(storage, name)
+        self.decompressor = get_codec(codec).decompressor() if codec else _Identity()
+
+    def write(self, data):
+        self._write(self.decompressor.decompress(data))
+
+    def finish(self, size, expected):
+        self._write(self.decompressor.flush())
+        super().finish(size, expected)
+
+
+class DeltaUpload(_Receiver):
+    """upload_delta: the new file rebuilt from copy runs of a stored basis plus literal data"""
+
+    def __init__(self, storage, name, basis, block_size):
+        self.basis = open(storage.path_for(basis), "rb")
+        try:
+            super().__init__(storage, name)
+        except BaseException:
+            self.basis.close()
+            raise
+        self.block_size = block_size
+        self._sink = HashingWriter(self.out, self.digest)
+
+    def copy(self, first, count):
+        self.written += copy_blocks(self.basis.fileno(), first, count, self.block_size, self._sink)
+
+    def write(self, data):
+        self._write(data)
+
+    def close(self):
+        self.basis.close()
+        super().close()
+
+
+class FileRequestHandler(socketserver.BaseRequestHandler):
+    """One client connection"""
+
+    def setup(self):
+        enable_keepalive(self.request)
+        self.reader = FrameReader(self.request)
+        self.data_buffer = bytearray(1024 * 1024)  # reused for every data message
+        self.user = None
+
+    def handle(self):
+        try:
+            self.serve_requests()
+        except ConnectionError:
+            pass  # the client went away while we were answering
+
+    def serve_requests(self):
+        while True:
+            try:
+                header = recv_message(self.reader)
+            except (ConnectionError, OSError):
+                return
+            except ProtocolError as e:
+                self.reply({"ok": False, "error": str(e)})
+                return
+
+            op = header.get("op")
+            handler = getattr(self, f"op_{op}", None)
+            if handler is None:
+                self.reply({"ok": False, "error": f"Unknown operation: {op}"})
+                continue
+            if self.user is None and op not in ("auth", "resume"):
+                self.reply({"ok": False, "error": "Not authenticated"})
+                continue
+            try:
+                reply = handler(header)
+            except (OSError, ProtocolError, KeyError, ValueError, IntegrityError) as e:
+                self.reply({"ok": False, "error": error_text(e)})
+                if op in PAYLOAD_OPS:
+                    return
+                continue
+            if reply is not None:
+                self.reply(reply)
+
+    def reply(self, header):
+        send_message(self.request, header)
+
+    # --- Operations ---
+
+    def op_auth(self, header):
+        username = header.get("username", "")
+        if not self.server.check_credentials(username, header.get("passkey", "")):
+            return {"ok": False, "error": "Invalid username or passkey"}
+        self.user = username
+        return {"ok": True, "ticket": self.server.issue_ticket(username),
+                "ticket_lifetime": TICKET_LIFETIME}
+
+    def op_resume(self, header):
+        """Authenticate with a resumption ticket from an earlier connection"""
+        username = self.server.redeem_ticket(header.get("ticket"))
+        if username is None:
+            return {"ok": False, "error": "Resumption ticket is invalid or has expired"}
+        self.user = username
+        return {"ok": True, "ticket": self.server.issue_ticket(username),
+                "ticket_lifetime": TICKET_LIFETIME}
+
+    def op_ping(self, header):
+        return {"ok": True}
+
+    def op_list(self, header):
+        files, cursor, etag = self.server.list_page(header.get("cursor"), header.get("limit"))
+        return {"ok": True, "files": files, "next": cursor, "etag": etag}
+
+    def op_list_changes(self, header):
+        changes, etag = self.server.changes_since(header.get("since"))
+        if changes is None:
+            return {"ok": True, "reset": True, "etag": etag}
+        return {"ok": True, "changes": changes, "etag": etag}
+
+    def op_stat(self, header):
+        return {"ok": True, **self.server.stat_file(header["name"])}
+
+    def op_delete(self, header):
+        self.server.delete_file(header["name"])
+        return {"ok": True}
+
+    def op_batch(self, header):
+        return {"ok": True, "results": self.server.run_batch(header["action"], header["items"])}
+
+    def op_upload_open(self, header):
+        upload_id = self.server.open_upload(self.user, header["name"], int(header["size"]))
+        return {"ok": True, "upload_id": upload_id}
+
+    def op_upload_range(self, header):
+        upload = self.server.get_upload(self.user, header["upload_id"])
+        upload.write_range(self.reader, int(header["offset"]), int(header["length"]),
+                           header.get("digest"))
+        return {"ok": True}
+
+    def op_upload_status(self, header):
+        upload = self.server.get_upload(self.user, header["upload_id"])
+        return {"ok": True, "size": upload.size, "received": upload.received()}
+
+    def op_upload_commit(self, header):
+        return self.server.commit_upload(self.user, header["upload_id"], header.get("digest"))
+
+    def op_upload_abort(self, header):
+        self.server.abort_upload(self.user, header["upload_id"])
+        return {"ok": True}
+
+    def op_signature(self, header):
+        """Block signatures of a stored file, sent as a raw payload"""
+        signature = file_signature(self.server.path_for(header["name"]))
+        payload = signature.to_bytes()
+        self.reply({"ok": True, "block_size": signature.block_size,
+                    "size": signature.size, "length": len(payload)})
+        send_data(self.request, payload)
+        return None
+
+    def op_upload_delta(self, header):
+        """Rebuild a file from a stream of copy/data messages against a stored basis"""
+        trailer = {}
+        with DeltaUpload(self.server, header["name"], header["basis"],
+                         int(header["block_size"])) as upload:
+            for op in self._delta_operations(trailer):
+                if op[0] == COPY:
+                    upload.copy(op[1], op[2])
+                else:
+                    upload.write(op[1])
+            upload.finish(header["size"], trailer.get("digest"))
+        return {"ok": True}
+
+    def op_upload_stream(self, header):
+        """Receive a stream of data messages of unknown length, optionally compressed.
+
+        Used for compressed uploads and for directory archives built on the fly.
+        """
+        trailer = {}
+        with StreamUpload(self.server, header["name"], header.get("codec")) as upload:
+            for op, data in self._delta_operations(trailer):
+                if op != DATA:
+                    raise ProtocolError("Unexpected message in stream upload")
+                upload.write(data)
+            upload.finish(header.get("size"), trailer.get("digest"))
+        return {"ok": True}
+
+    def _delta_operations(self, trailer):
+        """Yield operations up to the 'end' message, whose fields go into trailer"""
+        while True:
+            message = recv_message(self.reader)
+            op = message.get("op")
+            if op == "end":
+                trailer.update(message)
+                return
+            if op == COPY:
+                yield (COPY, int(message["block"]), int(message["count"]))
+            elif op == DATA:
+                length = int(message["length"])
+                if length > len(self.data_buffer):
+                    self.data_buffer = bytearray(length)
+                data = memoryview(self.data_buffer)[:length]
+                recv_exact(self.reader, data)
+                yield (DATA, data)  # only valid until the next operation is read
+            else:
+                raise ProtocolError(f"Unexpected delta message: {op}")
+
+    def op_download(self, header):
+        path = self.server.path_for(header["name"])
+        offset = int(header.get("offset", 0))
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            length = max(size - offset, 0)
+            self.reply({"ok": True, "size": size, "length": length,
+                        "digest": self.server.load_digest(path)})
+            if length:
+                send_file_range(self.request, f, offset, length)
+        return None
+
+
+class FileStorage:
+    """Accounts, stored files, uploads in progress and their digests"""
+
+    def __init__(self, root=DEFAULT_ROOT, users=None):
+        self.root = root
+        self.users = users  # {username: passkey}; None accepts any non-empty username
+        self.uploads = {}
+        self.uploads_lock = threading.Lock()
+        self.tickets = collections.OrderedDict()  # resumption ticket -> (username, expiry), oldest first
+        self.tickets_lock = threading.Lock()
+        self.epoch = secrets.token_hex(4)  # ETags from an earlier run of the server never match
+        self.version = 0
+        self.changes = collections.deque(maxlen=CHANGE_LOG_SIZE)  # (version, name), oldest first
+        self.listing_lock = threading.Lock()
+        self._snapshot = None  # (version, sorted names, entry by name) of the last full scan
+        self.digest_dir = os.path.join(root, DIGEST_DIR)
+        os.makedirs(self.digest_dir, exist_ok=True)
+
+    def check_credentials(self, username, passkey) -> bool:
+        if not username:
+            return False
+        if self.users is None:
+            return True
+        return self.users.get(username) == passkey
+
+    def path_for(self, name) -> str:
+        return os.path.join(self.root, safe_name(name))
+
+    def issue_ticket(self, username) -> str:
+        ticket = secrets.token_urlsafe(32)
+        now = time.monotonic()
+        with self.tickets_lock:
+            while self.tickets and next(iter(self.tickets.values()))[1] <= now:
+                self.tickets.popitem(last=False)
+            self.tickets[ticket] = (username, now + TICKET_LIFETIME)
+        return ticket
+
+    def redeem_ticket(self, ticket):
+        """Username the ticket was issued to, or None if it is unknown or expired.
+
+        A ticket stays valid until it expires, so the several connections of
+        one parallel transfer can all resume with it.
+        """
+        with self.tickets_lock:
+            entry = self.tickets.get(str(ticket or ""))
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def list_files(self):
+        return self.list_page()[0]
+
+    def list_page(self, cursor=None, limit=None):
+        """(entries, next cursor, etag): files sorted by name, starting after cursor.
+
+        A page also stops before it outgrows LIST_PAGE_BYTES, with or
+        without a limit, so it always fits one message; the client follows
+        the cursor for the rest.
+        """
+        version, names, entries = self._listing()
+        start = bisect.bisect_right(names, str(cursor)) if cursor else 0
+        limit = len(names) if limit is None else max(1, int(limit))
+        end = start
+        budget = LIST_PAGE_BYTES
+        while end < len(names) and end - start < limit:
+            budget -= len(json.dumps(entries[names[end]])) + 1
+            if budget < 0 and end > start:
+                break
+            end += 1
+        page = [entries[name] for name in names[start:end]]
+        next_cursor = names[end - 1] if end < len(names) and end > start else None
+        return page, next_cursor, self._etag(version)
+
+    def changes_since(self, etag):
+        """(entries changed since etag, current etag); None instead of the entries when
+        etag is from another server run or older than the change log reaches.
+
+        A changed entry carries its current state, or just "deleted": true.
+        """
+        with self.listing_lock:
+            version = self.version
+            log = list(self.changes)
+        epoch, _, since = str(etag or "").partition(":")
+        if epoch != self.epoch or not since.isdigit() or int(since) > version:
+            return None, self._etag(version)
+        since = int(since)
+        if since < version and (not log or log[0][0] > since + 1):
+            return None, self._etag(version)
+        changes = []
+        for name in sorted({name for changed, name in log if changed > since}):
+            entry = self._entry(name)
+            changes.append(entry if entry else {"name": name, "deleted": True})
+        return changes, self._etag(version)
+
+    def record_change(self, path):
+        """Note that the file at path was created, replaced or removed"""
+        with self.listing_lock:
+            self.version += 1
+            self.changes.append((self.version, os.path.basename(path)))
+
+    def _etag(self, version) -> str:
+        return f"{self.epoch}:{version}"
+
+    def _listing(self):
+        """Sorted snapshot of the directory, rescanned only after something changed"""
+        with self.listing_lock:
+            version = self.version
+            snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == version:
+            return snapshot
+        entries = {}
+        with os.scandir(self.root) as found:
+            for entry in found:
+                if entry.is_file() and not entry.name.endswith(".part"):
+                    st = entry.stat()
+                    entries[entry.name] = {"name": entry.name, "size": st.st_size, "mtime": st.st_mtime}
+        # Tagged with the version read before the scan: a change that lands during
+        # it is replayed by changes_since, which is harmless
+        snapshot = (version, sorted(entries), entries)
+        with self.listing_lock:
+            if self.version == version:
+                self._snapshot = snapshot
+        return snapshot
+
+    def _entry(self, name):
+        try:
+            st = os.stat(os.path.join(self.root, name))
+        except FileNotFoundError:
+            return None
+        return {"name": name, "size": st.st_size, "mtime": st.st_mtime}
+
+    def stat_file(self, name):
+        st = os.stat(self.path_for(name))
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def delete_file(self, name):
+        path = self.path_for(name)
+        os.remove(path)
+        self.forget_digest(path)
+        self.record_change(path)
+
+    def rename_file(self, name, new_name):
+        path, new_path = self.path_for(name), self.path_for(new_name)
+        if os.path.exists(new_path):
+            raise FileExistsError(17, "A file with the new name already exists")
+        os.rename(path, new_path)
+        try:  # rename keeps the mtime, so the digest record stays valid under the new name
+            os.replace(os.path.join(self.digest_dir, os.path.basename(path)),
+                       os.path.join(self.digest_dir, os.path.basename(new_path)))
+        except FileNotFoundError:
+            self.forget_digest(new_path)
+        self.record_change(path)
+        self.record_change(new_path)
+
+    def run_batch(self, action, items):
+        """Apply action to every item; returns one {"ok", ...} result per item, in order"""
+        run = {"delete": self.delete_file, "stat": self.stat_file, "rename": self._rename_item}.get(action)
+        if run is None:
+            raise ProtocolError(f"Unknown batch action: {action}")
+        if not isinstance(items, list) or len(items) > BATCH_LIMIT:
+            raise ProtocolError(f"A batch takes a list of at most {BATCH_LIMIT} items")
+        results = []
+        for item in items:
+            try:
+                results.append({"ok": True, **(run(item) or {})})
+            except (OSError, ProtocolError, TypeError, ValueError) as e:
+                results.append({"ok": False, "error": error_text(e)})
+        return results
+
+    def _rename_item(self, item):
+        if not isinstance(item, list) or len(item) != 2:
+            raise ProtocolError("A rename item is [name, new name]")
+        self.rename_file(*item)
+
+    def open_upload(self, user, name, size) -> str:
+        self.expire_uploads()
+        upload_id = uuid.uuid4().hex
+        upload = Upload(user, self.path_for(name), size)
+        with self.uploads_lock:
+            self.uploads[upload_id] = upload
+        return upload_id
+
+    def get_upload(self, user, upload_id) -> Upload:
+        with self.uploads_lock:
+            upload = self.uploads.get(upload_id)
+        if upload is None or upload.owner != user:
+            raise ProtocolError("Unknown upload")
+        upload.last_used = time.monotonic()
+        return upload
+
+    def expire_uploads(self):
+        """Abort uploads idle for UPLOAD_IDLE_TIMEOUT; their clients are not coming back"""
+        cutoff = time.monotonic() - UPLOAD_IDLE_TIMEOUT
+        with self.uploads_lock:
+            idle = [upload_id for upload_id, upload in self.uploads.items() if upload.last_used < cutoff]
+            expired = [self.uploads.pop(upload_id) for upload_id in idle]
+        for upload in expired:
+            upload.abort()
+
+    def commit_upload(self, user, upload_id, expected=None):
+        upload = self.get_upload(user, upload_id)
+        if not upload.complete():
+            return {"ok": False, "error": "Upload is missing data"}
+        with self.uploads_lock:
+            self.uploads.pop(upload_id, None)
+        digest = None
+        if expected:
+            try:
+                digest = upload.digest.hexdigest()
+                check(expected, digest, os.path.basename(upload.path))
+            except IntegrityError:
+                upload.abort()
+                raise
+        upload.commit()
+        self.save_digest(upload.path, digest)
+        self.record_change(upload.path)
+        return {"ok": True}
+
+    def abort_upload(self, user, upload_id):
+        upload = self.get_upload(user, upload_id)
+        with self.uploads_lock:
+            self.uploads.pop(upload_id, None)
+        upload.abort()
+
+    # --- Integrity digests, kept in DIGEST_DIR and tied to the file's size and mtime ---
+
+    def save_digest(self, path, digest):
+        record_path = os.path.join(self.digest_dir, os.path.basename(path))
+        if not digest:
+            self.forget_digest(path)
+            return
+        st = os.stat(path)
+        tmp_path = f"{record_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"digest": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}, f)
+        os.replace(tmp_path, record_path)
+
+    def load_digest(self, path):
+        """Digest of the file at path, or None if unknown or the file has changed since"""
+        try:
+            with open(os.path.join(self.digest_dir, os.path.basename(path)), "r", encoding="utf-8") as f:
+                record = json.load(f)
+            st = os.stat(path)
+        except (OSError, ValueError):
+            return None
+        if record.get("size") != st.st_size or record.get("mtime_ns") != st.st_mtime_ns:
+            return None
+        return record.get("digest")
+
+    def forget_digest(self, path):
+        try:
+            os.remove(os.path.join(self.digest_dir, os.path.basename(path)))
+        except FileNotFoundError:
+            pass
+
+
+class FileServer(FileStorage, socketserver.ThreadingTCPServer):
+    """Threaded server, one thread per connection"""
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, root=DEFAULT_ROOT, users=None):
+        FileStorage.__init__(self, root, users)
+        socketserver.ThreadingTCPServer.__init__(self, address, FileRequestHandler)
+
+
+def parse_users(values):
+    if not values:
+        return None
+    users = {}
+    for value in values:
+        username, _, passkey = value.partition(":")
+        users[username] = passkey
+    return users
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CryptPort reference file server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="directory that holds the files")
+    parser.add_argument("--user", action="append", metavar="NAME:PASSKEY",
+                        help="allowed account (repeatable); without it any username is accepted")
+    args = parser.parse_args(argv)
+
+    server = FileServer((args.host, args.port), args.root, parse_users(args.user))
+    print(f"CryptPort server listening on {args.host}:{args.port}, storing files in {args.root}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+"""Lets the tests import the app's top-level modules (protocol, server, transfer, ...)"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
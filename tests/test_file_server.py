@@ -0,0 +1,158 @@
+"""
+Loopback tests for server.file_server with the blocking FileServerClient
+A real FileServer listens on 127.0.0.1 in a background thread; files are
+sent in parallel byte ranges over several connections and fetched back.
+"""
+
+import os
+import threading
+
+import pytest
+
+from client.file_server_client import PARALLEL_THRESHOLD, SLICE_SIZE, FileServerClient
+from protocol import ProtocolError
+from server import file_server
+from server.file_server import FileServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = FileServer(("127.0.0.1", 0), str(tmp_path / "server"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server):
+    client = FileServerClient("127.0.0.1", server.server_address[1], streams=4)
+    assert client.connect()
+    assert client.authenticate("tester")[0]
+    yield client
+    client.disconnect()
+
+
+def write_random(path, size):
+    data = os.urandom(size)
+    with open(path, "wb") as f:
+        f.write(data)
+    return data
+
+
+def test_parallel_range_upload_and_download(server, client, tmp_path):
+    size = max(PARALLEL_THRESHOLD, 4 * SLICE_SIZE) + 12345   # four streams, last range short
+    data = write_random(tmp_path / "image.bin", size)
+
+    success, message = client.upload_file(str(tmp_path / "image.bin"), delta=False, compression=None)
+    assert success, message
+    stored = os.path.join(server.root, "image.bin")
+    with open(stored, "rb") as f:
+        assert f.read() == data
+    assert not [name for name in os.listdir(server.root) if name.endswith(".part")]
+    assert server.load_digest(stored)
+
+    success, path = client.download_file("image.bin", str(tmp_path / "copy.bin"))
+    assert success, path
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+
+def test_interrupted_upload_resumes_in_a_new_session(server, tmp_path):
+    size = 4 * SLICE_SIZE + 12345
+    data = write_random(tmp_path / "big.bin", size)
+    port = server.server_address[1]
+    resume_dir = str(tmp_path / "uploads")
+
+    def stop_halfway(done, total):
+        if done >= 2 * SLICE_SIZE:
+            raise RuntimeError("stopped")
+
+    first = FileServerClient("127.0.0.1", port, streams=1, resume_dir=resume_dir)
+    assert first.connect() and first.authenticate("tester")[0]
+    with pytest.raises(RuntimeError):
+        first.upload_file(str(tmp_path / "big.bin"), progress_callback=stop_halfway,
+                          delta=False, compression=None)
+    first.disconnect()
+
+    reports = []
+    second = FileServerClient("127.0.0.1", port, streams=1, resume_dir=resume_dir)
+    assert second.connect() and second.authenticate("tester")[0]
+    success, message = second.upload_file(str(tmp_path / "big.bin"),
+                                          progress_callback=lambda done, total: reports.append(done),
+                                          delta=False, compression=None)
+    second.disconnect()
+    assert success, message
+    assert reports[0] > 2 * SLICE_SIZE  # the first two slices were not sent again
+    with open(os.path.join(server.root, "big.bin"), "rb") as f:
+        assert f.read() == data
+    assert not os.listdir(resume_dir)
+
+
+def test_download_of_missing_file_fails_cleanly(client, tmp_path):
+    success, message = client.download_file("nope.bin", str(tmp_path / "nope.bin"))
+    assert not success
+    assert message
+    assert client.list_files()[0]
+
+
+def test_concurrent_uploads_of_one_name_stay_apart(server):
+    first_id = server.open_upload("a", "same.bin", 4)
+    second_id = server.open_upload("b", "same.bin", 4)
+    first, second = server.get_upload("a", first_id), server.get_upload("b", second_id)
+    assert first.part_path != second.part_path
+
+    first.pwrite(memoryview(b"AAAA"), 0)
+    first.record_range(0, 4, None, None)
+    second.pwrite(memoryview(b"BB"), 0)
+    second.record_range(0, 2, None, None)
+    second.pwrite(memoryview(b"BB"), 2)
+    second.record_range(2, 2, None, None)
+
+    for upload in (first, second):
+        with open(upload.part_path, "rb") as f:
+            assert f.read() == (b"AAAA" if upload is first else b"BBBB")
+    assert server.commit_upload("a", first_id)["ok"]
+    assert server.commit_upload("b", second_id)["ok"]
+    with open(os.path.join(server.root, "same.bin"), "rb") as f:
+        assert f.read() == b"BBBB"
+
+
+def test_idle_uploads_expire(server):
+    upload_id = server.open_upload("a", "stale.bin", 1024)
+    upload = server.get_upload("a", upload_id)
+    assert os.path.exists(upload.part_path)
+
+    upload.last_used -= file_server.UPLOAD_IDLE_TIMEOUT + 1
+    server.expire_uploads()
+    assert not os.path.exists(upload.part_path)
+    with pytest.raises(ProtocolError, match="Unknown upload"):
+        server.get_upload("a", upload_id)
+
+
+def test_abort_during_a_write_leaves_the_fd_to_the_writer(server, monkeypatch):
+    upload_id = server.open_upload("a", "racy.bin", 4)
+    upload = server.get_upload("a", upload_id)
+    writing, resume = threading.Event(), threading.Event()
+    real_pwrite = os.pwrite
+
+    def slow_pwrite(fd, data, offset):
+        writing.set()
+        resume.wait(5)
+        return real_pwrite(fd, data, offset)
+
+    monkeypatch.setattr(file_server.os, "pwrite", slow_pwrite)
+    writer = threading.Thread(target=upload.pwrite, args=(memoryview(b"ABCD"), 0))
+    writer.start()
+    assert writing.wait(5)
+    server.abort_upload("a", upload_id)
+    assert not os.path.exists(upload.part_path)
+    os.fstat(upload.fd)  # still open: the write in progress owns it
+
+    resume.set()
+    writer.join(5)
+    with pytest.raises(OSError):
+        os.fstat(upload.fd)
+    with pytest.raises(ProtocolError, match="aborted"):
+        upload.pwrite(memoryview(b"x"), 0)
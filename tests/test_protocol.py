@@ -0,0 +1,208 @@
+"""
+Codec tests for protocol.py
+Frames are fed to FrameReader through an in-memory socket that can hand the
+bytes out a few at a time, the way a slow or congested connection would.
+"""
+
+import json
+import os
+
+import pytest
+
+from protocol import (
+    DATA, FRAME_HEADER, FRAME_HEADER_SIZE, MAGIC, MAX_DATA_FRAME, MAX_HEADER_SIZE, MESSAGE,
+    PROTOCOL_VERSION, WINDOW, FrameReader, ProtocolError, decode_frame, decode_message, encode_data,
+    encode_frame, encode_message, recv_exact, recv_message, recv_payload, send_data
+)
+
+
+class ChunkedSocket:
+    """Serves the given bytes to recv_into at most step bytes per call"""
+
+    def __init__(self, data, step=None):
+        self.data = memoryview(bytes(data))
+        self.position = 0
+        self.step = step
+        self.calls = 0
+
+    def recv_into(self, view):
+        self.calls += 1
+        n = min(len(view), len(self.data) - self.position)
+        if self.step:
+            n = min(n, self.step)
+        view[:n] = self.data[self.position:self.position + n]
+        self.position += n
+        return n
+
+
+class CappedSendSocket:
+    """Records what sendmsg sends, accepting at most cap bytes per call"""
+
+    def __init__(self, cap):
+        self.cap = cap
+        self.sent = bytearray()
+
+    def sendmsg(self, parts):
+        budget = self.cap
+        for part in parts:
+            piece = bytes(part)[:budget]
+            self.sent += piece
+            budget -= len(piece)
+            if not budget:
+                break
+        return self.cap - budget
+
+
+def data_frames(data, stream_id=0):
+    return b"".join(bytes(part) for part in encode_data(data, stream_id))
+
+
+# --- Frame headers ---
+
+def test_frame_header_round_trip():
+    for frame_type in (MESSAGE, DATA, WINDOW):
+        header = encode_frame(frame_type, 1234, stream_id=7)
+        assert len(header) == FRAME_HEADER_SIZE
+        assert decode_frame(header) == (frame_type, 7, 1234)
+
+
+def test_bad_magic_is_rejected():
+    header = FRAME_HEADER.pack(b"XX", PROTOCOL_VERSION, MESSAGE, 0, 10)
+    with pytest.raises(ProtocolError, match="Not a CryptPort frame"):
+        decode_frame(header)
+
+
+def test_other_protocol_version_is_rejected():
+    header = FRAME_HEADER.pack(MAGIC, PROTOCOL_VERSION + 1, MESSAGE, 0, 10)
+    with pytest.raises(ProtocolError, match="Unsupported protocol version"):
+        decode_frame(header)
+
+
+def test_oversize_message_header_is_rejected():
+    decode_frame(encode_frame(MESSAGE, MAX_HEADER_SIZE))
+    with pytest.raises(ProtocolError, match="Header too long"):
+        decode_frame(encode_frame(MESSAGE, MAX_HEADER_SIZE + 1))
+
+
+def test_oversize_data_frame_and_unknown_type_are_rejected():
+    decode_frame(encode_frame(DATA, MAX_DATA_FRAME))
+    with pytest.raises(ProtocolError, match="Bad frame"):
+        decode_frame(encode_frame(DATA, MAX_DATA_FRAME + 1))
+    with pytest.raises(ProtocolError, match="Bad frame"):
+        decode_frame(FRAME_HEADER.pack(MAGIC, PROTOCOL_VERSION, 9, 0, 0))
+
+
+# --- Messages ---
+
+def test_message_round_trip():
+    header = {"op": "upload_open", "name": "résumé.pdf", "size": 2 ** 40}
+    reader = FrameReader(ChunkedSocket(encode_message(header, stream_id=3)))
+    assert recv_message(reader, stream_id=3) == header
+
+
+def test_message_on_another_stream_is_rejected():
+    reader = FrameReader(ChunkedSocket(encode_message({"op": "ping"}, stream_id=5)))
+    with pytest.raises(ProtocolError, match="unexpected stream"):
+        recv_message(reader, stream_id=0)
+
+
+def test_bad_message_bodies_are_rejected():
+    with pytest.raises(ProtocolError, match="Bad header"):
+        decode_message(b"{not json")
+    with pytest.raises(ProtocolError, match="must be an object"):
+        decode_message(json.dumps([1, 2]).encode())
+
+
+def test_data_frame_where_a_message_is_expected():
+    reader = FrameReader(ChunkedSocket(data_frames(b"abc")))
+    with pytest.raises(ProtocolError, match="Expected a message frame"):
+        recv_message(reader)
+
+
+# --- Truncated input ---
+
+def test_truncated_frame_header():
+    frame = encode_message({"op": "ping"})
+    reader = FrameReader(ChunkedSocket(frame[:FRAME_HEADER_SIZE - 3]))
+    with pytest.raises(ConnectionError):
+        recv_message(reader)
+
+
+def test_truncated_message_body():
+    frame = encode_message({"op": "list", "cursor": "a" * 100})
+    reader = FrameReader(ChunkedSocket(frame[:-10]))
+    with pytest.raises(ConnectionError):
+        recv_message(reader)
+
+
+def test_truncated_payload():
+    frames = data_frames(os.urandom(100_000))
+    reader = FrameReader(ChunkedSocket(frames[:-1]))
+    with pytest.raises(ConnectionError):
+        recv_payload(reader, 100_000, lambda view, position: None)
+
+
+def test_payload_longer_than_its_header_says():
+    reader = FrameReader(ChunkedSocket(data_frames(b"x" * 20)))
+    with pytest.raises(ProtocolError, match="does not match"):
+        recv_payload(reader, 10, lambda view, position: None)
+
+
+# --- Short reads ---
+
+@pytest.mark.parametrize("step", [1, 3, 7, 4096])
+def test_messages_and_payloads_survive_short_reads(step):
+    small, large = os.urandom(1000), os.urandom(300_000)   # large takes the direct recv_into path
+    stream = (encode_message({"op": "a", "length": len(small)}) + data_frames(small)
+              + encode_message({"op": "b", "length": len(large)}) + data_frames(large)
+              + encode_message({"op": "end"}))
+    sock = ChunkedSocket(stream, step)
+    reader = FrameReader(sock)
+
+    assert recv_message(reader)["op"] == "a"
+    received = bytearray(len(small))
+    recv_exact(reader, memoryview(received))
+    assert received == small
+
+    assert recv_message(reader)["op"] == "b"
+    pieces = []
+    recv_payload(reader, len(large), lambda view, position: pieces.append((position, bytes(view))),
+                 buffer_size=64 * 1024)
+    assert b"".join(piece for _, piece in pieces) == large
+    assert [position for position, _ in pieces] == sorted(position for position, _ in pieces)
+
+    assert recv_message(reader) == {"op": "end"}
+    assert sock.position == len(stream)
+
+
+def test_recv_payload_reuses_one_buffer():
+    payload = os.urandom(500_000)
+    reader = FrameReader(ChunkedSocket(data_frames(payload), 50_000))
+    buffer = bytearray(64 * 1024)
+    seen = set()
+
+    def sink(view, position):
+        seen.add(id(view.obj))
+    recv_payload(reader, len(payload), sink, buffer=buffer)
+    assert seen == {id(buffer)}
+
+
+def test_large_payload_is_split_across_data_frames():
+    payload = bytes(MAX_DATA_FRAME + 10)
+    parts = encode_data(payload, stream_id=2)
+    assert len(parts) == 4
+    assert decode_frame(parts[0]) == (DATA, 2, MAX_DATA_FRAME)
+    assert decode_frame(parts[2]) == (DATA, 2, 10)
+
+
+# --- Sending ---
+
+def test_send_data_finishes_after_partial_sendmsg():
+    payload = os.urandom(10_000)
+    sock = CappedSendSocket(cap=333)
+    send_data(sock, payload, stream_id=4)
+    reader = FrameReader(ChunkedSocket(sock.sent))
+    received = bytearray(len(payload))
+    recv_exact(reader, memoryview(received))
+    assert received == payload
+    assert reader.data_stream == 4
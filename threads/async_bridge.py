@@ -0,0 +1,52 @@
+"""
+asyncio <-> Qt bridge for CryptPort
+Runs one asyncio event loop in a background thread. The UI submits coroutines
+and gets their results back as callbacks on the Qt thread, the same shape a
+qasync event loop gives, without blocking the UI or adding a dependency.
+"""
+
+import asyncio
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+class AsyncBridge(QObject):
+    """Event loop thread whose results are delivered through Qt signals"""
+    failed = pyqtSignal(str)                  # unexpected error in a submitted coroutine
+    _finished = pyqtSignal(object, object)    # callback, concurrent future
+
+    def __init__(self):
+        super().__init__()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="cryptport-asyncio", daemon=True)
+        self._thread.start()
+        self._finished.connect(self._deliver)
+
+    def submit(self, coro, callback=None):
+        """Schedule coro on the loop; callback(result) later runs on the Qt thread"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(lambda done: self._finished.emit(callback, done))
+        return future
+
+    def call(self, coro, timeout=None):
+        """Run coro and wait for it; for worker threads and shutdown, never the UI thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def stop(self):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=2)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _deliver(self, callback, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self.failed.emit(str(error) or type(error).__name__)
+        elif callback is not None:
+            callback(future.result())
@@ -0,0 +1,88 @@
+"""
+Connection supervision for CryptPort
+ConnectionThread logs in off the UI thread and then keeps the session alive:
+once the control connection has been idle for the heartbeat interval it is
+pinged, and an unanswered ping counts as a drop. The thread then reconnects
+with the server's resumption ticket, backing off between attempts, so a
+short network outage costs one round trip instead of a new login.
+
+stop() never blocks the UI thread: it interrupts the connection, and the
+thread disconnects the client and deletes itself once it has finished.
+"""
+
+import threading
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from client.file_server_client import HEARTBEAT_INTERVAL
+
+RECONNECT_ATTEMPTS = 6
+FIRST_RETRY_DELAY = 0.5     # seconds; doubled after every failed attempt
+MAX_RETRY_DELAY = 8.0
+
+
+class ConnectionThread(QThread):
+    """Logs a FileServerClient in, then watches the connection with heartbeats"""
+    connected = pyqtSignal(bool, str)        # login finished: success, message
+    connection_lost = pyqtSignal(str)        # a heartbeat failed; reconnecting
+    connection_restored = pyqtSignal(str)
+    connection_failed = pyqtSignal(str)      # gave up reconnecting
+
+    def __init__(self, client, username, passkey, interval=HEARTBEAT_INTERVAL,
+                 attempts=RECONNECT_ATTEMPTS, parent=None):
+        super().__init__(parent)
+        self.client = client
+        self.username = username
+        self.passkey = passkey
+        self.interval = interval
+        self.attempts = attempts
+        self._stop = threading.Event()
+
+    def run(self):
+        try:
+            self._supervise()
+        finally:
+            if self._stop.is_set():
+                self.client.disconnect()
+
+    def _supervise(self):
+        success, message = self.client.login(self.username, self.passkey)
+        if self._stop.is_set():
+            return
+        self.connected.emit(success, message)
+        if not success:
+            return
+        while not self._stop.wait(min(1.0, self.interval)):
+            if self.client.idle_seconds() < self.interval:
+                continue
+            alive, message = self.client.ping()
+            if alive or self._stop.is_set():
+                continue
+            self.connection_lost.emit(message)
+            restored, message = self._reconnect()
+            if restored:
+                self.connection_restored.emit(message)
+            elif not self._stop.is_set():
+                self.connection_failed.emit(message)
+                return
+
+    def stop(self):
+        """Ask the thread to end and return at once; keep a parent on it until it has"""
+        self._stop.set()
+        self.client.interrupt()  # a blocked login or ping gives up now
+        self.finished.connect(self.deleteLater)
+        if self.isFinished():
+            self.client.disconnect()
+            self.deleteLater()
+
+    def _reconnect(self):
+        delay = FIRST_RETRY_DELAY
+        message = "Not reconnected"
+        for _ in range(self.attempts):
+            restored, message = self.client.resume()
+            if restored:
+                return True, message
+            if self._stop.wait(delay):
+                break
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+        return False, message
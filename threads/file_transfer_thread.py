@@ -0,0 +1,243 @@
+"""
+Background transfer workers for CryptPort
+Keeps all file I/O off the Qt main thread.
+
+FileTransferThread runs a single transfer in its own QThread.
+TransferPool runs many transfers on a bounded pool of worker threads.
+Both report progress and completion through Qt signals, which Qt delivers
+to the UI thread as queued events.
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+
+from transfer.archive import DirectoryArchive
+from transfer.crypto import DecryptingWriter, EncryptingReader, decrypt_file, encrypt_file, encrypted_size
+from transfer.delta import DELTA_MIN_SIZE, delta_copy_file
+from transfer.engine import copy_file_resumable
+from transfer.progress import format_size
+from transfer.ratelimit import BandwidthScheduler
+
+PROGRESS_INTERVAL = 0.05  # seconds between progress signals per transfer
+DEFAULT_WORKERS = 4
+
+
+class TransferCancelled(Exception):
+    """Raised inside a worker when its transfer has been cancelled"""
+
+
+def run_transfer(client, operation, progress_callback=None, file_path=None,
+                 filename=None, save_path=None, target_path=None, delta=True, store=None,
+                 compression="auto", digest=None, on_record=None, keys=None):
+    """Run one transfer and return (success, message).
+
+    operation is 'upload' or 'download' (through client), 'store' / 'export'
+    (into and out of a local ChunkStore) or 'copy' (plain local file).
+    'store_dir' and 'upload_dir' send a whole directory as one streamed archive.
+    'encrypt' / 'decrypt' turn file_path into target_path with keys (a KeyCache).
+    With keys, 'store', 'store_dir' and 'upload' also encrypt on the fly
+    and 'export' and 'download' decrypt on the fly; no encrypted copy is written.
+    Local copies are resumable: an interrupted one continues from its checkpoint.
+    With delta on, a copy over an existing target only takes the changed blocks.
+    compression ('auto', a codec name or None) applies to 'store' and 'upload'.
+    on_record receives the store record (with its SHA-256 digest) of a 'store' or
+    'store_dir'; 'export' with that digest rebuilds exactly that version.
+    """
+    if operation == 'store' and keys:
+        with open(file_path, "rb") as src, EncryptingReader(src, keys.encryptor()) as reader:
+            record, new_bytes = store.put_stream(reader, filename, progress_callback=progress_callback,
+                                                 total=encrypted_size(os.path.getsize(file_path)))
+        if on_record:
+            on_record(record)
+        return True, f"encrypted, {format_size(new_bytes)} new"
+    if operation == 'store':
+        record, new_bytes = store.put(file_path, filename, progress_callback=progress_callback,
+                                      compression=compression)
+        if on_record:
+            on_record(record)
+        if not new_bytes:
+            return True, "already stored"
+        return True, f"{format_size(new_bytes)} new"
+    if operation == 'store_dir':
+        with DirectoryArchive(file_path) as archive:
+            stream = archive
+            if keys:
+                # Ciphertext does not compress; the archive is encrypted as it is built
+                stream, compression = EncryptingReader(archive, keys.encryptor()), None
+            record, new_bytes = store.put_stream(stream, filename,
+                                                 progress_callback=progress_callback,
+                                                 compression=compression)
+        if on_record:
+            on_record(record)
+        return True, f"{archive.files} files, {format_size(new_bytes)} new"
+    if operation == 'upload_dir':
+        return client.upload_directory(file_path, progress_callback=progress_callback,
+                                       compression=compression)
+    if operation == 'export':
+        writer = (lambda out: DecryptingWriter(out, keys.decryptor())) if keys else None
+        return True, store.export(filename, save_path, digest=digest, writer=writer)
+    if operation == 'encrypt':
+        return True, encrypt_file(file_path, target_path, keys, progress_callback=progress_callback)
+    if operation == 'decrypt':
+        return True, decrypt_file(file_path, target_path, keys, progress_callback=progress_callback)
+    if operation == 'copy':
+        if delta and _delta_worthwhile(file_path, target_path):
+            literal = delta_copy_file(file_path, target_path, progress_callback=progress_callback)
+            return True, f"{target_path} (delta, {format_size(literal)} new)"
+        copy_file_resumable(file_path, target_path, progress_callback=progress_callback)
+        return True, target_path
+    if operation == 'upload':
+        return client.upload_file(file_path, progress_callback=progress_callback, delta=delta,
+                                  compression=compression, keys=keys)
+    if operation == 'download':
+        return client.download_file(filename, save_path, progress_callback=progress_callback,
+                                    keys=keys)
+    raise ValueError(f"Unknown transfer operation: {operation}")
+
+
+def _delta_worthwhile(source_path, target_path) -> bool:
+    try:
+        return (os.path.getsize(target_path) >= DELTA_MIN_SIZE
+                and os.path.getsize(source_path) >= DELTA_MIN_SIZE)
+    except OSError:
+        return False
+
+
+class _Throttle:
+    """Forwards at most one progress report per interval, plus the final one"""
+
+    def __init__(self, emit, cancel_event=None, interval=PROGRESS_INTERVAL):
+        self.emit = emit
+        self.cancel_event = cancel_event
+        self.interval = interval
+        self.last = 0.0
+
+    def __call__(self, done, total):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise TransferCancelled()
+        now = time.monotonic()
+        if total is not None and done < total and now - self.last < self.interval:
+            return
+        self.last = now
+        self.emit(done, total if total is not None else 0)
+
+
+class FileTransferThread(QThread):
+    """Single transfer running in its own thread"""
+    progress_updated = pyqtSignal(int)               # percent
+    transfer_completed = pyqtSignal(bool, str)       # success, message
+
+    def __init__(self, client, operation, **kwargs):
+        super().__init__()
+        self.client = client
+        self.operation = operation
+        self.kwargs = kwargs
+        self.cancel_event = threading.Event()
+
+    def run(self):
+        progress = _Throttle(self._emit_percent, self.cancel_event)
+        try:
+            success, message = run_transfer(self.client, self.operation,
+                                            progress_callback=progress, **self.kwargs)
+        except TransferCancelled:
+            success, message = False, "Transfer cancelled"
+        except Exception as e:
+            success, message = False, str(e)
+        self.transfer_completed.emit(success, message)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _emit_percent(self, done, total):
+        self.progress_updated.emit(int(done * 100 / total) if total else 100)
+
+
+class TransferPool(QObject):
+    """Bounded pool of transfer workers.
+
+    Every job gets an id; signals carry it so the UI can tell jobs apart.
+    Byte counts use qint64 so files over 2 GB report correctly.
+    All jobs share one BandwidthScheduler (self.bandwidth) for speed limits.
+    """
+    transfer_started = pyqtSignal(str)
+    progress_updated = pyqtSignal(str, 'qint64', 'qint64')   # job id, done, total
+    transfer_completed = pyqtSignal(str, bool, str)          # job id, success, message
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, client=None):
+        super().__init__()
+        self.client = client
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="cryptport-transfer")
+        self._cancel_events = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self.bandwidth = BandwidthScheduler()
+
+    def submit(self, operation, job_id=None, rate_limit=None, **kwargs) -> str:
+        """Queue a transfer and return its job id.
+
+        rate_limit caps this job in bytes per second (None for no cap).
+        After shutdown() the job is not run; it completes at once as failed.
+        """
+        job_id = job_id or uuid.uuid4().hex
+        cancel_event = threading.Event()
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._cancel_events[job_id] = cancel_event
+                self.executor.submit(self._run, job_id, operation, cancel_event, rate_limit, kwargs)
+        if closed:
+            self.transfer_completed.emit(job_id, False, "Transfers are shutting down")
+        return job_id
+
+    def set_rate_limit(self, job_id, rate):
+        """Change a running job's cap, bytes per second or None"""
+        self.bandwidth.set_transfer_rate(job_id, rate)
+
+    def cancel(self, job_id):
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+        if event:
+            event.set()
+
+    def active_count(self) -> int:
+        with self._lock:
+            return len(self._cancel_events)
+
+    def shutdown(self, wait=False):
+        """Cancel everything still running and stop the workers"""
+        with self._lock:
+            self._closed = True
+            for event in self._cancel_events.values():
+                event.set()
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job_id, operation, cancel_event, rate_limit, kwargs):
+        if cancel_event.is_set():
+            self._finish(job_id, False, "Transfer cancelled")
+            return
+        self.transfer_started.emit(job_id)
+        progress = _Throttle(lambda done, total: self.progress_updated.emit(job_id, done, total),
+                             cancel_event)
+        limit = self.bandwidth.register(job_id, rate_limit)
+        try:
+            success, message = run_transfer(self.client, operation,
+                                            progress_callback=limit.wrap(progress), **kwargs)
+        except TransferCancelled:
+            success, message = False, "Transfer cancelled"
+        except Exception as e:
+            success, message = False, str(e)
+        finally:
+            self.bandwidth.unregister(job_id)
+        self._finish(job_id, success, message)
+
+    def _finish(self, job_id, success, message):
+        with self._lock:
+            self._cancel_events.pop(job_id, None)
+        self.transfer_completed.emit(job_id, success, message)
@@ -0,0 +1,175 @@
+"""
+Streaming directory archives for CryptPort
+DirectoryArchive is a readable file object producing a tar stream of a
+directory tree while it is being read. A background thread walks the tree
+with os.scandir and feeds the tar writer through a small bounded queue, so
+walking, reading files and sending all overlap and nothing touches a temp
+file. A tree of many small files becomes one transfer.
+"""
+
+import io
+import os
+import queue
+import stat
+import tarfile
+import threading
+
+PIPE_BLOCK = 1024 * 1024     # bytes handed from the walker to the reader at a time
+PIPE_DEPTH = 8               # blocks buffered ahead of the reader
+
+
+def walk(root):
+    """Yield (relative path, DirEntry) for everything under root, parents first"""
+    stack = [""]
+    while stack:
+        relative_dir = stack.pop()
+        try:
+            with os.scandir(os.path.join(root, relative_dir)) as entries:
+                children = sorted(entries, key=lambda e: e.name)
+        except OSError:
+            continue  # unreadable directory: leave it out rather than fail the whole tree
+        for entry in children:
+            relative = os.path.join(relative_dir, entry.name) if relative_dir else entry.name
+            yield relative, entry
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(relative)
+
+
+class _ArchiveStopped(Exception):
+    """The reader went away; the walker thread should stop"""
+
+
+class _QueueWriter:
+    """File-like sink for tarfile that batches writes into queue blocks"""
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= PIPE_BLOCK:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.archive._put(bytes(self.buffer))
+            self.buffer.clear()
+
+
+class DirectoryArchive(io.RawIOBase):
+    """Readable tar stream of a directory tree, built on the fly"""
+
+    def __init__(self, root, arcname=None):
+        super().__init__()
+        self.root = root
+        self.arcname = arcname or os.path.basename(os.path.normpath(root))
+        self.files = 0
+        self.file_bytes = 0
+        self._queue = queue.Queue(maxsize=PIPE_DEPTH)
+        self._stop = threading.Event()
+        self._current = memoryview(b"")
+        self._finished = False
+        self._thread = threading.Thread(target=self._produce, name="cryptport-archive", daemon=True)
+        self._thread.start()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not len(self._current):
+            if self._finished:
+                return 0
+            item = self._queue.get()
+            if item is None:
+                self._finished = True
+                return 0
+            if isinstance(item, BaseException):
+                self._finished = True
+                raise item
+            self._current = memoryview(item)
+        n = min(len(b), len(self._current))
+        b[:n] = self._current[:n]
+        self._current = self._current[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            while self._thread.is_alive():  # unblock the walker if it waits on a full queue
+                try:
+                    self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        super().close()
+
+    def _put(self, item):
+        while True:
+            if self._stop.is_set():
+                raise _ArchiveStopped()
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _produce(self):
+        writer = _QueueWriter(self)
+        try:
+            with tarfile.open(fileobj=writer, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                tar.addfile(self._tarinfo(self.arcname, os.lstat(self.root)))
+                for relative, entry in walk(self.root):
+                    self._add(tar, relative, entry)
+            writer.flush()
+        except _ArchiveStopped:
+            return
+        except BaseException as e:
+            try:
+                self._put(e)
+            except _ArchiveStopped:
+                pass
+            return
+        try:
+            self._put(None)
+        except _ArchiveStopped:
+            pass
+
+    def _add(self, tar, relative, entry):
+        name = f"{self.arcname}/{relative.replace(os.sep, '/')}"
+        try:
+            st = entry.stat(follow_symlinks=False)
+            info = self._tarinfo(name, st)
+            if info is None:
+                return  # sockets, devices and fifos are not transferred
+            if info.type == tarfile.SYMTYPE:
+                info.linkname = os.readlink(entry.path)
+                tar.addfile(info)
+            elif info.type == tarfile.DIRTYPE:
+                tar.addfile(info)
+            else:
+                with open(entry.path, "rb") as f:
+                    tar.addfile(info, f)
+                self.files += 1
+                self.file_bytes += info.size
+        except (FileNotFoundError, PermissionError):
+            pass  # vanished or unreadable since the walk saw it
+
+    @staticmethod
+    def _tarinfo(name, st):
+        """TarInfo straight from a stat result, skipping tarfile's own lstat and user lookups"""
+        info = tarfile.TarInfo(name)
+        info.mode = stat.S_IMODE(st.st_mode)
+        info.mtime = int(st.st_mtime)
+        info.uid = st.st_uid
+        info.gid = st.st_gid
+        if stat.S_ISREG(st.st_mode):
+            info.type = tarfile.REGTYPE
+            info.size = st.st_size
+        elif stat.S_ISDIR(st.st_mode):
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(st.st_mode):
+            info.type = tarfile.SYMTYPE
+        else:
+            return None
+        return info
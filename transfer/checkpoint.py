@@ -0,0 +1,138 @@
+"""
+On-disk transfer checkpoints for CryptPort
+A transfer writes into '<target>.part' and records confirmed progress in
+'<target>.part.json': the byte offset reached and a hash per completed block.
+After a crash or restart the partial file is checked against those hashes and
+the transfer continues from the last block that still matches.
+
+The block hashes are the ones transfer.integrity uses, so a finished
+checkpoint also yields the file's integrity digest (hexdigest()).
+
+ResumeRecords keeps the same kind of note for transfers that do not write a
+'.part' file of their own (chunk store ingests, server uploads), one small
+JSON file per transfer, so a later session can pick them up.
+"""
+
+import hashlib
+import json
+import os
+import uuid
+
+from transfer.integrity import BLOCK_SIZE, BlockDigest, block_hash
+
+PART_SUFFIX = ".part"
+CHECKPOINT_SUFFIX = ".part.json"
+
+
+class Checkpoint(BlockDigest):
+    """Confirmed progress of one transfer into target_path"""
+
+    def __init__(self, target_path, source_id, size, block_size=BLOCK_SIZE, hashes=None):
+        super().__init__(block_size, hashes)
+        self.target_path = target_path
+        self.part_path = target_path + PART_SUFFIX
+        self.checkpoint_path = target_path + CHECKPOINT_SUFFIX
+        self.source_id = source_id
+        self.size = size
+
+    @property
+    def offset(self) -> int:
+        """Bytes confirmed by complete blocks"""
+        return min(len(self.hashes) * self.block_size, self.size)
+
+    @classmethod
+    def open(cls, target_path, source_id, size, block_size=BLOCK_SIZE):
+        """Load a matching checkpoint and verify its partial file, or start fresh"""
+        checkpoint = cls(target_path, source_id, size, block_size)
+        try:
+            with open(checkpoint.checkpoint_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return checkpoint
+        if (saved.get("source_id") == source_id and saved.get("size") == size
+                and saved.get("block_size") == block_size):
+            checkpoint.hashes = saved.get("hashes", [])
+            checkpoint.verify()
+        return checkpoint
+
+    def verify(self) -> int:
+        """Drop every block from the first one that no longer matches the partial file"""
+        good = 0
+        try:
+            with open(self.part_path, "rb") as part:
+                buffer = bytearray(self.block_size)
+                for expected in self.hashes:
+                    n = part.readinto(buffer)
+                    if not n or block_hash(memoryview(buffer)[:n]) != expected:
+                        break
+                    good += 1
+        except OSError:
+            good = 0
+        self.hashes = self.hashes[:good]
+        return self.offset
+
+    def update(self, data):
+        """Feed bytes that were just written after offset; completes blocks as they fill"""
+        super().update(data)
+        if self._pending and self.offset + self._pending >= self.size:
+            self._close_block()  # short last block
+
+    def save(self):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"source_id": self.source_id, "size": self.size,
+                       "block_size": self.block_size, "hashes": self.hashes}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def finish(self):
+        """Move the completed partial file into place and forget the checkpoint"""
+        os.replace(self.part_path, self.target_path)
+        self.remove_checkpoint()
+
+    def discard(self):
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+        self.remove_checkpoint()
+
+    def remove_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+
+class ResumeRecords:
+    """Progress notes of unfinished transfers, one JSON file per key under folder"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def load(self, key):
+        """The data saved under key, or None"""
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return saved.get("data") if saved.get("key") == key else None
+
+    def save(self, key, data):
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "data": data}, f)
+        os.replace(tmp_path, path)
+
+    def remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _path(self, key):
+        return os.path.join(self.folder, hashlib.sha256(key.encode()).hexdigest()[:32] + ".json")
+
+
+def local_source_id(path) -> str:
+    """Identity of a local source file; changes when the file is modified"""
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
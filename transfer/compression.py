@@ -0,0 +1,207 @@
+"""
+Adaptive streaming compression for CryptPort
+Each file is sampled before sending: data that is already compressed (JPEG,
+ZIP, encrypted output...) has close to 8 bits of entropy per byte and is sent
+as-is, so CPU is only spent where it shrinks what goes over the wire.
+
+zlib and lzma come with Python; zstd is used when the 'zstandard' package is
+installed.
+"""
+
+import lzma
+import math
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from transfer.mapped import read_chunks
+
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_COUNT = 4
+ENTROPY_LIMIT = 7.5          # bits per byte; above this compression rarely pays
+MIN_SAVING = 0.05            # keep a compressed chunk only if it is 5% smaller
+MIN_COMPRESS_SIZE = 4 * 1024
+
+# Leading bytes of formats that are already compressed or encrypted
+COMPRESSED_MAGIC = (
+    b"\xff\xd8\xff",             # JPEG
+    b"\x89PNG",                  # PNG
+    b"PK\x03\x04",               # ZIP, DOCX, XLSX, JAR, APK
+    b"\x1f\x8b",                 # gzip
+    b"\x28\xb5\x2f\xfd",         # zstd
+    b"\xfd7zXZ\x00",             # xz
+    b"7z\xbc\xaf\x27\x1c",       # 7-Zip
+    b"BZh",                      # bzip2
+    b"Rar!",                     # RAR
+    b"%PDF",                     # PDF streams are mostly deflated
+    b"OggS", b"fLaC", b"ID3",    # audio
+    b"\x1a\x45\xdf\xa3",         # Matroska / WebM
+    b"CPX",                      # CryptPort encrypted container, any version (transfer.crypto)
+)
+
+
+class _ZlibCodec:
+    name = "zlib"
+
+    def __init__(self, level=1):
+        self.level = level
+
+    def compressor(self):
+        return zlib.compressobj(self.level)
+
+    def decompressor(self):
+        return zlib.decompressobj()
+
+
+class _LzmaCodec:
+    name = "lzma"
+
+    def __init__(self, preset=1):
+        self.preset = preset
+
+    def compressor(self):
+        return _FlushAdapter(lzma.LZMACompressor(preset=self.preset))
+
+    def decompressor(self):
+        return _FlushAdapter(lzma.LZMADecompressor())
+
+
+class _ZstdCodec:
+    name = "zstd"
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def compressor(self):
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def decompressor(self):
+        return _FlushAdapter(zstandard.ZstdDecompressor().decompressobj())
+
+
+class _FlushAdapter:
+    """Give every streaming object the same compress/decompress/flush shape"""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def compress(self, data):
+        return self.inner.compress(data)
+
+    def decompress(self, data):
+        return self.inner.decompress(data)
+
+    def flush(self):
+        flush = getattr(self.inner, "flush", None)
+        return flush() if flush else b""
+
+
+CODEC_NAMES = ("zlib", "lzma", "zstd")   # every codec a stored or sent stream may use
+CODECS = {"zlib": _ZlibCodec(), "lzma": _LzmaCodec()}
+if zstandard is not None:
+    CODECS["zstd"] = _ZstdCodec()
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Compression '{name}' is not available") from None
+
+
+def default_codec_name() -> str:
+    return "zstd" if "zstd" in CODECS else "zlib"
+
+
+def entropy(data) -> float:
+    """Shannon entropy in bits per byte"""
+    if not data:
+        return 0.0
+    data = bytes(data)
+    total = len(data)
+    result = 0.0
+    for value in range(256):
+        count = data.count(value)
+        if count:
+            p = count / total
+            result -= p * math.log2(p)
+    return result
+
+
+def sample_file(path, sample_size=SAMPLE_SIZE, samples=SAMPLE_COUNT):
+    """A few slices spread over the file (start, middle, end)"""
+    size = os.path.getsize(path)
+    if size <= sample_size * samples:
+        with open(path, "rb") as f:
+            return [f.read()]
+    step = (size - sample_size) // (samples - 1)
+    pieces = []
+    with open(path, "rb") as f:
+        for i in range(samples):
+            f.seek(i * step)
+            pieces.append(f.read(sample_size))
+    return pieces
+
+
+def looks_compressible(data) -> bool:
+    """Quick check on the head of a block"""
+    if len(data) < MIN_COMPRESS_SIZE:
+        return False
+    if bytes(data[:8]).startswith(COMPRESSED_MAGIC):
+        return False
+    return entropy(data[:SAMPLE_SIZE]) < ENTROPY_LIMIT
+
+
+def choose_codec(path, preferred=None):
+    """Codec name worth using for this file, or None to send it as-is"""
+    try:
+        pieces = sample_file(path)
+    except OSError:
+        return None
+    if not pieces or len(pieces[0]) < MIN_COMPRESS_SIZE:
+        return None
+    if bytes(pieces[0][:8]).startswith(COMPRESSED_MAGIC):
+        return None
+    if sum(entropy(piece) for piece in pieces) / len(pieces) >= ENTROPY_LIMIT:
+        return None
+    return preferred or default_codec_name()
+
+
+def compress_stream(codec_name, src, chunk_size=1024 * 1024, progress_callback=None, total=None,
+                    digest=None):
+    """Yield compressed pieces of a file object, reading one chunk at a time.
+
+    digest (e.g. an integrity.BlockDigest) is fed the uncompressed chunks.
+    """
+    compressor = get_codec(codec_name).compressor()
+    done = 0
+    for chunk in read_chunks(src, chunk_size):
+        done += len(chunk)
+        if digest:
+            digest.update(chunk)
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+        if progress_callback:
+            progress_callback(done, total)
+    tail = compressor.flush()
+    if tail:
+        yield tail
+
+
+def compress_block(codec_name, data):
+    """Compress one independent block; returns None when it would not save enough"""
+    compressor = get_codec(codec_name).compressor()
+    out = compressor.compress(data) + compressor.flush()
+    if len(out) > len(data) * (1 - MIN_SAVING):
+        return None
+    return out
+
+
+def decompress_block(codec_name, data):
+    decompressor = get_codec(codec_name).decompressor()
+    return decompressor.decompress(data) + decompressor.flush()
@@ -0,0 +1,370 @@
+"""
+Streaming authenticated encryption for CryptPort
+Files are encrypted chunk by chunk with AES-256-GCM (or ChaCha20-Poly1305,
+which is faster on CPUs without AES instructions), so memory use stays at
+one chunk no matter how large the file is. The container is:
+
+    header:  magic "CPX" | version | algorithm | chunk size (4) | KDF salt (16)
+             | file salt (16) | nonce prefix (7)
+    chunks:  ciphertext + 16-byte tag; every chunk but the last is exactly chunk size
+
+Each chunk is sealed on its own with the nonce  prefix | chunk index (4) | last
+flag (1)  and the header as associated data. A chunk that was altered, moved,
+or taken from another file fails its tag, and so does a file cut short: the
+final chunk is always shorter than the chunk size (empty if need be) and is
+the only one sealed with the last flag.
+
+Because chunks are independent, encrypt_file and decrypt_file spread them
+over one thread pool shared by every transfer and write the results back in
+order; files of INLINE_CHUNKS chunks or fewer skip the pool. EncryptingReader
+and DecryptingWriter do the same work on the fly, for data that is being
+sent or received rather than written to disk.
+
+Keys: scrypt turns the passphrase and the KDF salt into a master key, and
+HKDF turns the master key and the file salt into the file's own key. A
+session uses one KDF salt for everything it encrypts, so transfer.keys.KeyCache
+runs the slow scrypt once and each file only costs an HKDF. Version 1
+containers (one salt, file key straight from scrypt) can still be opened.
+
+Needs the 'cryptography' package.
+"""
+
+import collections
+import hashlib
+import io
+import itertools
+import os
+import secrets
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+except ImportError:
+    AESGCM = ChaCha20Poly1305 = HKDF = None
+    InvalidTag = ()
+
+from transfer.mapped import read_chunks
+
+MAGIC = b"CPX"
+VERSION = 2
+AES_GCM = 1
+CHACHA20_POLY1305 = 2
+CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024     # refuse headers that would make us allocate more
+TAG_SIZE = 16
+SALT_SIZE = 16
+# magic, version, algorithm, chunk size, KDF salt, file salt, nonce prefix
+HEADER = struct.Struct("!3sBBI16s16s7s")
+HEADER_V1 = struct.Struct("!3sBBI16s7s")   # read only: no file salt
+HEADERS = {1: HEADER_V1, 2: HEADER}
+ENCRYPTED_SUFFIX = ".cpx"
+CRYPTO_WORKERS = min(32, os.cpu_count() or 1)   # threads sealing or opening chunks, shared by all files
+INLINE_CHUNKS = 2           # files this short are sealed on the calling thread; a pool hop costs more
+
+SCRYPT_N = 2 ** 15          # about 0.1 s and 32 MiB per derivation
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+
+class CryptoError(Exception):
+    """Encrypted data is damaged, was tampered with, or the passphrase is wrong"""
+
+
+def _aead(algorithm, key):
+    if AESGCM is None:
+        raise CryptoError("Encryption needs the 'cryptography' package")
+    if algorithm == AES_GCM:
+        return AESGCM(key)
+    if algorithm == CHACHA20_POLY1305:
+        return ChaCha20Poly1305(key)
+    raise CryptoError(f"Unknown cipher: {algorithm}")
+
+
+def derive_key(passphrase, salt) -> bytes:
+    """256-bit master key from a passphrase (str or UTF-8 bytes); deliberately slow"""
+    if isinstance(passphrase, str):
+        passphrase = passphrase.encode("utf-8")
+    return hashlib.scrypt(passphrase, salt=salt, n=SCRYPT_N, r=SCRYPT_R,
+                          p=SCRYPT_P, maxmem=64 * 1024 * 1024, dklen=32)
+
+
+def file_key(master_key, file_salt) -> bytes:
+    """Key for one file: HKDF-SHA256 of the master key with the file's salt; fast"""
+    if HKDF is None:
+        raise CryptoError("Encryption needs the 'cryptography' package")
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=file_salt,
+                info=b"cryptport file key").derive(bytes(master_key))
+
+
+def encrypted_size(size, chunk_size=CHUNK_SIZE) -> int:
+    """Container size for a plaintext of size bytes"""
+    return HEADER.size + size + (size // chunk_size + 1) * TAG_SIZE
+
+
+class ChunkCipher:
+    """Seals and opens the chunks of one container; any chunk, in any order"""
+
+    def __init__(self, key, header, algorithm, chunk_size, prefix):
+        self.header = bytes(header)
+        self.chunk_size = chunk_size
+        self.prefix = prefix
+        self.aead = _aead(algorithm, key)
+
+    def nonce(self, index, last) -> bytes:
+        if index >= 2 ** 32:
+            raise CryptoError("File is too large for one container")
+        return self.prefix + struct.pack("!IB", index, last)
+
+    def seal(self, index, data, last) -> bytes:
+        return self.aead.encrypt(self.nonce(index, last), data, self.header)
+
+    def open(self, index, data, last) -> bytes:
+        try:
+            return self.aead.decrypt(self.nonce(index, last), data, self.header)
+        except InvalidTag:
+            raise CryptoError("Encrypted data is damaged or the passphrase is wrong") from None
+
+
+class Encryptor:
+    """Turns a plaintext stream into a container, one chunk at a time"""
+
+    def __init__(self, key, kdf_salt, file_salt, algorithm=AES_GCM, chunk_size=CHUNK_SIZE):
+        prefix = secrets.token_bytes(7)
+        self.header = HEADER.pack(MAGIC, VERSION, algorithm, chunk_size, kdf_salt, file_salt, prefix)
+        self.cipher = ChunkCipher(key, self.header, algorithm, chunk_size, prefix)
+
+    def chunks(self, src, workers=1):
+        """Yield the header, then each sealed chunk of the file object src, in order"""
+        yield self.header
+        yield from map_ordered(self.cipher.seal, self._jobs(src), workers)
+
+    def _jobs(self, src):
+        index = 0
+        last = False
+        for chunk in read_chunks(src, self.cipher.chunk_size):
+            last = len(chunk) < self.cipher.chunk_size  # only the final chunk comes up short
+            yield index, chunk, last
+            index += 1
+        if not last:
+            yield index, b"", True
+
+
+class Decryptor:
+    """Turns container bytes, fed in pieces of any size, back into plaintext.
+
+    key_for(kdf_salt, file_salt) supplies the key once the header has arrived
+    (file_salt is None for a version 1 container). update and
+    finalize open chunks as they complete; split and split_final only cut
+    them out, as (index, chunk, last) jobs for open, e.g. on a thread pool.
+    """
+
+    def __init__(self, key_for):
+        self.key_for = key_for
+        self.cipher = None
+        self.buffer = bytearray()
+        self.index = 0
+        self.done = False
+
+    def update(self, data):
+        """Plaintext for every chunk that data completes"""
+        return [self.open(*job) for job in self.split(data)]
+
+    def finalize(self) -> bytes:
+        """Plaintext of the final chunk; raises CryptoError if the file was cut short"""
+        return self.open(*self.split_final())
+
+    def open(self, index, chunk, last) -> bytes:
+        return self.cipher.open(index, chunk, last)
+
+    def split(self, data):
+        self.buffer += data
+        if self.cipher is None:
+            if len(self.buffer) < 4:
+                return []
+            layout = HEADERS.get(self.buffer[3])
+            if layout is None or self.buffer[:3] != MAGIC:
+                raise CryptoError("Not a CryptPort encrypted file")
+            if len(self.buffer) < layout.size:
+                return []
+            self._read_header(layout)
+        jobs = []
+        stride = self.cipher.chunk_size + TAG_SIZE
+        # A full chunk is never the last one, but only more data tells us it is full
+        while len(self.buffer) > stride or (self.done and self.buffer):
+            if self.done:
+                raise CryptoError("Data follows the end of the encrypted file")
+            with memoryview(self.buffer) as view:
+                jobs.append((self.index, bytes(view[:stride]), False))
+            del self.buffer[:stride]
+            self.index += 1
+        return jobs
+
+    def split_final(self):
+        # A full chunk left over means the (possibly empty) final chunk is missing
+        if (self.cipher is None or self.done
+                or not TAG_SIZE <= len(self.buffer) < self.cipher.chunk_size + TAG_SIZE):
+            raise CryptoError("Encrypted file is incomplete")
+        chunk, self.buffer = bytes(self.buffer), bytearray()
+        self.done = True
+        return self.index, chunk, True
+
+    def _read_header(self, layout):
+        header = bytes(self.buffer[:layout.size])
+        if layout is HEADER_V1:
+            _, _, algorithm, chunk_size, kdf_salt, prefix = layout.unpack(header)
+            file_salt = None
+        else:
+            _, _, algorithm, chunk_size, kdf_salt, file_salt, prefix = layout.unpack(header)
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise CryptoError("Encrypted file has a damaged header")
+        self.cipher = ChunkCipher(self.key_for(kdf_salt, file_salt), header, algorithm, chunk_size, prefix)
+        del self.buffer[:layout.size]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _shared_pool() -> ThreadPoolExecutor:
+    """The crypto thread pool, started on first use and shared by every file"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix="cryptport-crypto")
+        return _pool
+
+
+def map_ordered(fn, jobs, workers=1):
+    """Yield fn(*job) for every (index, chunk, last) job, in job order.
+
+    With several workers the jobs run on the shared thread pool (the ciphers
+    release the GIL), at most two per worker in flight so memory stays
+    bounded. Files of up to INLINE_CHUNKS chunks run inline.
+    """
+    jobs = iter(jobs)
+    if workers > 1:
+        # chunk may be a view into a buffer that is reused for the next read
+        head = [(index, bytes(chunk), last) for index, chunk, last in
+                itertools.islice(jobs, INLINE_CHUNKS + 1)]
+        if len(head) <= INLINE_CHUNKS:
+            workers = 1
+        jobs = itertools.chain(head, jobs)
+    if workers <= 1:
+        for job in jobs:
+            yield fn(*job)
+        return
+    pool = _shared_pool()
+    pending = collections.deque()
+    try:
+        for index, chunk, last in jobs:
+            pending.append(pool.submit(fn, index, bytes(chunk), last))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class EncryptingReader(io.RawIOBase):
+    """Readable container stream over a plaintext file object, encrypted as it is read.
+
+    Lets anything that sends or stores a stream (ChunkStore.put_stream, a
+    stream upload) encrypt on the way without an encrypted copy on disk.
+    """
+
+    def __init__(self, src, encryptor, workers=CRYPTO_WORKERS):
+        super().__init__()
+        self._chunks = encryptor.chunks(src, workers)
+        self._current = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not len(self._current):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._current = memoryview(chunk)
+        n = min(len(b), len(self._current))
+        b[:n] = self._current[:n]
+        self._current = self._current[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._chunks.close()  # stops the worker pool of an abandoned stream
+        super().close()
+
+
+class DecryptingWriter:
+    """Writes the plaintext of container bytes to out as they arrive.
+
+    finish() must follow the last write: it opens the final chunk, and it is
+    what detects a container that was cut short.
+    """
+
+    def __init__(self, out, decryptor):
+        self.out = out
+        self.decryptor = decryptor
+        self.received = 0   # container bytes written so far
+
+    def write(self, data):
+        for plain in self.decryptor.update(data):
+            self.out.write(plain)
+        self.received += len(data)
+        return len(data)
+
+    def finish(self):
+        self.out.write(self.decryptor.finalize())
+
+
+def encrypt_file(src_path, dst_path, keys, algorithm=AES_GCM, progress_callback=None,
+                 workers=CRYPTO_WORKERS):
+    """Encrypt src_path into a container at dst_path, keyed by a transfer.keys.KeyCache"""
+    encryptor = keys.encryptor(algorithm)
+    total = os.path.getsize(src_path)
+    with open(src_path, "rb") as src:
+        _write_atomic(dst_path, encryptor.chunks(src, workers), total, progress_callback)
+    return dst_path
+
+
+def decrypt_file(src_path, dst_path, keys, progress_callback=None, workers=CRYPTO_WORKERS):
+    """Decrypt a container; nothing is left at dst_path unless every chunk checked out"""
+    decryptor = keys.decryptor()
+    total = os.path.getsize(src_path)
+
+    def jobs():
+        with open(src_path, "rb") as src:
+            for data in read_chunks(src, CHUNK_SIZE + TAG_SIZE):
+                yield from decryptor.split(data)
+        yield decryptor.split_final()
+
+    _write_atomic(dst_path, map_ordered(decryptor.open, jobs(), workers), total, progress_callback)
+    return dst_path
+
+
+def _write_atomic(dst_path, pieces, total, progress_callback):
+    tmp_path = f"{dst_path}.part"
+    done = 0
+    try:
+        with open(tmp_path, "wb") as out:
+            for piece in pieces:
+                out.write(piece)
+                done += len(piece)
+                if progress_callback:
+                    progress_callback(min(done, total), total)
+        os.replace(tmp_path, dst_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
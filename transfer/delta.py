@@ -0,0 +1,279 @@
+"""
+rsync-style delta transfer for CryptPort
+The receiver describes the copy it already has as a list of per-block
+signatures (weak rolling checksum + strong hash). The sender slides a window
+over the new file and emits either references to blocks the receiver already
+has, or literal bytes for what changed. Only the literals cross the wire.
+
+Weak checksum is Adler-32: zlib computes it for a whole block at C speed and
+it can be rolled forward one byte at a time when a block does not match.
+
+Rolling is done in Python, so it is the slow part. After two blocks of
+rolling find nothing (one for the edit itself, one more for the shift an
+insertion or deletion leaves behind), the scan jumps a block at a time
+(checked at C speed, keeping the alignment of the last match, which is where
+in-place edits leave the data) and only rolls again every RESCAN_INTERVAL
+blocks.
+
+A delta is only worth it against a related copy: senders can probe() the
+first PROBE_SIZE bytes and give up on the delta when most of it is literal.
+"""
+
+import hashlib
+import math
+import os
+import struct
+import zlib
+
+MIN_BLOCK_SIZE = 2 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+DELTA_MIN_SIZE = 1024 * 1024          # below this a plain copy is cheaper
+READ_SIZE = 4 * 1024 * 1024
+LITERAL_LIMIT = 1024 * 1024            # flush literal runs at this size
+RESCAN_INTERVAL = 32                   # blocks skipped between byte-by-byte rescans
+PROBE_SIZE = 8 * 1024 * 1024           # bytes diffed before deciding whether a delta pays off
+MAX_LITERAL_RATIO = 0.5                # more literal than this and a plain upload is cheaper
+ADLER_MOD = 65521
+
+SIGNATURE_RECORD = struct.Struct(">I16s")   # weak checksum, strong hash
+
+COPY = "copy"   # ("copy", first_block, block_count)
+DATA = "data"   # ("data", bytes)
+
+
+def choose_block_size(size: int) -> int:
+    """Square-root rule like rsync, rounded to a power of two"""
+    if size <= 0:
+        return MIN_BLOCK_SIZE
+    block = 1 << max(0, int(math.log2(math.isqrt(size) or 1)))
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block))
+
+
+def strong_hash(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class Signature:
+    """Block signatures of the receiver's existing copy"""
+
+    def __init__(self, block_size, size, blocks):
+        self.block_size = block_size
+        self.size = size
+        self.blocks = blocks   # list of (weak, strong)
+        self.index = {}
+        for number, (weak, strong) in enumerate(blocks):
+            self.index.setdefault(weak, []).append(number)
+
+    def block_length(self, number) -> int:
+        return min(self.block_size, self.size - number * self.block_size)
+
+    def find(self, weak, window):
+        """Block number whose hashes match window, or None"""
+        candidates = self.index.get(weak)
+        if not candidates:
+            return None
+        strong = strong_hash(window)
+        for number in candidates:
+            if self.blocks[number][1] == strong and self.block_length(number) == len(window):
+                return number
+        return None
+
+    def to_bytes(self) -> bytes:
+        return b"".join(SIGNATURE_RECORD.pack(weak, strong) for weak, strong in self.blocks)
+
+    @classmethod
+    def from_bytes(cls, block_size, size, data):
+        blocks = [SIGNATURE_RECORD.unpack_from(data, offset)
+                  for offset in range(0, len(data), SIGNATURE_RECORD.size)]
+        return cls(block_size, size, blocks)
+
+
+def file_signature(path, block_size=None) -> Signature:
+    size = os.path.getsize(path)
+    block_size = block_size or choose_block_size(size)
+    blocks = []
+    with open(path, "rb") as f:
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            block = view[:n]
+            blocks.append((zlib.adler32(block), strong_hash(block)))
+    return Signature(block_size, size, blocks)
+
+
+def compute_delta(src, signature: Signature, progress_callback=None, total=None):
+    """Yield COPY and DATA operations that rebuild src from the signed copy.
+
+    Consecutive block references are merged into one COPY run.
+    """
+    n = signature.block_size
+    buf = bytearray()
+    pos = 0             # start of the current window in buf
+    literal_start = 0   # start of unmatched bytes in buf
+    consumed = 0        # bytes of src dropped from the front of buf
+    eof = False
+    weak = None
+    a = b = 0
+    pending_copy = None  # [first_block, count]
+    budget = 2 * n       # bytes we may still roll before jumping whole blocks
+    skipped = 0
+
+    def fill():
+        nonlocal eof
+        chunk = src.read(READ_SIZE)
+        if chunk:
+            buf.extend(chunk)
+        else:
+            eof = True
+
+    while True:
+        if not eof and len(buf) - pos < n + 1:
+            fill()
+            continue
+        window_end = min(pos + n, len(buf))
+        if window_end <= pos:
+            break
+
+        if weak is None:
+            weak = zlib.adler32(buf[pos:window_end])
+            a, b = weak & 0xFFFF, weak >> 16
+
+        # Slicing copies, so only do it when the weak checksum already matched
+        number = signature.find(weak, buf[pos:window_end]) if weak in signature.index else None
+        if number is not None:
+            if literal_start < pos:
+                if pending_copy:
+                    yield (COPY, *pending_copy)
+                    pending_copy = None
+                yield (DATA, bytes(buf[literal_start:pos]))
+            if pending_copy and pending_copy[0] + pending_copy[1] == number:
+                pending_copy[1] += 1
+            else:
+                if pending_copy:
+                    yield (COPY, *pending_copy)
+                pending_copy = [number, 1]
+            pos = window_end
+            literal_start = pos
+            weak = None
+            budget = 2 * n
+            skipped = 0
+        else:
+            if window_end - pos < n and eof:
+                # Short tail that matched nothing: all literal
+                pos = window_end
+                break
+            if budget > 0:
+                out_byte = buf[pos]
+                in_byte = buf[window_end] if window_end < len(buf) else None
+                pos += 1
+                budget -= 1
+                if in_byte is None:
+                    weak = None  # window shrinks at end of file; recompute
+                else:
+                    a = (a - out_byte + in_byte) % ADLER_MOD
+                    b = (b - n * out_byte + a - 1) % ADLER_MOD
+                    weak = (b << 16) | a
+            else:
+                pos = window_end
+                weak = None
+                skipped += 1
+                if skipped % RESCAN_INTERVAL == 0:
+                    budget = 2 * n
+            if pos - literal_start >= LITERAL_LIMIT:
+                if pending_copy:
+                    yield (COPY, *pending_copy)
+                    pending_copy = None
+                yield (DATA, bytes(buf[literal_start:pos]))
+                literal_start = pos
+
+        # Drop bytes that can no longer be referenced
+        if literal_start > READ_SIZE:
+            del buf[:literal_start]
+            consumed += literal_start
+            pos -= literal_start
+            literal_start = 0
+            if progress_callback:
+                progress_callback(consumed, total)
+
+    if pending_copy:
+        yield (COPY, *pending_copy)
+    if literal_start < len(buf):
+        yield (DATA, bytes(buf[literal_start:]))
+    if progress_callback:
+        progress_callback(consumed + len(buf), total)
+
+
+def probe(operations, block_size, limit=PROBE_SIZE) -> tuple:
+    """(first operations, covering about limit bytes of output, share of those bytes that is literal)
+
+    operations is left positioned after the ones taken, so the caller can
+    send those and carry on with the rest.
+    """
+    taken = []
+    covered = literal = 0
+    for op in operations:
+        taken.append(op)
+        if op[0] == COPY:
+            covered += op[2] * block_size
+        else:
+            covered += len(op[1])
+            literal += len(op[1])
+        if covered >= limit:
+            break
+    return taken, literal / covered if covered else 0.0
+
+
+def apply_delta(basis_fd, operations, out, block_size, copy_chunk=8 * 1024 * 1024) -> int:
+    """Write the rebuilt file to out; COPY runs are read from basis_fd in bounded pieces"""
+    written = 0
+    for op in operations:
+        if op[0] == COPY:
+            written += copy_blocks(basis_fd, op[1], op[2], block_size, out, copy_chunk)
+        else:
+            out.write(op[1])
+            written += len(op[1])
+    return written
+
+
+def copy_blocks(basis_fd, first, count, block_size, out, copy_chunk=8 * 1024 * 1024) -> int:
+    """Write `count` basis blocks starting at block `first` to out; returns bytes written"""
+    start = first * block_size
+    remaining = count * block_size
+    written = 0
+    while remaining > 0:
+        data = os.pread(basis_fd, min(copy_chunk, remaining), start)
+        if not data:
+            break
+        out.write(data)
+        start += len(data)
+        remaining -= len(data)
+        written += len(data)
+    return written
+
+
+def delta_copy_file(source_path, target_path, progress_callback=None) -> int:
+    """Update an existing local target from source, rewriting only through the delta.
+
+    Returns the number of literal bytes that had to be taken from the source.
+    """
+    signature = file_signature(target_path)
+    size = os.path.getsize(source_path)
+    part_path = target_path + ".delta"   # ".part" belongs to resumable copies
+    literal = 0
+    with open(source_path, "rb") as src, open(target_path, "rb") as basis, \
+            open(part_path, "wb") as out:
+        operations = compute_delta(src, signature, progress_callback, size)
+
+        def counted():
+            nonlocal literal
+            for op in operations:
+                if op[0] == DATA:
+                    literal += len(op[1])
+                yield op
+
+        apply_delta(basis.fileno(), counted(), out, signature.block_size)
+    os.replace(part_path, target_path)
+    return literal
@@ -0,0 +1,134 @@
+"""
+Streaming transfer engine for CryptPort
+Moves file data in bounded-size chunks so memory use stays flat for any file size.
+Uses kernel copy paths (copy_file_range / sendfile) when both ends are local files.
+Local copies go through '<target>.part' with checkpoints so an interrupted copy
+resumes; the checkpoint hashes are taken in a second pass over what was written.
+"""
+
+import errno
+import os
+
+from transfer.checkpoint import Checkpoint, local_source_id
+
+CHUNK_SIZE = 1024 * 1024  # 1 MiB per step, the only buffer we ever hold
+CHECKPOINT_INTERVAL = 64 * 1024 * 1024  # flush and record progress this often
+
+# Errors meaning "this kernel path is not available here", not a real I/O failure
+_FALLBACK_ERRNOS = {
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EBADF,
+    errno.EOPNOTSUPP, errno.ENOTSUP, errno.ESPIPE,
+}
+
+
+def copy_file_resumable(source_path: str, target_path: str, chunk_size: int = CHUNK_SIZE,
+                        progress_callback=None,
+                        checkpoint_interval: int = CHECKPOINT_INTERVAL) -> int:
+    """Copy through '<target>.part' with checkpoints so an interrupted copy resumes.
+
+    Data already confirmed by a previous attempt is verified, not copied again.
+    Each checkpoint interval is copied by the kernel where it can be, then read
+    back from the partial file to hash it, so the checkpoint vouches for what
+    actually landed on disk.
+
+    Returns the number of bytes copied by this call.
+    """
+    size = os.path.getsize(source_path)
+    checkpoint = Checkpoint.open(target_path, local_source_id(source_path), size)
+    offset = checkpoint.offset
+    mode = "r+b" if os.path.exists(checkpoint.part_path) else "w+b"
+
+    position = offset
+    with open(source_path, "rb") as src, open(checkpoint.part_path, mode) as dst:
+        dst.truncate(offset)
+        if progress_callback:
+            progress_callback(position, size)
+        try:
+            while position < size:
+                end = min(position + checkpoint_interval, size)
+                reached = _copy_range(src, dst, position, end, chunk_size, progress_callback, size)
+                _hash_range(dst, checkpoint, position, reached, chunk_size)
+                _save_checkpoint(dst, checkpoint)
+                position = reached
+                if reached < end:
+                    break  # source shrank underneath us
+        except BaseException:
+            _save_checkpoint(dst, checkpoint)  # keep what was confirmed for the next attempt
+            raise
+    checkpoint.finish()
+    return position - offset
+
+
+def _copy_range(src, dst, start, end, chunk_size, progress_callback, total) -> int:
+    """Copy src[start:end] to the same offset in dst. Returns how far we got."""
+    position = _kernel_copy(src, dst, start, end, chunk_size, progress_callback, total)
+    if position < end:
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        src.seek(position)
+        dst.seek(position)
+        while position < end:
+            n = src.readinto(view[:min(chunk_size, end - position)])
+            if not n:
+                break
+            dst.write(view[:n])
+            position += n
+            if progress_callback:
+                progress_callback(position, total)
+        dst.flush()
+    return position
+
+
+def _kernel_copy(src, dst, start, end, chunk_size, progress_callback, total) -> int:
+    """Try copy_file_range, then sendfile. Returns how far we got."""
+    position = start
+    for name in ("copy_file_range", "sendfile"):
+        if not hasattr(os, name):
+            continue
+        position = _kernel_loop(name, src.fileno(), dst.fileno(), position, end,
+                                chunk_size, progress_callback, total)
+        if position >= end:
+            break
+    return position
+
+
+def _kernel_loop(name, src_fd, dst_fd, position, end, chunk_size, progress_callback, total) -> int:
+    while position < end:
+        count = min(chunk_size, end - position)
+        try:
+            if name == "copy_file_range":
+                n = os.copy_file_range(src_fd, dst_fd, count, position, position)
+            else:
+                os.lseek(dst_fd, position, os.SEEK_SET)
+                n = os.sendfile(dst_fd, src_fd, position, count)
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+            break  # let the next path (or the buffered loop) carry on from here
+        if n == 0:
+            break  # source shrank underneath us
+        position += n
+        if progress_callback:
+            progress_callback(position, total)
+    return position
+
+
+def _hash_range(dst, checkpoint, start, end, chunk_size):
+    """Feed dst[start:end] to the checkpoint; the pages are still cached from the copy"""
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    dst.seek(start)
+    position = start
+    while position < end:
+        n = dst.readinto(view[:min(chunk_size, end - position)])
+        if not n:
+            break
+        checkpoint.update(view[:n])
+        position += n
+
+
+def _save_checkpoint(dst, checkpoint):
+    """Data must be on disk before the checkpoint claims it"""
+    dst.flush()
+    os.fsync(dst.fileno())
+    checkpoint.save()
@@ -0,0 +1,102 @@
+"""
+Inline integrity digests for CryptPort
+A file's digest is the SHA-256 of the SHA-256s of its 8 MiB blocks. Blocks can
+be hashed in any order, so parallel range uploads produce the same digest as a
+single stream, and every path computes it from the buffers it is already
+sending or writing: checking a transfer never reads the file a second time.
+"""
+
+import hashlib
+
+BLOCK_SIZE = 8 * 1024 * 1024
+
+
+class IntegrityError(Exception):
+    """Received data does not match the digest the sender computed"""
+
+
+def block_hash(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def combine(block_hashes) -> str:
+    """File digest from its block hashes, in file order"""
+    outer = hashlib.sha256()
+    for digest in block_hashes:
+        outer.update(bytes.fromhex(digest))
+    return outer.hexdigest()
+
+
+def check(expected, actual, what="File"):
+    """Raise IntegrityError unless the sender's digest (if it sent one) matches"""
+    if expected and expected != actual:
+        raise IntegrityError(f"{what} failed the integrity check")
+
+
+class BlockDigest:
+    """Running file digest fed with consecutive bytes, or with whole blocks by index"""
+
+    def __init__(self, block_size=BLOCK_SIZE, hashes=None):
+        self.block_size = block_size
+        self.hashes = list(hashes or [])
+        self._hasher = hashlib.sha256()
+        self._pending = 0  # bytes fed into the current, unfinished block
+
+    def update(self, data):
+        view = memoryview(data)
+        while len(view):
+            take = min(self.block_size - self._pending, len(view))
+            self._hasher.update(view[:take])
+            self._pending += take
+            view = view[take:]
+            if self._pending == self.block_size:
+                self._close_block()
+
+    def set_block(self, index, digest):
+        """Record the hash of block `index`, e.g. from one range of a parallel upload"""
+        if index >= len(self.hashes):
+            self.hashes.extend([None] * (index + 1 - len(self.hashes)))
+        self.hashes[index] = digest
+
+    def hexdigest(self) -> str:
+        if self._pending:
+            self._close_block()  # short last block
+        if None in self.hashes:
+            raise IntegrityError("Digest is missing blocks")
+        return combine(self.hashes)
+
+    def _close_block(self):
+        self.hashes.append(self._hasher.hexdigest())
+        self._hasher = hashlib.sha256()
+        self._pending = 0
+
+
+class HashingReader:
+    """File object wrapper that feeds everything read through it into a digest"""
+
+    def __init__(self, raw, digest):
+        self.raw = raw
+        self.digest = digest
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.digest.update(data)
+        return data
+
+    def readinto(self, buffer):
+        n = self.raw.readinto(buffer)
+        if n:
+            self.digest.update(memoryview(buffer)[:n])
+        return n
+
+
+class HashingWriter:
+    """File object wrapper that feeds everything written through it into a digest"""
+
+    def __init__(self, raw, digest):
+        self.raw = raw
+        self.digest = digest
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.raw.write(data)
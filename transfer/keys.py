@@ -0,0 +1,100 @@
+"""
+Session key cache for CryptPort encryption
+The passkey entered at login becomes the encryption key through scrypt, which
+is slow on purpose. KeyCache keeps the passkey and every master key it has
+derived for the rest of the session, so a batch of files costs one scrypt and
+then one HKDF per file (each file has its own salt, see transfer.crypto).
+
+Nothing is kept forever: the cache forgets everything once it has gone unused
+for its time to live, and on clear() (logout / disconnect). Forgotten secrets
+are overwritten with zeros first. That is best effort in Python: copies made
+while deriving keys are not under our control.
+"""
+
+import secrets
+import threading
+import time
+
+from transfer.crypto import (
+    AES_GCM, CHUNK_SIZE, SALT_SIZE, CryptoError, Decryptor, Encryptor, derive_key, file_key
+)
+
+KEY_TTL = 15 * 60       # seconds of disuse after which the passkey must be entered again
+
+
+def _zero(buffer):
+    buffer[:] = bytes(len(buffer))
+
+
+class KeyCache:
+    """Passkey and derived master keys for one session; shared by transfer threads"""
+
+    def __init__(self, ttl=KEY_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self._passkey = None        # bytearray, so it can be zeroed
+        self._masters = {}          # KDF salt -> master key (bytearray)
+        self._session_salt = None   # KDF salt for everything encrypted this session
+        self._expires = 0.0
+
+    @property
+    def unlocked(self) -> bool:
+        with self.lock:
+            self._expire()
+            return self._passkey is not None
+
+    def unlock(self, passkey):
+        """Start a session with passkey; an earlier session's keys are cleared"""
+        with self.lock:
+            self._clear()
+            self._passkey = bytearray(passkey.encode("utf-8"))
+            self._session_salt = secrets.token_bytes(SALT_SIZE)
+            self._expires = time.monotonic() + self.ttl
+
+    def clear(self):
+        """Zero and forget the passkey and every derived key"""
+        with self.lock:
+            self._clear()
+
+    def key_for(self, kdf_salt, file_salt=None) -> bytes:
+        """Key of one container; file_salt None means a version 1 container"""
+        with self.lock:
+            # Derived under the lock: a clear() running meanwhile would zero the master mid-use
+            master = self._master(kdf_salt)
+            return bytes(master) if file_salt is None else file_key(master, file_salt)
+
+    def encryptor(self, algorithm=AES_GCM, chunk_size=CHUNK_SIZE) -> Encryptor:
+        """Encryptor for one new file, under this session's master key and a fresh file salt"""
+        with self.lock:
+            kdf_salt = self._session_salt
+        file_salt = secrets.token_bytes(SALT_SIZE)
+        return Encryptor(self.key_for(kdf_salt, file_salt), kdf_salt, file_salt, algorithm, chunk_size)
+
+    def decryptor(self) -> Decryptor:
+        return Decryptor(self.key_for)
+
+    def _master(self, kdf_salt):
+        # Caller holds the lock, across scrypt on purpose: parallel transfers wait for one
+        # derivation instead of racing
+        self._expire()
+        if self._passkey is None:
+            raise CryptoError("No passkey for encryption (it may have expired); enter it again")
+        master = self._masters.get(kdf_salt)
+        if master is None:
+            master = bytearray(derive_key(self._passkey, kdf_salt))
+            self._masters[kdf_salt] = master
+        self._expires = time.monotonic() + self.ttl
+        return master
+
+    def _expire(self):
+        if self._passkey is not None and time.monotonic() >= self._expires:
+            self._clear()
+
+    def _clear(self):
+        if self._passkey is not None:
+            _zero(self._passkey)
+        for master in self._masters.values():
+            _zero(master)
+        self._passkey = None
+        self._masters = {}
+        self._session_salt = None
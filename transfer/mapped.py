@@ -0,0 +1,88 @@
+"""
+Zero-copy chunked reads for CryptPort
+Large local files are memory-mapped and handed out as memoryview slices of the
+mapping, so hashing, compression and socket sends read the page cache directly
+instead of copying every chunk into a fresh bytes object. Small files and
+streams without a file descriptor are read into one reusable buffer instead.
+
+Each chunk is only valid until the next one is requested: views are released
+as the iteration moves on so the mapping can be closed.
+"""
+
+import mmap
+import os
+from contextlib import contextmanager
+
+MMAP_THRESHOLD = 16 * 1024 * 1024
+READ_CHUNK = 1024 * 1024
+
+
+def read_chunks(src, chunk_size=READ_CHUNK, threshold=MMAP_THRESHOLD):
+    """Yield memoryviews covering src from its current position to the end.
+
+    Every chunk except the last is exactly chunk_size bytes, even when the
+    source is a stream that returns short reads.
+    """
+    try:
+        fd = src.fileno()
+        start = src.tell()
+        size = os.fstat(fd).st_size
+    except (AttributeError, OSError, ValueError):
+        size = None     # pipes, archives and other non-file streams
+    if size is not None and size - start >= threshold:
+        yield from _mapped_chunks(fd, start, size, chunk_size)
+        src.seek(size)
+    else:
+        yield from _buffered_chunks(src, chunk_size)
+
+
+@contextmanager
+def mapped_view(f):
+    """Read-only memoryview of a whole open file; empty files give an empty view.
+
+    Slices taken from it must be dropped before the block ends.
+    """
+    size = os.fstat(f.fileno()).st_size
+    if not size:
+        yield memoryview(b"")
+        return
+    mapping = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    view = memoryview(mapping)
+    try:
+        yield view
+    finally:
+        view.release()
+        mapping.close()
+
+
+def _mapped_chunks(fd, start, size, chunk_size):
+    mapping = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+    if hasattr(mapping, "madvise"):
+        mapping.madvise(mmap.MADV_SEQUENTIAL)
+    whole = memoryview(mapping)
+    try:
+        for offset in range(start, size, chunk_size):
+            chunk = whole[offset:offset + chunk_size]
+            try:
+                yield chunk
+            finally:
+                chunk.release()
+    finally:
+        whole.release()
+        mapping.close()
+
+
+def _buffered_chunks(src, chunk_size):
+    view = memoryview(bytearray(chunk_size))
+    while True:
+        filled = 0
+        while filled < chunk_size:
+            n = src.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+        if not filled:
+            return
+        yield view[:filled]
+        if filled < chunk_size:
+            return
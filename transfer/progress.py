@@ -0,0 +1,94 @@
+"""
+Transfer progress tracking for CryptPort
+Turns the byte counts reported by the transfer engine into percent, throughput and ETA.
+"""
+
+import time
+
+
+class TransferProgress:
+    """Byte-accurate progress for a single transfer.
+
+    total may be None when the size is not known up front (a directory
+    archive built while it is sent); percent and ETA are then unavailable.
+    """
+
+    def __init__(self, total: int, smoothing: float = 0.3, clock=time.monotonic):
+        self.total = total
+        self.done = 0
+        self.rate = 0.0  # bytes per second, exponentially smoothed
+        self.smoothing = smoothing
+        self.clock = clock
+        self.started = clock()
+        self._last_time = self.started
+        self._last_done = None
+
+    def update(self, done: int):
+        """Record that `done` bytes have been moved so far"""
+        now = self.clock()
+        if self._last_done is None:
+            # First report; a resumed transfer starts part-way, which is not throughput
+            self._last_time = now
+            self._last_done = done
+            self.done = done
+            return
+        elapsed = now - self._last_time
+        if elapsed > 0:
+            instant = (done - self._last_done) / elapsed
+            if self.rate:
+                self.rate += self.smoothing * (instant - self.rate)
+            else:
+                self.rate = instant
+            self._last_time = now
+            self._last_done = done
+        self.done = done
+
+    @property
+    def percent(self) -> int:
+        if self.total is None:
+            return 0
+        if not self.total:
+            return 100
+        return min(100, int(self.done * 100 / self.total))
+
+    @property
+    def eta(self):
+        """Seconds remaining, or None while the rate or size is still unknown"""
+        if self.total is None:
+            return None
+        if self.done >= self.total:
+            return 0.0
+        if self.rate <= 0:
+            return None
+        return (self.total - self.done) / self.rate
+
+    @property
+    def elapsed(self) -> float:
+        return self.clock() - self.started
+
+    def summary(self) -> str:
+        """Short text for a progress bar: throughput and time left"""
+        eta = self.eta
+        eta_text = "--:--" if eta is None else format_duration(eta)
+        return f"{format_rate(self.rate)}  •  ETA {eta_text}"
+
+
+def format_size(num_bytes: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{int(num_bytes)} B"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+
+def format_rate(bytes_per_second: float) -> str:
+    return f"{format_size(bytes_per_second)}/s"
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
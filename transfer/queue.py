@@ -0,0 +1,84 @@
+"""
+Persistent transfer queue for CryptPort
+Tracks every file waiting to be sent and survives app restarts.
+"""
+
+import json
+import os
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class TransferQueue:
+    """Ordered list of transfer entries saved as JSON next to the app"""
+
+    def __init__(self, queue_file=None):
+        self.queue_file = queue_file or os.path.join(os.getcwd(), "cryptport_queue.json")
+        self.entries = []
+        self._by_id = {}
+        self.load()
+
+    def load(self):
+        """Read saved entries; anything left running by a previous run is queued again"""
+        self.entries = []
+        if os.path.exists(self.queue_file):
+            try:
+                with open(self.queue_file, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = []
+        for entry in self.entries:
+            if entry["state"] == RUNNING:
+                entry["state"] = QUEUED
+        self._by_id = {entry["id"]: entry for entry in self.entries}
+        self._recount()
+
+    def save(self):
+        tmp_path = self.queue_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.queue_file)
+
+    def add(self, source, target) -> dict:
+        entry = {"id": uuid.uuid4().hex, "source": source, "target": target,
+                 "state": QUEUED, "message": ""}
+        self.entries.append(entry)
+        self._by_id[entry["id"]] = entry
+        self._counts[QUEUED] += 1
+        return entry
+
+    def get(self, entry_id):
+        return self._by_id.get(entry_id)
+
+    def set_state(self, entry_id, state, message=""):
+        entry = self._by_id[entry_id]
+        self._counts[entry["state"]] -= 1
+        self._counts[state] += 1
+        entry["state"] = state
+        entry["message"] = message
+        return entry
+
+    def pending(self):
+        """Queued entries in order"""
+        return [entry for entry in self.entries if entry["state"] == QUEUED]
+
+    def count(self, state) -> int:
+        return self._counts[state]
+
+    def clear_finished(self):
+        """Drop done and failed entries, returns the removed ones"""
+        removed = [entry for entry in self.entries if entry["state"] in (DONE, FAILED)]
+        self.entries = [entry for entry in self.entries if entry["state"] not in (DONE, FAILED)]
+        for entry in removed:
+            del self._by_id[entry["id"]]
+        self._recount()
+        return removed
+
+    def _recount(self):
+        self._counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        for entry in self.entries:
+            self._counts[entry["state"]] += 1
@@ -0,0 +1,142 @@
+"""
+Bandwidth scheduling for CryptPort transfers
+A global token bucket caps the total rate of all running transfers, and
+each transfer can carry its own cap on top. When transfers compete for the
+global budget, the one that has received the least service so far goes next
+(start-time fair queuing), so a large file cannot starve small ones.
+
+Rates are bytes per second; None means unlimited. All rates can be changed
+while transfers are running.
+"""
+
+import threading
+import time
+
+BURST_SECONDS = 0.25   # how much unused budget a bucket may save up
+
+
+class TokenBucket:
+    """Classic token bucket; tokens may go negative so large chunks never wait forever"""
+
+    def __init__(self, rate=None, clock=time.monotonic):
+        self.clock = clock
+        self.rate = rate
+        self.tokens = 0.0
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = rate or None
+
+    def take(self, nbytes, sleep=time.sleep):
+        """Spend nbytes, sleeping first if the bucket is in debt"""
+        while True:
+            with self.lock:
+                if self.rate is None:
+                    return
+                self._refill()
+                if self.tokens > 0:
+                    self.tokens -= nbytes
+                    return
+                wait = -self.tokens / self.rate
+            sleep(min(wait, 0.1))  # wake up regularly so rate changes apply quickly
+
+    def _refill(self):
+        now = self.clock()
+        if self.rate is not None:
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate,
+                              self.rate * BURST_SECONDS)
+        self.updated = now
+
+
+class TransferLimit:
+    """One transfer's handle on the scheduler"""
+
+    def __init__(self, scheduler, transfer_id, rate=None):
+        self.scheduler = scheduler
+        self.transfer_id = transfer_id
+        self.bucket = TokenBucket(rate)
+        self.served = 0.0   # fair-queuing tag: bytes of service received, in virtual time
+        self.last_done = 0
+
+    def wrap(self, progress_callback):
+        """Progress callback that charges the bytes each report adds"""
+        def charged(done, total):
+            delta = done - self.last_done
+            self.last_done = done
+            if delta > 0:
+                self.scheduler.consume(self, delta)
+            if progress_callback:
+                progress_callback(done, total)
+        return charged
+
+
+class BandwidthScheduler:
+    """Shared global cap with fair sharing and per-transfer caps"""
+
+    def __init__(self, global_rate=None, clock=time.monotonic):
+        self.bucket = TokenBucket(global_rate, clock)
+        self.limits = {}
+        self.waiting = set()
+        self.virtual_clock = 0.0
+        self.condition = threading.Condition()
+
+    @property
+    def global_rate(self):
+        return self.bucket.rate
+
+    def set_global_rate(self, rate):
+        self.bucket.set_rate(rate)
+        with self.condition:
+            self.condition.notify_all()
+
+    def register(self, transfer_id, rate=None) -> TransferLimit:
+        limit = TransferLimit(self, transfer_id, rate)
+        with self.condition:
+            limit.served = self.virtual_clock  # newcomers start level with everyone else
+            self.limits[transfer_id] = limit
+        return limit
+
+    def unregister(self, transfer_id):
+        with self.condition:
+            limit = self.limits.pop(transfer_id, None)
+            if limit:
+                self.waiting.discard(limit)
+            self.condition.notify_all()
+
+    def set_transfer_rate(self, transfer_id, rate):
+        with self.condition:
+            limit = self.limits.get(transfer_id)
+        if limit:
+            limit.bucket.set_rate(rate)
+
+    def consume(self, limit, nbytes):
+        """Block until nbytes fit under this transfer's cap and its fair share of the global cap"""
+        limit.bucket.take(nbytes)
+        if self.bucket.rate is None:
+            limit.served += nbytes
+            return
+        with self.condition:
+            # A transfer coming back from idle does not get to replay the time it missed
+            limit.served = max(limit.served, self.virtual_clock)
+            self.waiting.add(limit)
+            try:
+                while self.bucket.rate is not None:
+                    first = min(self.waiting, key=lambda w: w.served)
+                    if first is limit:
+                        with self.bucket.lock:
+                            self.bucket._refill()
+                            if self.bucket.tokens > 0:
+                                self.bucket.tokens -= nbytes
+                                break
+                            wait = -self.bucket.tokens / self.bucket.rate
+                    else:
+                        wait = 0.1
+                    self.condition.wait(min(wait, 0.1))
+            finally:
+                self.waiting.discard(limit)
+            self.virtual_clock = limit.served
+            limit.served += nbytes
+            self.condition.notify_all()
@@ -0,0 +1,305 @@
+"""
+Content-addressed chunk store for CryptPort
+Files sent to the transfer folder are split into fixed-size chunks named by
+their SHA-256. A chunk that is already present is never written again, and a
+manifest per distinct file lists its chunks. An append-only index maps each
+name to every version stored under it, so a different file with the same name
+adds a version instead of overwriting.
+
+With compression on, compressible chunks are kept compressed on disk as
+'<sha256>.<codec>'; the hash is always of the original bytes, so dedup does
+not depend on the codec.
+
+Storing a local file notes its chunk list in partial/ as it goes. If the
+ingest is interrupted, storing the same unchanged file again (in this or a
+later session) checks the noted chunks against the file and carries on
+after them instead of starting over.
+
+Layout under the transfer folder:
+    .cryptport_store/chunks/ab/<sha256>
+    .cryptport_store/manifests/<sha256 of whole file>.json
+    .cryptport_store/partial/<key>.json
+    .cryptport_store/index.jsonl
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from transfer.checkpoint import ResumeRecords
+from transfer.compression import (
+    CODEC_NAMES, choose_codec, compress_block, decompress_block, default_codec_name,
+    looks_compressible
+)
+from transfer.mapped import read_chunks
+
+STORE_DIR = ".cryptport_store"
+CHUNK_SIZE = 4 * 1024 * 1024
+RESUME_INTERVAL = 64 * 1024 * 1024  # note ingest progress this often
+
+
+class StoreError(Exception):
+    """Stored data is missing or does not match its hash"""
+
+
+class ChunkStore:
+    """Deduplicated storage behind the transfer folder"""
+
+    def __init__(self, folder, chunk_size=CHUNK_SIZE):
+        self.root = os.path.join(folder, STORE_DIR)
+        self.chunk_dir = os.path.join(self.root, "chunks")
+        self.manifest_dir = os.path.join(self.root, "manifests")
+        self.index_path = os.path.join(self.root, "index.jsonl")
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.versions = {}      # name -> [record, ...], oldest first
+        self.by_source = {}     # source identity -> file digest
+        self.partial = ResumeRecords(os.path.join(self.root, "partial"))
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        self._load_index()
+
+    # --------------------------------------------------------------------------
+    # Storing
+    # --------------------------------------------------------------------------
+    def put(self, source_path, name=None, progress_callback=None, compression=None):
+        """Store a file and return (record, new_bytes).
+
+        new_bytes counts what was actually written to disk. compression is a
+        codec name, 'auto' to pick one if the file looks compressible, or None.
+        A file this store has already seen unchanged (same path, size and
+        mtime) is recorded without reading it at all, and an interrupted
+        ingest of it resumes.
+        """
+        name = name or os.path.basename(source_path)
+        st = os.stat(source_path)
+        source_id = _source_id(source_path, st)
+
+        with self.lock:
+            digest = self.by_source.get(source_id)
+        if digest and os.path.exists(self._manifest_path(digest)):
+            # No progress report: nothing was moved, and reporting the full size
+            # would be charged against the bandwidth limit
+            return self._record(name, digest, st.st_size, source_id), 0
+
+        codec = choose_codec(source_path) if compression == "auto" else compression
+        with open(source_path, "rb") as src:
+            return self._ingest(src, name, st.st_size, source_id, codec, progress_callback)
+
+    def put_stream(self, stream, name, progress_callback=None, compression=None, total=None):
+        """Store everything read from a file object (e.g. a DirectoryArchive).
+
+        With 'auto' compression each chunk is checked on its own, since a
+        stream cannot be sampled ahead.
+        """
+        codec = default_codec_name() if compression == "auto" else compression
+        return self._ingest(stream, name, total, None, codec, progress_callback)
+
+    def _ingest(self, src, name, total, source_id, codec, progress_callback):
+        """Chunk src into the store; with a source_id the progress is noted for a resume"""
+        file_hash = hashlib.sha256()
+        chunks = self._resume_ingest(src, source_id, file_hash) if source_id else []
+        new_bytes = 0
+        done = noted = sum(length for _, length in chunks)
+        if progress_callback and done:
+            progress_callback(done, total)
+        try:
+            for chunk in read_chunks(src, self.chunk_size):
+                n = len(chunk)
+                file_hash.update(chunk)
+                chunk_digest = hashlib.sha256(chunk).hexdigest()
+                new_bytes += self._write_chunk(chunk_digest, chunk, codec)
+                chunks.append([chunk_digest, n])
+                done += n
+                if source_id and done - noted >= RESUME_INTERVAL:
+                    self.partial.save(source_id, chunks)
+                    noted = done
+                if progress_callback:
+                    progress_callback(done, total)
+        except BaseException:
+            if source_id and done > noted:
+                self.partial.save(source_id, chunks)  # the chunks written so far count next time
+            raise
+        if progress_callback and done == 0:
+            progress_callback(0, 0)
+
+        digest = file_hash.hexdigest()
+        manifest_path = self._manifest_path(digest)
+        if not os.path.exists(manifest_path):
+            self._atomic_write(manifest_path, json.dumps({"size": done, "chunks": chunks}).encode())
+        if source_id:
+            self.partial.remove(source_id)
+        return self._record(name, digest, done, source_id), new_bytes
+
+    def _resume_ingest(self, src, source_id, file_hash):
+        """Chunks noted by an interrupted ingest of source_id that still match src.
+
+        The file hash cannot be saved mid-way, so the matching prefix is read
+        again to rebuild it; src is left positioned right after it.
+        """
+        noted = self.partial.load(source_id) or []
+        chunks = []
+        position = src.tell()
+        pieces = read_chunks(src, self.chunk_size)
+        try:
+            for (chunk_digest, length), chunk in zip(noted, pieces):
+                if (len(chunk) != length or not self._find_chunk(chunk_digest)
+                        or hashlib.sha256(chunk).hexdigest() != chunk_digest):
+                    break
+                file_hash.update(chunk)
+                chunks.append([chunk_digest, length])
+                position += length
+        finally:
+            pieces.close()
+        src.seek(position)
+        return chunks
+
+    # --------------------------------------------------------------------------
+    # Reading
+    # --------------------------------------------------------------------------
+    def names(self):
+        """Stored names with their newest version record"""
+        with self.lock:
+            return {name: records[-1] for name, records in self.versions.items()}
+
+    def history(self, name):
+        with self.lock:
+            return list(self.versions.get(name, []))
+
+    def source_digest(self, source_path):
+        """Digest stored from source_path as it is now (same size and mtime), or None"""
+        try:
+            source_id = _source_id(source_path, os.stat(source_path))
+        except OSError:
+            return None
+        with self.lock:
+            return self.by_source.get(source_id)
+
+    def export(self, name, target_path, version=-1, digest=None, writer=None):
+        """Rebuild a stored file at target_path, checking every chunk hash.
+
+        digest picks the version recorded when the file was sent (default: the
+        newest); the rebuilt file must hash to it. writer, if given, wraps the
+        output file (e.g. crypto.DecryptingWriter) and is finished after the
+        last chunk.
+        """
+        with self.lock:
+            records = self.versions.get(name)
+        if not records:
+            raise StoreError(f"{name} is not stored")
+        if digest is None:
+            digest = records[version]["digest"]
+        elif not any(record["digest"] == digest for record in records):
+            raise StoreError(f"That version of {name} is not stored")
+        manifest = self._read_manifest(digest)
+        file_hash = hashlib.sha256()
+        tmp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as out:
+                sink = writer(out) if writer else out
+                for chunk_digest, length in manifest["chunks"]:
+                    data = self._read_chunk(chunk_digest)
+                    if len(data) != length or hashlib.sha256(data).hexdigest() != chunk_digest:
+                        raise StoreError(f"Chunk {chunk_digest[:12]} is damaged")
+                    file_hash.update(data)
+                    sink.write(data)
+                if file_hash.hexdigest() != digest:
+                    raise StoreError(f"{name} failed the integrity check")
+                if writer:
+                    sink.finish()
+            os.replace(tmp_path, target_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return target_path
+
+    # --------------------------------------------------------------------------
+    # Internals
+    # --------------------------------------------------------------------------
+    def _record(self, name, digest, size, source_id):
+        record = {"name": name, "digest": digest, "size": size,
+                  "source": source_id, "time": time.time()}
+        with self.lock:
+            if source_id:
+                self.by_source[source_id] = digest
+            records = self.versions.setdefault(name, [])
+            if records and records[-1]["digest"] == digest:
+                return records[-1]  # same content under the same name: nothing new
+            records.append(record)
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        return record
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a crash
+                self.versions.setdefault(record["name"], []).append(record)
+                if record["source"]:
+                    self.by_source[record["source"]] = record["digest"]
+
+    def _write_chunk(self, chunk_digest, data, codec=None) -> int:
+        """Store a chunk unless it is already there; returns bytes written"""
+        if self._find_chunk(chunk_digest):
+            return 0
+        path = self._chunk_path(chunk_digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if codec and looks_compressible(data):
+            packed = compress_block(codec, data)
+            if packed is not None:
+                self._atomic_write(f"{path}.{codec}", packed)
+                return len(packed)
+        self._atomic_write(path, data)
+        return len(data)
+
+    def _find_chunk(self, chunk_digest):
+        """(path, codec) of a stored chunk, or None"""
+        path = self._chunk_path(chunk_digest)
+        if os.path.exists(path):
+            return path, None
+        for codec in CODEC_NAMES:
+            if os.path.exists(f"{path}.{codec}"):
+                return f"{path}.{codec}", codec
+        return None
+
+    def _read_chunk(self, chunk_digest) -> bytes:
+        found = self._find_chunk(chunk_digest)
+        if not found:
+            raise StoreError(f"Chunk {chunk_digest[:12]} is missing")
+        path, codec = found
+        with open(path, "rb") as f:
+            data = f.read()
+        return decompress_block(codec, data) if codec else data
+
+    def _read_manifest(self, digest):
+        try:
+            with open(self._manifest_path(digest), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise StoreError(f"Manifest {digest[:12]} is unreadable: {e}") from None
+
+    def _chunk_path(self, chunk_digest):
+        return os.path.join(self.chunk_dir, chunk_digest[:2], chunk_digest)
+
+    def _manifest_path(self, digest):
+        return os.path.join(self.manifest_dir, digest + ".json")
+
+    @staticmethod
+    def _atomic_write(path, data):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+def _source_id(path, st) -> str:
+    """Identity of a local file; changes when it is modified"""
+    return f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
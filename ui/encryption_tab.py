@@ -5,26 +5,41 @@ Now includes a Back button and signal for navigation.
 """
 
 import os
-import shutil
+from functools import partial
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QLabel, QPushButton,
-    QFileDialog, QMessageBox, QHBoxLayout
+    QFileDialog, QMessageBox, QHBoxLayout, QInputDialog, QLineEdit
 )
 from PyQt5.QtGui import QFont, QColor, QPalette
 from PyQt5.QtCore import Qt, pyqtSignal
 
+from threads.file_transfer_thread import FileTransferThread
+from transfer.crypto import ENCRYPTED_SUFFIX
+from transfer.keys import KeyCache
 from ui.history_tab import HistoryTab  # ✅ for logging
 
 
+def _abandon(thread, *_):
+    """The page that started thread is gone: drop its slots and cancel the job"""
+    thread.progress_updated.disconnect()
+    thread.transfer_completed.disconnect()
+    thread.cancel()
+
+
 class EncryptionTab(QWidget):
     """Encryption / Decryption Page"""
 
     # ✅ Add signal for navigation
     back_requested = pyqtSignal()
 
-    def __init__(self):
+    def __init__(self, keys=None, owner=None):
         super().__init__()
+        self.keys = keys or KeyCache()  # the session's passkey, shared with the connection
+        self.owner = owner  # parents the crypto thread, so it outlives this page
         self.selected_file = None
+        self.crypto_thread = None
+        self.crypto_job = None  # (action, file name, is_encrypt) of the running thread
+        self.release_thread = None
         self.history = HistoryTab()
         self.init_ui()
 
@@ -126,31 +141,65 @@ class EncryptionTab(QWidget):
         self.selected_file = file_path
         file_name = os.path.basename(file_path)
 
-        QMessageBox.information(self, f"{action}ing...", f"{action}ing {file_name}...")
-        self.simulate_crypto(file_name, is_encrypt)
+        if not self.keys.unlocked:
+            passkey, ok = QInputDialog.getText(self, f"{action} {file_name}", "Passkey:",
+                                               QLineEdit.Password)
+            if not ok or not passkey:
+                return
+            self.keys.unlock(passkey)
+
+        self.run_crypto(file_name, is_encrypt)
 
-    def simulate_crypto(self, file_name: str, is_encrypt: bool):
-        """Simulated encryption/decryption (creates new saved file)"""
+    def run_crypto(self, file_name: str, is_encrypt: bool):
+        """Encrypt or decrypt the selected file in the background (creates new saved file)"""
         folder_name = "cryptport_encrypted" if is_encrypt else "cryptport_decrypted"
         output_folder = os.path.join(os.getcwd(), folder_name)
         os.makedirs(output_folder, exist_ok=True)
 
-        base, ext = os.path.splitext(file_name)
-        suffix = "_encrypted" if is_encrypt else "_decrypted"
-        new_filename = f"{base}{suffix}{ext}"
+        if is_encrypt:
+            new_filename = f"{file_name}{ENCRYPTED_SUFFIX}"
+        elif file_name.endswith(ENCRYPTED_SUFFIX):
+            new_filename = file_name[:-len(ENCRYPTED_SUFFIX)]
+        else:
+            base, ext = os.path.splitext(file_name)
+            new_filename = f"{base}_decrypted{ext}"
+        target_path = os.path.join(output_folder, new_filename)
 
-        source_path = self.selected_file
-        target_path = os.path.join(output_folder, os.path.basename(new_filename))
-
-        try:
-            shutil.copy2(source_path, target_path)
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to process file:\n{e}")
+        action = "Encrypt" if is_encrypt else "Decrypt"
+        self.info_label.setText(f"⏳ {action}ing {file_name}...")
+        self.encrypt_btn.setEnabled(False)
+        self.decrypt_btn.setEnabled(False)
+        self.crypto_job = (action, file_name, is_encrypt)
+        thread = FileTransferThread(None, action.lower(), file_path=self.selected_file,
+                                    target_path=target_path, keys=self.keys)
+        if self.owner is not None:
+            thread.setParent(self.owner)
+        thread.progress_updated.connect(self.on_crypto_progress)
+        thread.transfer_completed.connect(self.on_crypto_finished)
+        thread.finished.connect(thread.deleteLater)
+        self.release_thread = partial(_abandon, thread)
+        self.destroyed.connect(self.release_thread)
+        self.crypto_thread = thread
+        thread.start()
+
+    def on_crypto_progress(self, percent: int):
+        action, file_name, _ = self.crypto_job
+        self.info_label.setText(f"⏳ {action}ing {file_name}... {percent}%")
+
+    def on_crypto_finished(self, success: bool, message: str):
+        is_encrypt = self.crypto_job[2]
+        self.destroyed.disconnect(self.release_thread)
+        self.crypto_thread = self.release_thread = self.crypto_job = None
+        self.encrypt_btn.setEnabled(True)
+        self.decrypt_btn.setEnabled(True)
+        if not success:
+            self.info_label.setText("❌ Failed")
+            QMessageBox.critical(self, "Error", f"Failed to process file:\n{message}")
             return
 
         action = "Encrypted" if is_encrypt else "Decrypted"
-        QMessageBox.information(self, "Done", f"{action} file saved successfully:\n{target_path}")
-        self.info_label.setText(f"✅ {action}: {os.path.basename(target_path)}")
+        QMessageBox.information(self, "Done", f"{action} file saved successfully:\n{message}")
+        self.info_label.setText(f"✅ {action}: {os.path.basename(message)}")
 
         # ✅ Log this action
-        self.history.add_entry(action, os.path.basename(target_path))
+        self.history.add_entry(action, os.path.basename(message))
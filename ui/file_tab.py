@@ -7,13 +7,33 @@ Now includes 'Encryption' and 'History' buttons for navigation.
 import os
 import sys
 import subprocess
+from functools import partial
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QLabel, QPushButton, QFileDialog,
-    QProgressBar, QListWidget, QHBoxLayout, QFrame, QMessageBox
+    QProgressBar, QListWidget, QListWidgetItem, QHBoxLayout, QFrame, QMessageBox,
+    QSpinBox, QCheckBox, QDoubleSpinBox, QMenu, QInputDialog, QLineEdit
 )
 from PyQt5.QtCore import Qt, pyqtSignal, QTimer
 from PyQt5.QtGui import QFont, QColor, QPalette
 
+from threads.file_transfer_thread import TransferPool
+from transfer.keys import KeyCache
+from transfer.progress import TransferProgress, format_size, format_rate
+from transfer.queue import TransferQueue, QUEUED, RUNNING, DONE, FAILED
+from transfer.store import ChunkStore
+
+MAX_CONCURRENCY = 16
+DEFAULT_CONCURRENCY = 4
+MB = 1024 * 1024
+QUEUE_SAVE_DELAY_MS = 1000  # batch queue writes instead of saving on every state change
+
+STATE_LABELS = {
+    QUEUED: "⏳ Queued",
+    RUNNING: "🚀 Sending",
+    DONE: "✅ Sent",
+    FAILED: "❌ Failed",
+}
+
 
 class FileTab(QWidget):
     """File Transfer Page"""
@@ -21,8 +41,9 @@ class FileTab(QWidget):
     open_encryption_requested = pyqtSignal()  # ➡️ Go to encryption page
     open_history_requested = pyqtSignal()     # ➡️ Go to history page
 
-    def __init__(self):
+    def __init__(self, keys=None):
         super().__init__()
+        self.keys = keys or KeyCache()  # the session's passkey, shared with the connection
         self.init_ui()
 
     def init_ui(self):
@@ -73,7 +94,7 @@ class FileTab(QWidget):
         box_layout.addWidget(send_title)
 
         send_row = QHBoxLayout()
-        self.choose_btn = QPushButton("Choose File...")
+        self.choose_btn = QPushButton("Choose Files...")
         self.choose_btn.setFont(QFont("Segoe UI", 12))
         self.choose_btn.setCursor(Qt.PointingHandCursor)
         self.choose_btn.setStyleSheet("""
@@ -87,6 +108,20 @@ class FileTab(QWidget):
         """)
         self.choose_btn.clicked.connect(self.choose_file)
 
+        self.choose_dir_btn = QPushButton("Choose Folder...")
+        self.choose_dir_btn.setFont(QFont("Segoe UI", 12))
+        self.choose_dir_btn.setCursor(Qt.PointingHandCursor)
+        self.choose_dir_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #E3F2FD;
+                color: #1565C0;
+                border-radius: 10px;
+                padding: 10px 16px;
+            }
+            QPushButton:hover { background-color: #BBDEFB; }
+        """)
+        self.choose_dir_btn.clicked.connect(self.choose_folder)
+
         self.send_btn = QPushButton("Send Securely 🚀")
         self.send_btn.setFont(QFont("Segoe UI", 13, QFont.Bold))
         self.send_btn.setCursor(Qt.PointingHandCursor)
@@ -102,12 +137,74 @@ class FileTab(QWidget):
         self.send_btn.clicked.connect(self.send_file)
 
         send_row.addWidget(self.choose_btn)
+        send_row.addWidget(self.choose_dir_btn)
         send_row.addWidget(self.send_btn)
         box_layout.addLayout(send_row)
 
+        # --- Queue Options ---
+        options_row = QHBoxLayout()
+        concurrency_label = QLabel("Parallel transfers:")
+        concurrency_label.setFont(QFont("Segoe UI", 11))
+        self.concurrency_spin = QSpinBox()
+        self.concurrency_spin.setRange(1, MAX_CONCURRENCY)
+        self.concurrency_spin.setValue(DEFAULT_CONCURRENCY)
+        self.concurrency_spin.setFont(QFont("Segoe UI", 11))
+        self.concurrency_spin.valueChanged.connect(self.dispatch_queue)
+
+        self.compress_check = QCheckBox("Compress")
+        self.compress_check.setFont(QFont("Segoe UI", 11))
+        self.compress_check.setToolTip("Compress files that are not already compressed")
+        self.compress_check.setChecked(True)
+
+        self.encrypt_check = QCheckBox("Encrypt")
+        self.encrypt_check.setFont(QFont("Segoe UI", 11))
+        self.encrypt_check.setToolTip("Encrypt files while they are sent; no encrypted copy is written")
+
+        self.clear_btn = QPushButton("🧹 Clear Finished")
+        self.clear_btn.setFont(QFont("Segoe UI", 11))
+        self.clear_btn.setCursor(Qt.PointingHandCursor)
+        self.clear_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #E3F2FD;
+                color: #1565C0;
+                border-radius: 10px;
+                padding: 6px 14px;
+            }
+            QPushButton:hover { background-color: #BBDEFB; }
+        """)
+        self.clear_btn.clicked.connect(self.clear_finished)
+
+        options_row.addWidget(concurrency_label)
+        options_row.addWidget(self.concurrency_spin)
+        options_row.addWidget(self.compress_check)
+        options_row.addWidget(self.encrypt_check)
+        options_row.addStretch()
+        options_row.addWidget(self.clear_btn)
+        box_layout.addLayout(options_row)
+
+        # --- Speed Limits (0 = unlimited, applied live) ---
+        limit_row = QHBoxLayout()
+        global_label = QLabel("Max total MB/s:")
+        global_label.setFont(QFont("Segoe UI", 11))
+        self.global_limit_spin = self.create_limit_spin()
+        self.global_limit_spin.valueChanged.connect(self.apply_global_limit)
+
+        per_label = QLabel("Per transfer MB/s:")
+        per_label.setFont(QFont("Segoe UI", 11))
+        self.transfer_limit_spin = self.create_limit_spin()
+        self.transfer_limit_spin.valueChanged.connect(self.apply_transfer_limit)
+
+        limit_row.addWidget(global_label)
+        limit_row.addWidget(self.global_limit_spin)
+        limit_row.addStretch()
+        limit_row.addWidget(per_label)
+        limit_row.addWidget(self.transfer_limit_spin)
+        box_layout.addLayout(limit_row)
+
         # --- Progress Bar ---
         self.progress = QProgressBar()
         self.progress.setValue(0)
+        self.progress.setFormat("%p%")
         self.progress.setFixedHeight(25)
         self.progress.setStyleSheet("""
             QProgressBar {
@@ -123,7 +220,7 @@ class FileTab(QWidget):
         box_layout.addWidget(self.progress)
 
         # --- RECEIVED FILES SECTION ---
-        recv_title = QLabel("📥 Received Files")
+        recv_title = QLabel("📥 Transfer Queue")
         recv_title.setFont(QFont("Segoe UI", 16, QFont.Bold))
         box_layout.addWidget(recv_title)
 
@@ -136,6 +233,11 @@ class FileTab(QWidget):
                 background-color: #FAFAFA;
             }
         """)
+        self.file_list.setToolTip("Double-click a sent file to save a copy.\n"
+                                  "Right-click a transfer to limit its speed.")
+        self.file_list.itemDoubleClicked.connect(self.export_entry)
+        self.file_list.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.file_list.customContextMenuRequested.connect(self.show_entry_menu)
         box_layout.addWidget(self.file_list)
 
         self.open_folder_btn = QPushButton("📁 Open Folder")
@@ -213,50 +315,293 @@ class FileTab(QWidget):
         self.setLayout(main_layout)
 
         # State
-        self.selected_file = None
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.simulate_progress)
-
-        # Folder path
+        self.selected_files = []
+        self.active_transfers = {}  # queue entry id -> TransferProgress
+        self.exports = {}           # export job id -> file name
+        self.sent_digests = {}      # queue entry id -> SHA-256 of what was stored
+        self.queue_items = {}       # queue entry id -> QListWidgetItem
+        self._shutting_down = False
+        self.pool = TransferPool(max_workers=MAX_CONCURRENCY)
+        self.pool.progress_updated.connect(self.on_transfer_progress)
+        self.pool.transfer_completed.connect(self.on_transfer_completed)
+
+        # Folder path, with identical data stored once in the chunk store inside it
         self.transfer_folder = os.path.join(os.getcwd(), "cryptport_transfers")
         if not os.path.exists(self.transfer_folder):
             os.makedirs(self.transfer_folder)
+        self.store = ChunkStore(self.transfer_folder)
+
+        # Persistent queue, picks up where the last session stopped
+        self.queue = TransferQueue()
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.timeout.connect(self.queue.save)
+        for entry in self.queue.entries:
+            self.add_queue_item(entry)
+        self.dispatch_queue()
+
+    def create_limit_spin(self):
+        spin = QDoubleSpinBox()
+        spin.setRange(0, 10000)
+        spin.setDecimals(1)
+        spin.setSingleStep(1)
+        spin.setSpecialValueText("Unlimited")
+        spin.setFont(QFont("Segoe UI", 11))
+        return spin
 
     # ======================
     # Functionality
     # ======================
 
     def choose_file(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "Select File to Send")
-        if file_path:
-            self.selected_file = file_path
-            QMessageBox.information(self, "File Selected", f"Selected file:\n{file_path}")
+        file_paths, _ = QFileDialog.getOpenFileNames(self, "Select Files to Send")
+        if file_paths:
+            self.selected_files = file_paths
+            if len(file_paths) == 1:
+                QMessageBox.information(self, "File Selected", f"Selected file:\n{file_paths[0]}")
+            else:
+                QMessageBox.information(self, "Files Selected", f"Selected {len(file_paths)} files.")
+
+    def choose_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Select Folder to Send")
+        if folder:
+            self.selected_files = [folder]
+            QMessageBox.information(self, "Folder Selected",
+                                    f"Selected folder:\n{folder}\n\nIt will be sent as one archive.")
 
     def send_file(self):
-        if not self.selected_file:
+        if not self.selected_files:
             QMessageBox.warning(self, "No File", "Please choose a file first.")
             return
+        encrypt = self.encrypt_check.isChecked()
+        if encrypt and not self.ask_passkey():
+            return
 
-        QMessageBox.information(self, "Encrypting", "Encrypting file before sending...")
-        self.progress.setValue(0)
-        self.timer.start(100)  # simulate sending
-
-    def simulate_progress(self):
-        val = self.progress.value() + 5
-        if val <= 100:
-            self.progress.setValue(val)
+        for file_path in self.selected_files:
+            name = os.path.basename(os.path.normpath(file_path))
+            if os.path.isdir(file_path):
+                name += ".tar"
+            entry = self.queue.add(file_path, name)
+            if encrypt:
+                entry["encrypt"] = True
+            self.add_queue_item(entry)
+        self.selected_files = []
+        self.schedule_save()
+        self.dispatch_queue()
+
+    def dispatch_queue(self):
+        """Start queued entries until the concurrency limit is reached"""
+        if self._shutting_down:
+            return
+        free_slots = self.concurrency_spin.value() - len(self.active_transfers)
+        if free_slots <= 0:
+            return
+        for entry in self.queue.pending():
+            if free_slots <= 0:
+                break
+            source = entry["source"]
+            if entry.get("encrypt") and not self.keys.unlocked:
+                self.set_entry_state(entry["id"], FAILED, "Passkey needed, send the file again")
+                continue
+            is_dir = os.path.isdir(source)
+            try:
+                size = None if is_dir else os.path.getsize(source)  # archives are sized as they stream
+            except OSError as e:
+                self.set_entry_state(entry["id"], FAILED, e.strerror or str(e))
+                continue
+            self.active_transfers[entry["id"]] = TransferProgress(size)
+            self.set_entry_state(entry["id"], RUNNING)
+            self.pool.submit('store_dir' if is_dir else 'store', job_id=entry["id"], file_path=source,
+                             rate_limit=self.entry_rate_limit(entry),
+                             filename=os.path.basename(entry["target"]), store=self.store,
+                             compression="auto" if self.compress_check.isChecked() else None,
+                             keys=self.keys if entry.get("encrypt") else None,
+                             on_record=partial(self.remember_record, entry["id"]))
+            free_slots -= 1
+        self.refresh_progress()
+
+    def shutdown(self):
+        """Cancel running transfers and save the queue; they are queued again next session"""
+        self._shutting_down = True  # the cancelled jobs' completions must not start new ones
+        self.save_timer.stop()
+        self.pool.shutdown()
+        for entry_id in self.active_transfers:
+            self.queue.set_state(entry_id, QUEUED)  # interrupted, not failed
+        self.active_transfers.clear()
+        self.queue.save()
+
+    def ask_passkey(self) -> bool:
+        """Make sure the session has a passkey; asks again only after it expired"""
+        if not self.keys.unlocked:
+            passkey, ok = QInputDialog.getText(self, "Encryption", "Passkey:", QLineEdit.Password)
+            if ok and passkey:
+                self.keys.unlock(passkey)
+        return self.keys.unlocked
+
+    def remember_record(self, entry_id, record):
+        """Runs on the worker thread; the completion signal is delivered after it"""
+        self.sent_digests[entry_id] = record["digest"]
+
+    def entry_rate_limit(self, entry):
+        """Bytes per second for an entry: its own cap, else the per-transfer default"""
+        mb_per_second = entry.get("rate_limit") or self.transfer_limit_spin.value()
+        return mb_per_second * MB if mb_per_second else None
+
+    def apply_global_limit(self, mb_per_second):
+        self.pool.bandwidth.set_global_rate(mb_per_second * MB if mb_per_second else None)
+
+    def apply_transfer_limit(self, mb_per_second):
+        """New default cap; running transfers without their own cap follow it"""
+        for job_id in self.active_transfers:
+            entry = self.queue.get(job_id)
+            if entry and not entry.get("rate_limit"):
+                self.pool.set_rate_limit(job_id, self.entry_rate_limit(entry))
+
+    def show_entry_menu(self, position):
+        item = self.file_list.itemAt(position)
+        entry = self.queue.get(item.data(Qt.UserRole)) if item else None
+        if entry is None or entry["state"] not in (QUEUED, RUNNING):
+            return
+        menu = QMenu(self)
+        limit_action = menu.addAction("Set speed limit...")
+        if menu.exec_(self.file_list.mapToGlobal(position)) == limit_action:
+            self.set_entry_limit(entry)
+
+    def set_entry_limit(self, entry):
+        value, ok = QInputDialog.getDouble(
+            self, "Speed Limit",
+            f"Max speed for {os.path.basename(entry['source'])} in MB/s (0 = default):",
+            entry.get("rate_limit") or 0, 0, 10000, 1
+        )
+        if not ok:
+            return
+        entry["rate_limit"] = value or None
+        self.schedule_save()
+        if entry["id"] in self.active_transfers:
+            self.pool.set_rate_limit(entry["id"], self.entry_rate_limit(entry))
+        self.update_queue_item(entry)
+
+    def on_transfer_progress(self, job_id, done, total):
+        """Byte counts reported by a background worker"""
+        if job_id in self.active_transfers:
+            self.active_transfers[job_id].update(done)
+            self.refresh_progress()
+
+    def on_transfer_completed(self, job_id, success, message):
+        if self._shutting_down:
+            return
+        if job_id in self.exports:
+            self.on_export_completed(self.exports.pop(job_id), success, message)
+            return
+        stats = self.active_transfers.pop(job_id, None)
+        digest = self.sent_digests.pop(job_id, None)
+        if stats is None or self.queue.get(job_id) is None:
+            return
+        if success:
+            self.queue.get(job_id)["digest"] = digest
+            rate = format_rate(stats.done / max(stats.elapsed, 1e-6))
+            self.set_entry_state(job_id, DONE, f"{format_size(stats.done)}, {rate}, {message}")
         else:
-            self.timer.stop()
-            # Simulate "saving" sent file to local folder
-            filename = os.path.basename(self.selected_file)
-            target_path = os.path.join(self.transfer_folder, filename)
-            with open(self.selected_file, "rb") as src, open(target_path, "wb") as dst:
-                dst.write(src.read())
-
-            self.file_list.addItem(f"Sent: {filename}")
-            self.selected_file = None
+            self.set_entry_state(job_id, FAILED, message)
+        self.dispatch_queue()
+        if not self.active_transfers:
+            self.queue.save()
+            self.report_batch()
+
+    def report_batch(self):
+        """One summary once the queue drains, instead of a dialog per file"""
+        failed = self.queue.count(FAILED)
+        if failed:
+            QMessageBox.warning(
+                self, "Transfers Finished",
+                f"{self.queue.count(DONE)} sent, {failed} failed.\nSee the queue for details."
+            )
+
+    def export_entry(self, item):
+        """Save a copy of a sent file: straight from its source while that is unchanged, else out of the store"""
+        entry = self.queue.get(item.data(Qt.UserRole))
+        if entry is None or entry["state"] != DONE:
+            return
+        name = os.path.basename(entry["target"])
+        if entry.get("encrypt") and not self.ask_passkey():
+            return
+        save_path, _ = QFileDialog.getSaveFileName(self, "Save Sent File", name)
+        if not save_path:
+            return
+        if (not entry.get("encrypt") and entry.get("digest")
+                and self.store.source_digest(entry["source"]) == entry["digest"]):
+            # A local copy: kernel copy or delta, and resumable, with no chunks to reassemble
+            job_id = self.pool.submit('copy', file_path=entry["source"], target_path=save_path)
+        else:
+            job_id = self.pool.submit('export', filename=name, save_path=save_path, store=self.store,
+                                      digest=entry.get("digest"),
+                                      keys=self.keys if entry.get("encrypt") else None)
+        self.exports[job_id] = name
+
+    def on_export_completed(self, name, success, message):
+        if success:
+            QMessageBox.information(self, "Saved", f"{name} saved to:\n{message}")
+        else:
+            QMessageBox.critical(self, "Error", f"Failed to save {name}:\n{message}")
+
+    def add_queue_item(self, entry):
+        item = QListWidgetItem()
+        item.setData(Qt.UserRole, entry["id"])
+        self.queue_items[entry["id"]] = item
+        self.file_list.addItem(item)
+        self.update_queue_item(entry)
+
+    def update_queue_item(self, entry):
+        text = f"{STATE_LABELS[entry['state']]}: {os.path.basename(entry['source'])}"
+        if entry["message"]:
+            text += f" ({entry['message']})"
+        if entry.get("rate_limit") and entry["state"] in (QUEUED, RUNNING):
+            text += f" [≤ {entry['rate_limit']:g} MB/s]"
+        item = self.queue_items[entry["id"]]
+        item.setText(text)
+        tooltip = entry["source"]
+        if entry.get("digest"):
+            tooltip += f"\nSHA-256: {entry['digest']}"
+        item.setToolTip(tooltip)
+
+    def set_entry_state(self, entry_id, state, message=""):
+        self.update_queue_item(self.queue.set_state(entry_id, state, message))
+        self.schedule_save()
+
+    def schedule_save(self):
+        if not self.save_timer.isActive():
+            self.save_timer.start(QUEUE_SAVE_DELAY_MS)
+
+    def clear_finished(self):
+        for entry in self.queue.clear_finished():
+            item = self.queue_items.pop(entry["id"])
+            self.file_list.takeItem(self.file_list.row(item))
+        self.queue.save()
+
+    def refresh_progress(self):
+        """Show combined progress of every running transfer"""
+        if not self.active_transfers:
+            self.progress.setRange(0, 100)
             self.progress.setValue(0)
-            QMessageBox.information(self, "Success", f"File sent and saved to:\n{target_path}")
+            self.progress.setFormat("%p%")
+            return
+        stats = list(self.active_transfers.values())
+        sized = [s for s in stats if s.total is not None]
+        total = sum(s.total for s in sized)
+        done = sum(s.done for s in sized)
+        rate = sum(s.rate for s in stats)
+        if len(sized) < len(stats) and not total:
+            self.progress.setRange(0, 0)  # only archives of unknown size running: busy indicator
+        else:
+            self.progress.setRange(0, 100)
+            self.progress.setValue(int(done * 100 / total) if total else 100)
+        text = f"%p%  •  {format_rate(rate)}"
+        waiting = self.queue.count(QUEUED)
+        if len(stats) > 1 or waiting:
+            text += f"  •  {len(stats)} running, {waiting} queued"
+        elif stats[0].eta is not None:
+            text = f"%p%  •  {stats[0].summary()}"
+        self.progress.setFormat(text)
 
     def open_folder(self):
         """Open the transfer folder in file explorer"""